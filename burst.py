@@ -0,0 +1,93 @@
+"""
+burst.py
+
+Szybka seria klatek (burst) zapisywana prosto do pliku.
+BurstRecorder alokuje z góry tablicę .npy na dysku (numpy.memmap,
+kształt klatki x Y x X) i wątek akwizycji kamery kopiuje do niej każdą
+klatkę z bufora SDK - bez puli, kolejki zapisu i wątku GUI. Numery klatek,
+czasy odbioru i znaczniki czasu sensora trafiają do opisu <plik>.json razem
+z lukami w numeracji SDK (klatki utracone przez kamerę).
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+
+class BurstRecorder:
+    """Seria `frame_count` kolejnych klatek w jednym pliku .npy (memmap)."""
+
+    def __init__(self, file_path, frame_count, height, width, dtype=np.uint16):
+        self.file_path = file_path
+        self.metadata_path = os.path.splitext(file_path)[0] + ".json"
+        self.frame_count = frame_count
+        # Plik alokowany w całości przed startem - zapis klatki to jedna kopia do mapowanej pamięci
+        self._frames = np.lib.format.open_memmap(
+            file_path, mode='w+', dtype=dtype, shape=(frame_count, height, width)
+        )
+        self._flat = self._frames.reshape(frame_count, -1)
+        self.frame_numbers = np.zeros(frame_count, dtype=np.int64)
+        self.timestamps = np.zeros(frame_count, dtype=np.float64)          # perf_counter odbioru [s]
+        self.sensor_timestamps_ns = np.full(frame_count, -1, dtype=np.int64)  # Znacznik kamery (-1 = brak)
+        self.recorded = 0
+        self.dropped_sdk = 0
+        self.gaps = []        # (numer klatki przed luką, liczba utraconych)
+        self.exposure_us = 0
+        self.gain_db = 0.0
+        self.started_at = time.perf_counter()
+        self.stopped = False
+
+    def is_complete(self):
+        return self.recorded >= self.frame_count
+
+    def add(self, frame, arrival):
+        """Kopiuje klatkę SDK do kolejnego miejsca w pliku. Zwraca True po ostatniej."""
+        index = self.recorded
+        np.copyto(self._flat[index], frame.image_buffer)
+        if index > 0:
+            missing = frame.frame_count - int(self.frame_numbers[index - 1]) - 1
+            if missing > 0:
+                self.dropped_sdk += missing
+                self.gaps.append((int(self.frame_numbers[index - 1]), missing))
+        self.frame_numbers[index] = frame.frame_count
+        self.timestamps[index] = arrival
+        sensor_ns = getattr(frame, "time_stamp_relative_ns_or_null", None)
+        if sensor_ns is not None:
+            self.sensor_timestamps_ns[index] = sensor_ns
+        self.recorded += 1
+        return self.is_complete()
+
+    def summary(self):
+        """Opis serii: liczba klatek, czas trwania, częstotliwość i utracone klatki."""
+        recorded = self.recorded
+        duration_s = float(self.timestamps[recorded - 1] - self.timestamps[0]) if recorded > 1 else 0.0
+        return {
+            "file": os.path.basename(self.file_path),
+            "requested_frames": self.frame_count,
+            "recorded_frames": recorded,
+            "stopped": self.stopped,
+            "exposure_us": self.exposure_us,
+            "gain_db": self.gain_db,
+            "duration_s": round(duration_s, 6),
+            "fps": round((recorded - 1) / duration_s, 3) if duration_s > 0 else None,
+            "dropped_sdk": self.dropped_sdk,
+            "gaps": [{"after_frame": after, "missing": missing} for after, missing in self.gaps],
+        }
+
+    def close(self):
+        """Zamyka plik i zapisuje opis serii (numery klatek i czasy) do <plik>.json."""
+        recorded = self.recorded
+        metadata = self.summary()
+        metadata["frame_numbers"] = self.frame_numbers[:recorded].tolist()
+        metadata["timestamps_s"] = np.round(self.timestamps[:recorded] - self.timestamps[0], 6).tolist() if recorded else []
+        sensor = self.sensor_timestamps_ns[:recorded]
+        if recorded and sensor[0] >= 0:
+            metadata["sensor_timestamps_s"] = np.round((sensor - sensor[0]) / 1e9, 6).tolist()
+        # Bez flush(): strony zapisze system, wątek akwizycji nie czeka na dysk
+        self._flat = None
+        self._frames = None
+        with open(self.metadata_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=4, ensure_ascii=False)
+        return metadata
@@ -1,9 +1,8 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import cv2
-import numpy as np
 import os
-import json
+
+from calibration_engine import CalibrationEngine, save_config
 
 
 class CalibrationApp:
@@ -24,6 +23,11 @@ class CalibrationApp:
         # Przechowywanie referencji do widgetów wierszy
         self.rows = []
 
+        # Obliczenia w puli wątków; wynik odbierany w wątku Tk (root.after)
+        self.engine = CalibrationEngine()
+        self.poll_interval_ms = 50
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self._build_ui()
 
     def _build_ui(self):
@@ -33,13 +37,15 @@ class CalibrationApp:
         header_frame.pack(pady=10)
         tk.Label(header_frame, text="Konfiguracja Koła Filtrów", font=("Arial", 16, "bold")).pack()
         tk.Label(header_frame, text="Wprowadź dane kalibracyjne dla każdego filtra.").pack()
+        tk.Label(header_frame, text="Kilka zdjęć filtra (różne ekspozycje): czasy w kolejności alfabetycznej plików, "
+                                    "oddzielone średnikami, np. 5; 10; 20.", fg="gray").pack()
 
         # Ramka na tabelę filtrów
         self.scroll_frame = tk.Frame(self.root)
         self.scroll_frame.pack(fill="both", expand=True, padx=10)
 
         # Nagłówki tabeli
-        headers = ["Poz.", "Nazwa Filtra", "Pusty?", "Plik Kalibracyjny", "Czas (ms)", "Referencja"]
+        headers = ["Poz.", "Nazwa Filtra", "Pusty?", "Pliki Kalibracyjne", "Czasy (ms)", "Referencja"]
         for idx, text in enumerate(headers):
             lbl = tk.Label(self.scroll_frame, text=text, font=("Arial", 10, "bold"))
             lbl.grid(row=0, column=idx, padx=5, pady=5)
@@ -51,8 +57,11 @@ class CalibrationApp:
         # Przycisk akcji
         action_frame = tk.Frame(self.root)
         action_frame.pack(pady=20)
-        tk.Button(action_frame, text="ZAPISZ KONFIGURACJĘ", command=self.calculate_and_save,
-                  bg="#4CAF50", fg="white", font=("Arial", 12, "bold"), height=2, width=25).pack()
+        self.save_button = tk.Button(action_frame, text="ZAPISZ KONFIGURACJĘ", command=self.calculate_and_save,
+                                     bg="#4CAF50", fg="white", font=("Arial", 12, "bold"), height=2, width=25)
+        self.save_button.pack()
+        self.status_label = tk.Label(action_frame, text="")
+        self.status_label.pack(pady=5)
 
     def _create_filter_row(self, index):
         """Tworzy pojedynczy wiersz tabeli dla danego filtra."""
@@ -85,7 +94,7 @@ class CalibrationApp:
         path_var = tk.StringVar()
 
         # 5. Czas ekspozycji
-        entry_time = tk.Entry(self.scroll_frame, width=10)
+        entry_time = tk.Entry(self.scroll_frame, width=16)
         entry_time.grid(row=row_idx, column=4, padx=5)
 
         # 6. Wybór referencji
@@ -100,6 +109,7 @@ class CalibrationApp:
             "lbl_file": lbl_file,
             "btn_browse": btn_browse,
             "path_var": path_var,
+            "paths": [],
             "entry_time": entry_time,
             "rb_ref": rb_ref
         })
@@ -119,6 +129,7 @@ class CalibrationApp:
             row["rb_ref"].config(state="disabled")
             row["lbl_file"].config(text="Niedostępne", fg="gray")
             row["path_var"].set("")
+            row["paths"] = []
 
             if self.ref_var.get() == index:
                 self.ref_var.set(-1)
@@ -132,119 +143,104 @@ class CalibrationApp:
             row["lbl_file"].config(text="Brak pliku", fg="red")
 
     def browse_file(self, index):
-        """Otwiera okno wyboru pliku dla danego wiersza."""
-        filename = filedialog.askopenfilename(
-            title=f"Wybierz zdjęcie bieli dla poz. {index + 1}",
+        """Otwiera okno wyboru plików (jednego lub kilku ekspozycji) dla danego wiersza."""
+        filenames = filedialog.askopenfilenames(
+            title=f"Wybierz zdjęcia bieli dla poz. {index + 1}",
             filetypes=[("TIFF Images", "*.tif *.tiff"), ("All Files", "*.*")]
         )
-        if filename:
+        if filenames:
             row = self.rows[index]
-            row["path_var"].set(filename)
-            short_name = os.path.basename(filename)
-            if len(short_name) > 15:
-                short_name = short_name[:12] + "..."
+            row["paths"] = sorted(filenames)
+            row["path_var"].set(row["paths"][0])
+            if len(row["paths"]) > 1:
+                short_name = f"{len(row['paths'])} pliki"
+            else:
+                short_name = os.path.basename(row["paths"][0])
+                if len(short_name) > 15:
+                    short_name = short_name[:12] + "..."
             row["lbl_file"].config(text=short_name, fg="green")
 
-    def process_image(self, path, current_time):
-        """Analizuje obraz i oblicza optymalny czas naświetlania."""
-        try:
-            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-            if img is None:
-                return None
-
-            if len(img.shape) == 3:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-            h, w = img.shape
-            cy, cx = h // 2, w // 2
-            oy = int(h * self.roi_factor / 2)
-            ox = int(w * self.roi_factor / 2)
-
-            roi = img[cy - oy:cy + oy, cx - ox:cx + ox]
-            mean_val = np.mean(roi)
-            if mean_val < 1:
-                mean_val = 1
-
-            target_val = self.bit_depth * self.target_percent
-            opt_time = current_time * (target_val / mean_val)
-            return opt_time
-
-        except Exception as e:
-            print(f"Błąd przetwarzania {path}: {e}")
-            return None
+    @staticmethod
+    def parse_times(text):
+        """Czasy ekspozycji z pola wiersza ("10" lub "5; 10; 20"). ValueError przy błędzie."""
+        return [float(value) for value in text.replace(";", " ").split()]
 
     def calculate_and_save(self):
-        """Główna logika obliczania współczynników i zapisu konfiguracji."""
+        """Zbiera dane filtrów i zleca obliczenia w tle (okno pozostaje responsywne)."""
         ref_idx = self.ref_var.get()
 
         if ref_idx == -1:
             messagebox.showerror("Błąd", "Musisz wybrać filtr referencyjny!")
             return
 
-        # 1. Przetwarzanie filtra referencyjnego
+        # 1. Sprawdzenie filtra referencyjnego
         ref_row = self.rows[ref_idx]
-        ref_path = ref_row["path_var"].get()
+        ref_paths = ref_row["paths"]
 
-        if not ref_path or not os.path.exists(ref_path):
+        if not ref_paths or not all(os.path.exists(path) for path in ref_paths):
             messagebox.showerror("Błąd", f"Brak poprawnego zdjęcia dla referencji (Poz. {ref_idx + 1})")
             return
 
         try:
-            ref_time_input = float(ref_row["entry_time"].get())
+            if not self.parse_times(ref_row["entry_time"].get()):
+                raise ValueError
         except ValueError:
             messagebox.showerror("Błąd", "Niepoprawny czas ekspozycji dla referencji.")
             return
 
-        ref_opt_time = self.process_image(ref_path, ref_time_input)
-        if ref_opt_time is None:
-            messagebox.showerror("Błąd", "Nie udało się przetworzyć zdjęcia referencyjnego.")
-            return
-
-        # 2. Generowanie danych dla wszystkich filtrów
-        filters_output = []
-
+        # 2. Dane wszystkich filtrów (brakujące dane zgłosi silnik jako ostrzeżenia)
+        filters = []
         for row in self.rows:
-            idx = row["index"]
-            position = idx + 1
-            is_empty = row["is_empty_var"].get()
-            name = row["entry_name"].get()
-
-            filter_data = {
+            position = row["index"] + 1
+            entry = {
                 "position": position,
-                "name": name,
-                "exposure_multiplier": 1.0
+                "name": row["entry_name"].get(),
+                "empty": row["is_empty_var"].get(),
             }
+            paths = row["paths"]
+            time_str = row["entry_time"].get()
+            if not entry["empty"] and paths and time_str.strip():
+                try:
+                    times = self.parse_times(time_str)
+                except ValueError:
+                    messagebox.showerror("Błąd", f"Błędny czas dla filtru {position}")
+                    return
+                if len(times) != len(paths):
+                    messagebox.showerror("Błąd", f"Filtr {position}: {len(paths)} plików, a {len(times)} czasów.")
+                    return
+                entry["images"] = [{"path": path, "exposure_ms": t} for path, t in zip(paths, times)]
+            filters.append(entry)
+
+        # 3. Obliczenia w tle - wszystkie filtry równolegle
+        self.save_button.config(state="disabled")
+        self.status_label.config(text="Obliczanie...")
+        future = self.engine.calibrate_async(
+            filters, ref_idx + 1, roi_factor=self.roi_factor,
+            bit_depth=self.bit_depth, target_percent=self.target_percent
+        )
+        self.root.after(self.poll_interval_ms, self._poll_calibration, future)
 
-            if is_empty:
-                filter_data["exposure_multiplier"] = 0.1
-                filter_data["name"] = "Pusty"
-            elif idx == ref_idx:
-                filter_data["exposure_multiplier"] = 1.0
-                filter_data["name"] += " (Ref)"
-            else:
-                path = row["path_var"].get()
-                time_str = row["entry_time"].get()
-
-                if not path or not time_str:
-                    messagebox.showwarning(
-                        "Uwaga",
-                        f"Filtr {position}: brak danych. Ustawiono mnożnik x1.0."
-                    )
-                else:
-                    try:
-                        curr_time = float(time_str)
-                        opt_time = self.process_image(path, curr_time)
-                        if opt_time:
-                            multiplier = opt_time / ref_opt_time
-                            filter_data["exposure_multiplier"] = round(multiplier, 4)
-                    except ValueError:
-                        messagebox.showerror("Błąd", f"Błędny czas dla filtru {position}")
-                        return
-
-            filters_output.append(filter_data)
-
-        # 3. Zapis pliku
-        final_json = {"filters": filters_output}
+    def _poll_calibration(self, future):
+        """Odbiera wynik w wątku Tk (widgety Tk nie mogą być zmieniane z puli wątków)."""
+        if not future.done():
+            self.root.after(self.poll_interval_ms, self._poll_calibration, future)
+            return
+
+        self.save_button.config(state="normal")
+        try:
+            result = future.result()
+        except Exception as e:
+            self.status_label.config(text="")
+            messagebox.showerror("Błąd", str(e))
+            return
+
+        self.status_label.config(text=f"Obliczono mnożniki dla {len(result['filters'])} pozycji.")
+        for warning in result["warnings"]:
+            messagebox.showwarning("Uwaga", warning)
+        self.save_config(result["filters"])
+
+    def save_config(self, filters):
+        """Zapis pliku konfiguracji wskazanego przez użytkownika."""
         save_path = filedialog.asksaveasfilename(
             defaultextension=".json",
             initialfile="config.json",
@@ -253,12 +249,14 @@ class CalibrationApp:
 
         if save_path:
             try:
-                with open(save_path, 'w', encoding='utf-8') as f:
-                    json.dump(final_json, f, indent=4, ensure_ascii=False)
+                save_config(save_path, filters)
                 messagebox.showinfo("Sukces", f"Zapisano konfigurację:\n{save_path}")
             except Exception as e:
                 messagebox.showerror("Błąd zapisu", str(e))
 
+    def on_close(self):
+        self.engine.shutdown()
+        self.root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,438 @@
+"""
+calibration_engine.py
+
+Obliczenia kalibracji filtrów bez GUI (używane przez calibration.py
+i dostępne ze skryptów).
+
+Z każdego zdjęcia bieli potrzebny jest tylko środkowy wycinek (ROI,
+roi_factor boku obrazu), więc z pliku TIFF dekodowana jest wyłącznie ta
+część: nieskompresowany obraz mapowany jest w pamięci (numpy.memmap),
+a w skompresowanym dekodowane są tylko paski (strips) lub kafelki (tiles)
+przecinające ROI. Filtry przetwarzane są równolegle w puli wątków
+(dekodowanie i numpy zwalniają GIL).
+
+Filtr może mieć kilka zdjęć z różnymi ekspozycjami: dla wszystkich filtrów
+naraz (tablice filtry x punkty) dopasowywana jest metodą najmniejszych
+kwadratów prosta średnia = offset + nachylenie * ekspozycja, z pominięciem
+punktów nasyconych i odstających od prostej (flagi w wyniku). Ekspozycja
+optymalna wynika z modelu, a nie z proporcji jednego zdjęcia, więc
+poziom czerni i słabe filtry nie zaniżają mnożników. Model trafia do
+config.json (pole "linearity" filtra).
+
+save_config() zapisuje config.json atomowo (plik tymczasowy + os.replace),
+więc przerwany zapis nie zostawia uszkodzonej konfiguracji. Z klatek
+kamery (kalibracja na żywo, live_calibration.py) korzysta image_roi_mean().
+
+Przykład użycia ze skryptu:
+
+    from calibration_engine import calibrate
+    config = calibrate([
+        {"position": 1, "name": "675 nm", "images": [
+            {"path": "biel_675_6ms.tif", "exposure_ms": 6.0},
+            {"path": "biel_675_12ms.tif", "exposure_ms": 12.0},
+        ]},
+        {"position": 5, "name": "550 nm", "path": "biel_550.tif", "exposure_ms": 8.0},
+        {"position": 8, "empty": True},
+    ], reference_position=5)
+"""
+
+import concurrent.futures
+import json
+import os
+import stat
+import tempfile
+
+import numpy as np
+
+BIT_DEPTH = 65535          # Głębia 16-bit
+TARGET_PERCENT = 0.8       # Docelowa średnia ROI jako ułamek zakresu
+ROI_FACTOR = 0.2           # Bok ROI jako ułamek boku obrazu
+EMPTY_MULTIPLIER = 0.1     # Mnożnik dla pozycji bez filtra
+SATURATION_FRACTION = 0.98     # Próg nasycenia piksela jako ułamek zakresu
+SATURATED_PIXELS = 0.001       # Punkt kalibracji nasycony, gdy ROI ma więcej nasyconych pikseli
+NONLINEARITY_TOLERANCE = 0.03  # Względne odchylenie punktu od prostej uznane za nieliniowość
+
+# Wagi luminancji jak w cv2.COLOR_BGR2GRAY (kolejność R, G, B)
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+
+def roi_bounds(height, width, roi_factor=ROI_FACTOR):
+    """Granice (y0, y1, x0, x1) środkowego ROI - jak w dotychczasowym kalibratorze."""
+    cy, cx = height // 2, width // 2
+    oy = int(height * roi_factor / 2)
+    ox = int(width * roi_factor / 2)
+    return cy - oy, cy + oy, cx - ox, cx + ox
+
+
+def _to_gray(roi, channel_axis=-1, bgr=False):
+    """Obraz wielokanałowy -> jasność (wagi BT.601); obraz 2-D bez zmian."""
+    if roi.ndim == 2:
+        return roi
+    roi = np.moveaxis(roi, channel_axis, -1)[..., :3]
+    weights = _GRAY_WEIGHTS[::-1] if bgr else _GRAY_WEIGHTS
+    return roi @ weights
+
+
+def _read_tiff_roi(path, roi_factor):
+    import tifffile
+
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        y0, y1, x0, x1 = roi_bounds(page.imagelength, page.imagewidth, roi_factor)
+        if page.is_memmappable:
+            # Nieskompresowane dane ciągłe - system wczyta tylko strony pamięci z ROI
+            image = tifffile.memmap(path, page=0, mode='r')
+            if image.ndim == 3 and page.planarconfig == 2:
+                # Kanały w osobnych płaszczyznach (próbka, Y, X)
+                return _to_gray(np.array(image[:, y0:y1, x0:x1]), channel_axis=0)
+            return _to_gray(np.array(image[y0:y1, x0:x1]))
+        return _decode_roi_segments(tif, page, y0, y1, x0, x1)
+
+
+def _decode_roi_segments(tif, page, y0, y1, x0, x1):
+    """Dekoduje tylko paski/kafelki przecinające ROI (obraz skompresowany)."""
+    separate, _, length, width, contig = page.shaped
+    out = np.zeros((separate, y1 - y0, x1 - x0, contig), dtype=page.dtype)
+
+    if page.is_tiled:
+        seg_h, seg_w = page.tilelength, page.tilewidth
+    else:
+        seg_h, seg_w = page.rowsperstrip or length, width
+    rows = -(-length // seg_h)
+    cols = -(-width // seg_w)
+    per_plane = rows * cols
+
+    fh = tif.filehandle
+    jpegtables = getattr(page, "jpegtables", None)
+    for sample in range(separate):
+        for row in range(y0 // seg_h, (y1 - 1) // seg_h + 1):
+            for col in range(x0 // seg_w, (x1 - 1) // seg_w + 1):
+                index = sample * per_plane + row * cols + col
+                bytecount = page.databytecounts[index]
+                if not bytecount:
+                    continue  # Pusty segment - zera
+                fh.seek(page.dataoffsets[index])
+                data = fh.read(bytecount)
+                segment, indices, _ = page.decode(data, index, jpegtables=jpegtables)
+                if segment is None:
+                    continue
+                seg_y, seg_x = indices[2], indices[3]
+                segment = segment[0]   # (długość, szerokość, próbki) - głębia 1
+                sy0, sy1 = max(y0, seg_y), min(y1, seg_y + segment.shape[0])
+                sx0, sx1 = max(x0, seg_x), min(x1, seg_x + segment.shape[1])
+                if sy0 >= sy1 or sx0 >= sx1:
+                    continue
+                out[sample, sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = \
+                    segment[sy0 - seg_y:sy1 - seg_y, sx0 - seg_x:sx1 - seg_x]
+
+    if separate > 1:
+        return _to_gray(out[..., 0], channel_axis=0)
+    if contig > 1:
+        return _to_gray(out[0])
+    return out[0, ..., 0]
+
+
+def read_roi(path, roi_factor=ROI_FACTOR):
+    """Środkowe ROI obrazu w skali szarości (TIFF - dekodowane tylko ROI)."""
+    if os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        return _read_tiff_roi(path, roi_factor)
+
+    # Inne formaty - pełny odczyt przez OpenCV
+    import cv2
+
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise IOError(f"Nie można odczytać obrazu {path}")
+    y0, y1, x0, x1 = roi_bounds(image.shape[0], image.shape[1], roi_factor)
+    return _to_gray(image[y0:y1, x0:x1], bgr=True)
+
+
+def roi_stats(roi, bit_depth=BIT_DEPTH, saturation_fraction=SATURATION_FRACTION):
+    """(średnia, ułamek nasyconych pikseli) wycinka ROI."""
+    mean_value = float(np.mean(roi, dtype=np.float64))
+    saturated = float(np.count_nonzero(roi >= saturation_fraction * bit_depth)) / roi.size
+    return mean_value, saturated
+
+
+def image_roi_stats(image, roi_factor=ROI_FACTOR, bit_depth=BIT_DEPTH):
+    """roi_stats() dla obrazu w pamięci (np. klatki z kamery)."""
+    y0, y1, x0, x1 = roi_bounds(image.shape[0], image.shape[1], roi_factor)
+    return roi_stats(_to_gray(image[y0:y1, x0:x1]), bit_depth)
+
+
+def image_roi_mean(image, roi_factor=ROI_FACTOR):
+    """Średnia jasność ROI obrazu w pamięci (co najmniej 1)."""
+    return max(image_roi_stats(image, roi_factor)[0], 1.0)
+
+
+def roi_mean(path, roi_factor=ROI_FACTOR):
+    """Średnia jasność ROI (co najmniej 1, jak w dotychczasowym kalibratorze)."""
+    mean_value = float(np.mean(read_roi(path, roi_factor), dtype=np.float64))
+    return max(mean_value, 1.0)
+
+
+def optimal_exposure(mean_value, exposure_ms, bit_depth=BIT_DEPTH, target_percent=TARGET_PERCENT):
+    """Czas naświetlania, przy którym średnia ROI osiągnie target_percent zakresu."""
+    return exposure_ms * (bit_depth * target_percent / max(mean_value, 1.0))
+
+
+# ---------------------------------------------------
+# Model liniowości: średnia ROI = offset + slope * ekspozycja
+# ---------------------------------------------------
+def _least_squares(exposures, means, used):
+    """Prosta (offset, slope) dla każdego wiersza z punktów `used` - sumy zamiast pętli po filtrach."""
+    t = np.where(used, exposures, 0.0)
+    m = np.where(used, means, 0.0)
+    n = used.sum(axis=1).astype(np.float64)
+    st, sm = t.sum(axis=1), m.sum(axis=1)
+    stt, stm = (t * t).sum(axis=1), (t * m).sum(axis=1)
+    det = n * stt - st * st
+    # Dwie różne ekspozycje wyznaczają offset; jedna - prosta przez zero (jak dotąd)
+    two_points = det > 1e-9 * np.maximum(stt, 1.0) * np.maximum(n, 1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(two_points, (n * stm - st * sm) / np.where(two_points, det, 1.0), sm / st)
+        offset = np.where(two_points, (sm - slope * st) / n, 0.0)
+    return offset, slope, two_points
+
+
+def _fit_residuals(t, m, used):
+    """Prosta z punktów `used` i odchylenia wszystkich punktów względem największej średniej filtra."""
+    offset, slope, two_points = _least_squares(t, m, used)
+    predicted = offset[:, None] + slope[:, None] * t
+    # Odchylenie jak nieliniowość podawana w "% zakresu" pomiaru
+    scale = np.max(np.where(used, np.abs(m), 0.0), axis=1, keepdims=True)
+    residual = (m - predicted) / np.maximum(scale, 1.0)
+    return offset, slope, two_points, residual
+
+
+def fit_linearity(exposures_ms, means, usable, tolerance=NONLINEARITY_TOLERANCE):
+    """
+    Dopasowanie średnia = offset + slope * ekspozycja dla wszystkich filtrów
+    naraz (tablice filtry x punkty, brakujące punkty NaN). usable - maska
+    punktów dopuszczonych do dopasowania (np. nienasyconych). Gdy punkt odbiega
+    od prostej o więcej niż `tolerance` największej średniej, odrzucany jest
+    ten punkt, bez którego prosta pasuje najlepiej (punkt odstający przesuwa
+    prostą, więc największa reszta nie zawsze go wskazuje) - po jednym na
+    filtr, dopóki zostają co najmniej 3 punkty.
+    Zwraca (offset, slope, two_points, used, residual).
+    """
+    t = np.asarray(exposures_ms, dtype=np.float64)
+    m = np.asarray(means, dtype=np.float64)
+    used = np.asarray(usable, dtype=bool) & np.isfinite(t) & np.isfinite(m)
+    filters, width = t.shape
+    for _ in range(width):
+        offset, slope, two_points, residual = _fit_residuals(t, m, used)
+        outliers = used & (np.abs(np.nan_to_num(residual)) > tolerance)
+        rows = np.flatnonzero(outliers.any(axis=1) & (used.sum(axis=1) >= 3))
+        if rows.size == 0:
+            break
+        # Wszystkie warianty "bez punktu k" jako jedna tablica (filtry * punkty) x punkty
+        candidates = used[rows, None, :] & ~np.eye(width, dtype=bool)
+        shape = (rows.size * width, width)
+        _, _, _, candidate_residual = _fit_residuals(
+            np.repeat(t[rows, None, :], width, axis=1).reshape(shape),
+            np.repeat(m[rows, None, :], width, axis=1).reshape(shape),
+            candidates.reshape(shape),
+        )
+        worst = np.max(np.where(candidates.reshape(shape), np.abs(candidate_residual), 0.0), axis=1)
+        worst = np.where(used[rows].reshape(-1), worst, np.inf).reshape(rows.size, width)
+        used[rows, np.argmin(worst, axis=1)] = False
+    return offset, slope, two_points, used, residual
+
+
+def fit_filter_models(points, bit_depth=BIT_DEPTH, target_percent=TARGET_PERCENT,
+                      tolerance=NONLINEARITY_TOLERANCE):
+    """
+    Modele liniowości filtrów. points - lista (na filtr) list punktów
+    (ekspozycja ms, średnia ROI, ułamek nasyconych pikseli). Zwraca listę
+    słowników: offset, slope_per_ms, points, rms_residual, flags oraz
+    optimal_exposure_ms (None, gdy brak sygnału).
+    Flagi: saturated, nonlinear (punkty odrzucone), single_exposure
+    (bez wyznaczenia offsetu), no_signal.
+    """
+    width = max((len(p) for p in points), default=0)
+    shape = (len(points), max(width, 1))
+    exposures = np.full(shape, np.nan)
+    means = np.full(shape, np.nan)
+    saturated = np.zeros(shape, dtype=bool)
+    for row, filter_points in enumerate(points):
+        for col, (exposure_ms, mean_value, saturated_fraction) in enumerate(filter_points):
+            exposures[row, col] = exposure_ms
+            means[row, col] = mean_value
+            saturated[row, col] = (saturated_fraction > SATURATED_PIXELS
+                                   or mean_value >= SATURATION_FRACTION * bit_depth)
+
+    offset, slope, two_points, used, residual = fit_linearity(exposures, means, ~saturated, tolerance)
+    target = bit_depth * target_percent
+    models = []
+    for row, filter_points in enumerate(points):
+        flags = []
+        count = len(filter_points)
+        if saturated[row, :count].any():
+            flags.append("saturated")
+        if (~saturated[row, :count] & ~used[row, :count]).any():
+            flags.append("nonlinear")
+        n_used = int(used[row].sum())
+        signal = n_used > 0 and np.isfinite(slope[row]) and slope[row] > 0
+        if n_used and not two_points[row]:
+            flags.append("single_exposure")
+        if not signal:
+            flags.append("no_signal")
+        rms = float(np.sqrt(np.mean(residual[row][used[row]] ** 2))) if n_used else None
+        models.append({
+            "offset": round(float(offset[row]), 2) if n_used else None,
+            "slope_per_ms": round(float(slope[row]), 6) if n_used else None,
+            "points": n_used,
+            "rms_residual": round(rms, 5) if rms is not None else None,
+            "flags": flags,
+            "optimal_exposure_ms": round(float((target - offset[row]) / slope[row]), 4) if signal else None,
+        })
+    return models
+
+
+def _filter_images(entry):
+    """Zdjęcia filtra: lista "images" [{path, exposure_ms}] albo pojedyncze path/exposure_ms."""
+    if entry.get("images"):
+        return [image for image in entry["images"] if image.get("path") and image.get("exposure_ms") is not None]
+    if entry.get("path") and entry.get("exposure_ms") is not None:
+        return [{"path": entry["path"], "exposure_ms": entry["exposure_ms"]}]
+    return []
+
+
+def _measure(image, roi_factor, bit_depth):
+    """(ekspozycja, średnia ROI, ułamek nasyconych) dla zdjęcia lub (None, błąd)."""
+    try:
+        mean_value, saturated = roi_stats(read_roi(image["path"], roi_factor), bit_depth)
+    except Exception as e:
+        print(f"Błąd przetwarzania {image['path']}: {e}")
+        return None, str(e)
+    return (float(image["exposure_ms"]), mean_value, saturated), None
+
+
+def calibrate(filters, reference_position, roi_factor=ROI_FACTOR, bit_depth=BIT_DEPTH,
+              target_percent=TARGET_PERCENT, max_workers=None, executor=None):
+    """
+    Oblicza konfigurację filtrów (jak "Zapisz Konfigurację" w kalibratorze).
+    filters - lista słowników: position, name, empty (opcjonalnie) oraz
+    images (lista {path, exposure_ms} - kilka ekspozycji) lub path/exposure_ms.
+    Dla każdego filtra dopasowywany jest model liniowości (fit_filter_models),
+    a mnożnik to stosunek ekspozycji optymalnych z modeli.
+    Zwraca {"filters": [...], "warnings": [...]}; wpisy "filters" mają postać
+    config.json (z polem "linearity"). ValueError, gdy referencji nie da się wyznaczyć.
+    """
+    reference = next((f for f in filters if f["position"] == reference_position), None)
+    if reference is None or reference.get("empty") or not _filter_images(reference):
+        raise ValueError(f"Brak poprawnego zdjęcia dla referencji (Poz. {reference_position})")
+
+    # Wszystkie zdjęcia wszystkich filtrów jako jedna lista zadań dla puli
+    tasks = [(f["position"], image) for f in filters if not f.get("empty") for image in _filter_images(f)]
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Calibration")
+    try:
+        measurements = list(executor.map(lambda task: _measure(task[1], roi_factor, bit_depth), tasks))
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    warnings = []
+    points = {}
+    for (position, image), (point, error) in zip(tasks, measurements):
+        if point is None:
+            warnings.append(f"Filtr {position}: błąd przetwarzania {os.path.basename(image['path'])} ({error}).")
+        else:
+            points.setdefault(position, []).append(point)
+
+    positions = sorted(points)
+    models = dict(zip(positions, fit_filter_models([points[p] for p in positions], bit_depth, target_percent)))
+    ref_model = models.get(reference_position)
+    if ref_model is None or ref_model["optimal_exposure_ms"] is None:
+        raise ValueError("Nie udało się wyznaczyć ekspozycji referencji "
+                         f"({', '.join(ref_model['flags']) if ref_model else 'brak danych'})")
+    ref_time = ref_model["optimal_exposure_ms"]
+
+    output = []
+    for entry in sorted(filters, key=lambda f: f["position"]):
+        position = entry["position"]
+        filter_data = {"position": position, "name": entry.get("name", f"Filtr {position}"),
+                       "exposure_multiplier": 1.0}
+        model = models.get(position)
+        if entry.get("empty"):
+            filter_data["exposure_multiplier"] = EMPTY_MULTIPLIER
+            filter_data["name"] = "Pusty"
+        elif model is None:
+            warnings.append(f"Filtr {position}: brak danych. Ustawiono mnożnik x1.0.")
+        elif model["optimal_exposure_ms"] is None:
+            warnings.append(f"Filtr {position}: brak sygnału w zdjęciach. Ustawiono mnożnik x1.0.")
+        else:
+            filter_data["exposure_multiplier"] = round(model["optimal_exposure_ms"] / ref_time, 4)
+        if position == reference_position:
+            filter_data["name"] += " (Ref)"
+        if model is not None:
+            filter_data["linearity"] = model
+            if "saturated" in model["flags"] or "nonlinear" in model["flags"]:
+                warnings.append(f"Filtr {position}: pominięto punkty nasycone lub nieliniowe "
+                                f"({', '.join(model['flags'])}).")
+        output.append(filter_data)
+    return {"filters": output, "warnings": warnings}
+
+
+def save_config(path, filters, calibration=None):
+    """
+    Zapisuje wpisy filtrów do config.json atomowo: pełny plik tymczasowy
+    w tym samym katalogu, fsync i os.replace. Pozostałe klucze istniejącego
+    pliku są zachowywane; calibration - opis przebiegu kalibracji (lub brak).
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except (OSError, ValueError):
+        data, mode = {}, 0o644
+    if not isinstance(data, dict):
+        data = {}
+    data["filters"] = filters
+    if calibration is not None:
+        data["calibration"] = calibration
+    else:
+        data.pop("calibration", None)  # Opis poprzedniej kalibracji byłby nieaktualny
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".config_", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class CalibrationEngine:
+    """
+    Pula wątków do kalibracji w tle. calibrate_async() zwraca Future
+    z wynikiem calibrate(); GUI odbiera go we własnym wątku (np. Tk: root.after).
+    """
+
+    def __init__(self, max_workers=None):
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="Calibration"
+        )
+        # Osobny wątek koordynujący - czeka na pomiary z puli, nie zajmując jej
+        self._coordinator = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def calibrate_async(self, filters, reference_position, **options):
+        """Future z wynikiem calibrate(filters, reference_position, **options)."""
+        return self._coordinator.submit(
+            calibrate, filters, reference_position, executor=self._pool, **options
+        )
+
+    def shutdown(self):
+        self._coordinator.shutdown(wait=False, cancel_futures=True)
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,283 @@
+"""
+cli.py
+
+Akwizycja bez GUI - do skryptów wsadowych i pomiarów przepustowości.
+Korzysta z tych samych elementów co main_app.py (RealCameraService,
+FilterWheelConnection, ScanScheduler, ImageSaveQueue), ale w pętli
+QCoreApplication, bez tworzenia widgetów:
+
+    python -m cli scan --bands 1,3,5 --base-exposure 10 --out wyniki
+    python -m cli scan --sim --frames 4 --format npy-cube
+    python -m cli scan --correction master_frames --correction-dtype uint16
+
+Komunikaty idą na stderr, a na stdout trafia jeden obiekt JSON
+z podsumowaniem skanu i czasami (start, kroki, zapis). Kod wyjścia
+0 oznacza kompletny skan.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import sys
+import time
+
+_process_start = time.perf_counter()
+
+from PySide6.QtCore import QCoreApplication, QObject, QThread, QTimer, Signal, Slot
+
+# Komunikaty wypisywane przy imporcie (np. brak SDK) też na stderr
+with contextlib.redirect_stdout(sys.stderr):
+    from saving import ImageSaveQueue, TiffCubeWriter, MemmapCubeWriter
+    from scan import ScanScheduler, parse_band_selection
+    from workers import RealCameraService, FilterWheelConnection
+    from exposure import AutoExposure
+    from correction import MasterFrames, FrameCorrector, DTYPE_FLOAT32, DTYPE_UINT16, describe_masters
+
+_imports_done = time.perf_counter()
+
+CUBE_FORMATS = {
+    "files": None,
+    "tiff-cube": TiffCubeWriter,
+    "npy-cube": MemmapCubeWriter,
+}
+
+
+def load_filter_config(path):
+    """Wpisy filtrów z config.json jako słownik pozycja -> wpis."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    return {item['position']: item for item in data['filters']}
+
+
+def _elapsed_ms(since):
+    return round((time.perf_counter() - since) * 1000, 1)
+
+
+class HeadlessScan(QObject):
+    """
+    Jeden skan bez GUI: uruchamia wątki kamery i koła, czeka na gotowość
+    obu, wykonuje skan i kończy po zapisaniu wszystkich pasm (output_written).
+    finished(kod wyjścia) emitowany jest raz, po zamknięciu sprzętu.
+    """
+    gain_requested = Signal(float)
+    finished = Signal(int)
+
+    def __init__(self, args, filter_config):
+        super().__init__()
+        self.args = args
+        self.filter_config = filter_config
+        self.result = {"command": "scan", "ok": False, "errors": []}
+        self.startup_ms = {"imports": round((_imports_done - _process_start) * 1000, 1)}
+        self.start_position = None
+        self.camera_ready = False
+        self.wheel_ready = False
+        self.scan_started = False
+        self._done = False
+
+        self.camera_sdk_factory = None
+        self.wheel_emulator = None
+        self.serial_port = args.port
+        if args.sim:
+            self._setup_simulation()
+
+        self.save_queue = ImageSaveQueue()
+        self.scan_scheduler = ScanScheduler(self.save_queue)
+        self.scan_scheduler.frames_per_band = args.frames
+        self.scan_scheduler.sigma_clip = 3.0 if args.sigma_clip else 0.0
+        self.scan_scheduler.save_variance = args.variance
+        if args.auto_exposure:
+            self.scan_scheduler.auto_exposure = AutoExposure(target_fraction=args.auto_exposure_target)
+        if args.correction:
+            masters = MasterFrames(args.correction)
+            print(f"Korekcja ({args.correction}): {describe_masters(masters)}")
+            self.scan_scheduler.corrector = FrameCorrector(masters, dtype=args.correction_dtype)
+        self.scan_scheduler.error.connect(self.on_error)
+        self.scan_scheduler.output_written.connect(self.on_output_written)
+
+        self.camera_thread = QThread()
+        self.camera_worker = RealCameraService(sdk_factory=self.camera_sdk_factory)
+        self.wheel_thread = QThread()
+        self.wheel_connection = FilterWheelConnection(
+            self.serial_port, args.baud, telemetry_decimation=args.telemetry
+        )
+
+    def _setup_simulation(self):
+        from simulation import SimulatedScene, SimulatedCameraSDK, Esp32Emulator
+
+        scene = SimulatedScene()
+        self.camera_sdk_factory = functools.partial(SimulatedCameraSDK, scene=scene)
+        self.wheel_emulator = Esp32Emulator(scene=scene)
+        self.serial_port = self.wheel_emulator.start()
+        print(f"Tryb symulacji: emulator koła na {self.serial_port}")
+
+    def start(self):
+        self._t_start = time.perf_counter()
+        self.save_queue.start()
+
+        # Kamera (jak FilterWheelApp.start_camera_service, bez podglądu)
+        self.camera_worker.moveToThread(self.camera_thread)
+        self.camera_worker.error.connect(self.on_error)
+        self.camera_worker.streaming_started.connect(self.on_camera_ready)
+        self.gain_requested.connect(self.camera_worker.set_gain)
+        self.scan_scheduler.exposure_requested.connect(self.camera_worker.set_exposure)
+        self.scan_scheduler.capture_requested.connect(self.camera_worker.request_capture)
+        self.scan_scheduler.stack_requested.connect(self.camera_worker.request_stack)
+        self.scan_scheduler.auto_exposed_requested.connect(self.camera_worker.request_auto_exposed)
+        self.scan_scheduler.capture_cancelled.connect(self.camera_worker.cancel_capture)
+        self.camera_worker.frame_captured.connect(self.scan_scheduler.on_frame_captured)
+        self.camera_thread.started.connect(self.camera_worker.start_streaming)
+
+        # Koło filtrów
+        self.wheel_connection.moveToThread(self.wheel_thread)
+        self.wheel_connection.error.connect(self.on_error)
+        self.wheel_connection.ready.connect(self.on_wheel_ready)
+        self.scan_scheduler.wheel_command_requested.connect(self.wheel_connection.send_command)
+        self.wheel_connection.serial_response.connect(self.scan_scheduler.on_wheel_response)
+        self.wheel_connection.move_completed.connect(self.scan_scheduler.on_wheel_move)
+        self.wheel_connection.error.connect(self.scan_scheduler.on_wheel_error)
+        self.wheel_thread.started.connect(self.wheel_connection.open)
+
+        self.camera_thread.start()
+        self.wheel_thread.start()
+        if self.args.timeout > 0:
+            QTimer.singleShot(int(self.args.timeout * 1000), self.on_timeout)
+
+    @Slot(dict)
+    def on_camera_ready(self, timings):
+        self.camera_ready = True
+        self.startup_ms["camera_ready"] = _elapsed_ms(self._t_start)
+        self.startup_ms["camera"] = timings
+        if self.args.gain is not None:
+            self.gain_requested.emit(self.args.gain)
+        self._start_scan_when_ready()
+
+    @Slot(int)
+    def on_wheel_ready(self, position):
+        self.wheel_ready = True
+        self.start_position = position if position > 0 else None
+        self.startup_ms["wheel_ready"] = _elapsed_ms(self._t_start)
+        self._start_scan_when_ready()
+
+    def _start_scan_when_ready(self):
+        if self.scan_started or not (self.camera_ready and self.wheel_ready):
+            return
+        self.scan_started = True
+        positions = parse_band_selection(self.args.bands, self.filter_config.keys())
+        self.startup_ms["to_scan_start"] = round((time.perf_counter() - _process_start) * 1000, 1)
+        self.scan_scheduler.start(
+            [self.filter_config[position] for position in positions],
+            self.args.base_exposure,
+            format_str="TIFF 16-bit",
+            cube_class=CUBE_FORMATS[self.args.format],
+            output_base_dir=self.args.out,
+            start_position=self.start_position,
+        )
+
+    @Slot(str)
+    def on_error(self, message):
+        print(f"BŁĄD: {message}")
+        self.result["errors"].append(message)
+        if not self.scan_started:
+            self.finish(1)  # Sprzęt nie wystartował - skan się nie zacznie
+
+    @Slot()
+    def on_timeout(self):
+        if self._done:
+            return
+        self.result["errors"].append(f"Przekroczono limit czasu ({self.args.timeout:g} s)")
+        if self.scan_scheduler.active:
+            self.scan_scheduler.stop(error=True)  # Dokończy output_written
+        else:
+            self.finish(1)
+
+    @Slot(dict)
+    def on_output_written(self, summary):
+        self.result["ok"] = summary["completed"]
+        self.result["scan"] = summary
+        self.finish(0 if summary["completed"] else 1)
+
+    def finish(self, exit_code):
+        if self._done:
+            return
+        self._done = True
+        self.result["startup_ms"] = self.startup_ms
+        self.result["frames"] = self.camera_worker.frame_statistics()
+        self.shutdown()
+        self.result["wall_ms"] = round((time.perf_counter() - _process_start) * 1000, 1)
+        self.finished.emit(exit_code)
+
+    def shutdown(self):
+        """Zamyka sprzęt w tej samej kolejności co FilterWheelApp.closeEvent."""
+        self.scan_scheduler.stop()
+        self.camera_worker.stop_streaming()
+        self.camera_thread.quit()
+        self.camera_thread.wait()
+        self.save_queue.stop()
+        self.wheel_thread.quit()
+        self.wheel_thread.wait()
+        self.wheel_connection.close()
+        if self.wheel_emulator:
+            self.wheel_emulator.stop()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m cli", description="Akwizycja bez GUI (wynik JSON na stdout)"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="pojedynczy skan multispektralny")
+    scan.add_argument("--bands", default="", help="pasma, np. 1,3,5 lub 2-6 (domyślnie wszystkie)")
+    scan.add_argument("--base-exposure", type=float, default=10.0, metavar="MS",
+                      help="ekspozycja bazowa w ms (mnożniki z config.json)")
+    scan.add_argument("--gain", type=float, default=None, metavar="DB", help="wzmocnienie w dB")
+    scan.add_argument("--out", default=".", help="katalog, w którym powstanie scan_<data>_<czas>")
+    scan.add_argument("--format", choices=sorted(CUBE_FORMATS), default="files",
+                      help="osobne pliki TIFF lub jedna kostka pasm")
+    scan.add_argument("--frames", type=int, default=1, help="klatki uśredniane na pasmo")
+    scan.add_argument("--sigma-clip", action="store_true", help="odrzucanie pikseli odstających o ponad 3σ")
+    scan.add_argument("--variance", action="store_true", help="zapis wariancji uśrednionych pasm")
+    scan.add_argument("--auto-exposure", action="store_true",
+                      help="dobór ekspozycji każdego pasma w pętli zamkniętej (start z mnożnika)")
+    scan.add_argument("--auto-exposure-target", type=float, default=0.8, metavar="F",
+                      help="docelowa średnia ROI jako ułamek zakresu (domyślnie 0.8)")
+    scan.add_argument("--correction", default="", metavar="DIR",
+                      help="korekcja dark/flat wzorcami z katalogu (np. master_frames nagrane w GUI)")
+    scan.add_argument("--correction-dtype", choices=[DTYPE_FLOAT32, DTYPE_UINT16], default=DTYPE_FLOAT32,
+                      help="typ danych pasm po korekcji (domyślnie float32)")
+    scan.add_argument("--config", default="config.json", help="plik konfiguracji filtrów")
+    scan.add_argument("--port", default="COM3", help="port szeregowy koła filtrów lub 'auto'")
+    scan.add_argument("--baud", type=int, default=115200)
+    scan.add_argument("--telemetry", type=int, default=0, metavar="N",
+                      help="telemetria enkodera koła: co N-ta próbka korekcji (0 = wyłączona)")
+    scan.add_argument("--sim", action="store_true", help="symulowana kamera i emulator ESP32 (bez sprzętu)")
+    scan.add_argument("--timeout", type=float, default=600.0, metavar="S",
+                      help="limit czasu całego przebiegu w sekundach (0 = brak)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            filter_config = load_filter_config(args.config)
+            parse_band_selection(args.bands, filter_config.keys())
+        except (OSError, ValueError, KeyError) as e:
+            print(f"BŁĄD: {e}")
+            print(json.dumps({"command": args.command, "ok": False, "errors": [str(e)]}, ensure_ascii=False), file=stdout)
+            return 2
+
+        app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+        runner = HeadlessScan(args, filter_config)
+        runner.finished.connect(app.exit)
+        QTimer.singleShot(0, runner.start)
+        exit_code = app.exec()
+
+    print(json.dumps(runner.result, ensure_ascii=False), file=stdout)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+correction.py
+
+Korekcja ciemna i płaskiego pola (dark / flat) zapisywanych klatek.
+MasterFrames przechowuje klatki wzorcowe: darki dla pary (ekspozycja,
+wzmocnienie) i znormalizowane flaty dla pozycji koła. Wzorce trzymane są
+w pamięci (float32) i na dysku jako .npy o nazwach z kluczem, np.
+
+    master_frames/dark_10000us_0.0dB.npy
+    master_frames/flat_pos3.npy
+
+więc po restarcie aplikacji są wczytywane przy pierwszym użyciu.
+Brak darka dla danej ekspozycji uzupełnia interpolacja liniowa dwóch
+najbliższych darków o tym samym wzmocnieniu po obu stronach (prąd ciemny
+rośnie liniowo z czasem naświetlania); poza zakresem nagranych ekspozycji
+używany jest wprost najbliższy dark.
+
+Korekcja jednej klatki to jeden przebieg wektorowy w miejscu:
+
+    wynik = (surowa - dark) * (skala / flat)
+
+do bufora float32 wątku wywołującego (bufory alokowane raz na wątek
+i kształt), a dla wyjścia uint16 dodatkowo zaokrąglenie i obcięcie do
+zakresu. Odwrotność flatu liczona jest raz, przy wczytaniu wzorca.
+Plan korekcji (CorrectionPlan) ustalany jest raz na pasmo w wątku GUI,
+a w podglądzie tylko po zmianie pozycji, ekspozycji, Gain lub wzorców;
+stosowany jest w wątku zapisu lub podglądu - wątek kamery nie wykonuje
+dodatkowej pracy.
+Wariancja uśrednionych pasm zapisywana jest bez korekcji.
+"""
+
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+DTYPE_FLOAT32 = "float32"
+DTYPE_UINT16 = "uint16"
+UINT16_MAX = 65535
+
+_DARK_NAME = re.compile(r"^dark_(\d+)us_(-?\d+(?:\.\d+)?)dB\.npy$")
+_FLAT_NAME = re.compile(r"^flat_pos(\d+)\.npy$")
+
+_buffers = threading.local()
+
+
+def _thread_buffer(name, shape, dtype):
+    """Bufor wyniku wątku wywołującego - ponownie używany dla tego samego kształtu."""
+    buffer = getattr(_buffers, name, None)
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, dtype=dtype)
+        setattr(_buffers, name, buffer)
+    return buffer
+
+
+def gain_key(gain_db):
+    """Wzmocnienie zaokrąglone do 0,1 dB (klucz darka)."""
+    return round(float(gain_db), 1)
+
+
+def dark_file_name(exposure_us, gain_db):
+    return f"dark_{int(round(exposure_us))}us_{gain_key(gain_db):.1f}dB.npy"
+
+
+def flat_file_name(position):
+    return f"flat_pos{int(position)}.npy"
+
+
+class CorrectionPlan:
+    """
+    Wzorce dobrane dla jednej klatki (dark, mapa wzmocnienia = skala / flat)
+    i typ wyniku. apply() zwraca bufor wątku wywołującego - ważny do
+    następnego wywołania apply() w tym samym wątku.
+    """
+
+    __slots__ = ("dark", "gain", "scale", "dtype", "info")
+
+    def __init__(self, dark, gain, scale, dtype, info):
+        self.dark = dark
+        self.gain = gain
+        self.scale = scale
+        self.dtype = dtype
+        self.info = info
+
+    def apply(self, image):
+        result = _thread_buffer("float32", image.shape, np.float32)
+        if self.dark is not None:
+            np.subtract(image, self.dark, out=result)
+        else:
+            result[...] = image
+        if self.gain is not None:
+            np.multiply(result, self.gain, out=result)
+        elif self.scale != 1.0:
+            np.multiply(result, self.scale, out=result)
+        if self.dtype != DTYPE_UINT16:
+            return result
+        np.rint(result, out=result)
+        np.clip(result, 0, UINT16_MAX, out=result)
+        output = _thread_buffer("uint16", image.shape, np.uint16)
+        np.copyto(output, result, casting='unsafe')
+        return output
+
+
+class MasterFrames:
+    """
+    Biblioteka klatek wzorcowych z pamięcią podręczną w RAM i na dysku.
+    Metody są bezpieczne wątkowo (GUI nagrywa wzorce, wątki zapisu
+    i podglądu z nich korzystają); tablice wzorców nie są modyfikowane
+    po dodaniu, więc plan korekcji może je trzymać bez kopii.
+    """
+
+    def __init__(self, directory="master_frames", min_flat=0.05, max_derived=8):
+        self.directory = directory
+        self.min_flat = min_flat          # Dolne ograniczenie flatu (martwe piksele, winiety)
+        self.max_derived = max_derived    # Darki interpolowane trzymane w pamięci
+        self._lock = threading.Lock()
+        self._darks = {}                  # (gain_key, exposure_us) -> tablica lub None (niewczytany)
+        self._flats = {}                  # pozycja -> znormalizowany flat lub None
+        self._gains = {}                  # (pozycja, skala) -> skala / flat
+        self._derived = {}                # (gain_key, exposure_us) -> (dark, opis)
+        self.revision = 0                 # Zwiększany po nagraniu wzorca (unieważnia plany korekcji)
+        self._warned = set()
+        self._scan_directory()
+
+    def _scan_directory(self):
+        """Indeks wzorców z nazw plików; same dane wczytywane są przy pierwszym użyciu."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            match = _DARK_NAME.match(name)
+            if match:
+                self._darks[(gain_key(match.group(2)), int(match.group(1)))] = None
+                continue
+            match = _FLAT_NAME.match(name)
+            if match:
+                self._flats[int(match.group(1))] = None
+
+    def inventory(self):
+        """Dostępne wzorce: ekspozycje darków (us) dla wzmocnień i pozycje flatów."""
+        with self._lock:
+            darks = {}
+            for gain, exposure_us in sorted(self._darks):
+                darks.setdefault(gain, []).append(exposure_us)
+            return {"darks": darks, "flats": sorted(self._flats)}
+
+    # ---------------------------------------------------
+    # Nagrywanie wzorców
+    # ---------------------------------------------------
+    def store_dark(self, image, exposure_us, gain_db):
+        """Zapisuje master dark (np. średnią klatek przy zasłoniętym obiektywie). Zwraca ścieżkę."""
+        dark = np.array(image, dtype=np.float32)
+        key = (gain_key(gain_db), int(round(exposure_us)))
+        path = self._save(dark_file_name(exposure_us, gain_db), dark)
+        with self._lock:
+            self._darks[key] = dark
+            self._derived.clear()
+            self.revision += 1
+        return path
+
+    def store_flat(self, image, position, exposure_us, gain_db):
+        """
+        Zapisuje master flat pozycji: odjęcie darka (o ile jest) i normalizacja
+        do średniej 1. Zwraca (ścieżka, opis użytego darka lub None).
+        """
+        flat = np.array(image, dtype=np.float32)
+        dark, dark_info = self.dark(exposure_us, gain_db, flat.shape)
+        if dark is not None:
+            np.subtract(flat, dark, out=flat)
+        mean_value = float(np.mean(flat, dtype=np.float64))
+        if mean_value <= 0:
+            raise ValueError("Flat bez sygnału ponad poziom ciemny.")
+        np.multiply(flat, 1.0 / mean_value, out=flat)
+        np.maximum(flat, self.min_flat, out=flat)
+        path = self._save(flat_file_name(position), flat)
+        with self._lock:
+            self._flats[int(position)] = flat
+            for key in [key for key in self._gains if key[0] == int(position)]:
+                del self._gains[key]
+            self.revision += 1
+        return path, dark_info
+
+    def _save(self, name, array):
+        """Zapis atomowy (plik tymczasowy + os.replace) - przerwany zapis nie psuje wzorca."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        fd, tmp_path = tempfile.mkstemp(prefix=".master_", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        print(f"Zapisano wzorzec: {path}")
+        return path
+
+    # ---------------------------------------------------
+    # Dobór wzorców
+    # ---------------------------------------------------
+    def _load(self, table, key, name, shape):
+        """Wzorzec z pamięci lub z dysku (wywoływane pod blokadą). None przy braku lub innym kształcie."""
+        array = table.get(key)
+        if array is None:
+            try:
+                array = np.load(os.path.join(self.directory, name)).astype(np.float32, copy=False)
+            except (OSError, ValueError) as e:
+                self._warn(name, f"Nie można wczytać wzorca {name}: {e}")
+                return None
+            table[key] = array
+        if array.shape != shape:
+            # Np. zmieniony obszar odczytu (ROI) kamery
+            self._warn((name, shape), f"Wzorzec {name} ma wymiary {array.shape}, klatka {shape} - pominięty.")
+            return None
+        return array
+
+    def _warn(self, key, message):
+        if key not in self._warned:
+            self._warned.add(key)
+            print(f"Korekcja: {message}")
+
+    def dark(self, exposure_us, gain_db, shape):
+        """(dark, opis) dla ekspozycji i wzmocnienia; (None, None), gdy brak darka o tym wzmocnieniu."""
+        gain = gain_key(gain_db)
+        exposure_us = int(round(exposure_us))
+        with self._lock:
+            if (gain, exposure_us) in self._darks:
+                name = dark_file_name(exposure_us, gain)
+                dark = self._load(self._darks, (gain, exposure_us), name, shape)
+                if dark is not None:
+                    return dark, {"file": name, "exposure_us": exposure_us, "method": "exact"}
+
+            derived = self._derived.get((gain, exposure_us))
+            if derived is not None and derived[0].shape == shape:
+                return derived
+
+            # Interpolacja tylko między darkami po obu stronach; poza zakresem
+            # nagranych ekspozycji - najbliższy dark (bez ekstrapolacji)
+            candidates = sorted(
+                (abs(t - exposure_us), t) for g, t in self._darks if g == gain and t != exposure_us
+            )
+            below = [t for _, t in candidates if t < exposure_us][:1]
+            above = [t for _, t in candidates if t > exposure_us][:1]
+            chosen = below + above if below and above else [t for _, t in candidates[:1]]
+            darks = []
+            for t in chosen:
+                dark = self._load(self._darks, (gain, t), dark_file_name(t, gain), shape)
+                if dark is not None:
+                    darks.append((t, dark))
+            if not darks:
+                return None, None
+            if len(darks) == 1:
+                t, dark = darks[0]
+                return dark, {"file": dark_file_name(t, gain), "exposure_us": t, "method": "nearest"}
+
+            (t0, d0), (t1, d1) = darks
+            weight = (exposure_us - t0) / (t1 - t0)
+            dark = np.subtract(d1, d0, dtype=np.float32)
+            np.multiply(dark, weight, out=dark)
+            np.add(dark, d0, out=dark)
+            info = {"file": [dark_file_name(t0, gain), dark_file_name(t1, gain)],
+                    "exposure_us": exposure_us, "method": "interpolated"}
+            if len(self._derived) >= self.max_derived:
+                self._derived.pop(next(iter(self._derived)))
+            self._derived[(gain, exposure_us)] = (dark, info)
+            return dark, info
+
+    def gain_map(self, position, shape, scale=1.0):
+        """(skala / flat, opis) dla pozycji koła; (None, None), gdy brak flatu."""
+        position = int(position)
+        with self._lock:
+            gain = self._gains.get((position, scale))
+            if gain is not None and gain.shape == shape:
+                return gain, {"file": flat_file_name(position)}
+            if position not in self._flats:
+                return None, None
+            flat = self._load(self._flats, position, flat_file_name(position), shape)
+            if flat is None:
+                return None, None
+            gain = np.divide(scale, flat, dtype=np.float32)
+            self._gains[(position, scale)] = gain
+            return gain, {"file": flat_file_name(position)}
+
+    def prepare(self, exposure_us, gain_db, position, shape, dtype=DTYPE_FLOAT32, scale=1.0):
+        """Plan korekcji klatki; brakujący wzorzec oznacza pominięcie tego etapu (opis: None)."""
+        dark, dark_info = self.dark(exposure_us, gain_db, shape)
+        gain, flat_info = self.gain_map(position, shape, scale) if position else (None, None)
+        info = {"dark": dark_info, "flat": flat_info, "dtype": dtype}
+        if scale != 1.0:
+            info["scale"] = scale
+        return CorrectionPlan(dark, gain, scale, dtype, info)
+
+
+class FrameCorrector:
+    """Ustawienia korekcji (typ wyniku, skala uint16) dla biblioteki wzorców."""
+
+    def __init__(self, masters, dtype=DTYPE_FLOAT32, scale=1.0):
+        self.masters = masters
+        self.dtype = dtype
+        self.scale = scale   # Mnożnik wyniku (np. dla pełniejszego wykorzystania zakresu uint16)
+
+    def plan(self, frame, position, dtype=None):
+        """Plan dla klatki z puli lub średniej (image, exposure_us, gain_db) na pozycji koła."""
+        return self.masters.prepare(
+            frame.exposure_us, frame.gain_db, position, frame.image.shape,
+            dtype or self.dtype, self.scale,
+        )
+
+
+def describe_masters(masters):
+    """Krótki opis dostępnych wzorców (do statusu GUI i logów)."""
+    inventory = masters.inventory()
+    darks = sum(len(exposures) for exposures in inventory["darks"].values())
+    flats = ", ".join(str(position) for position in inventory["flats"]) or "-"
+    return f"darki: {darks}, flaty pozycji: {flats}"
@@ -0,0 +1,133 @@
+"""
+exposure.py
+
+Automatyczny dobór ekspozycji pasma (tryb automatyczny).
+AutoExposure mierzy statystyki ROI na przerzedzonej klatce (co `step`-ty
+piksel w obu osiach, widok bez kopii) i - zakładając liniową odpowiedź
+sensora - wylicza od razu ekspozycję docelową zamiast szukać jej
+krokami. Średnia ROI dąży do target_fraction zakresu, ale jasne obszary
+(percentyl 1 - max_saturated_fraction) zostają z zapasem headroom poniżej
+progu nasycenia; klatka z nasyconym ROI skraca ekspozycję stałym krokiem.
+Kontroler działa w wątku akwizycji kamery (RealCameraService), więc
+kolejne iteracje nie czekają na wątek GUI.
+"""
+
+import copy
+
+import numpy as np
+
+from calibration_engine import BIT_DEPTH, TARGET_PERCENT, roi_bounds
+
+
+class AutoExposure:
+    """Ustawienia i stan doboru ekspozycji jednego pasma (clone() - nowy przebieg)."""
+
+    def __init__(self, target_fraction=TARGET_PERCENT, tolerance=0.05, roi_factor=1.0, step=8,
+                 max_saturated_fraction=0.001, saturation_fraction=0.98, headroom=0.05, black_level=0.0,
+                 min_exposure_ms=0.1, max_exposure_ms=10000.0, max_iterations=6, max_ratio=16.0,
+                 bit_depth=BIT_DEPTH):
+        self.target_fraction = target_fraction
+        self.tolerance = tolerance                        # Względny błąd poziomu uznany za zbieżny
+        self.roi_factor = roi_factor                      # Bok ROI jako ułamek boku klatki
+        self.step = step                                  # Przerzedzenie klatki do pomiaru
+        self.max_saturated_fraction = max_saturated_fraction
+        self.saturation_fraction = saturation_fraction    # Próg nasycenia jako ułamek zakresu
+        self.headroom = headroom                          # Zapas jasnych obszarów poniżej progu nasycenia
+        self.black_level = black_level                    # Poziom czerni (offset sensora)
+        self.min_exposure_ms = min_exposure_ms
+        self.max_exposure_ms = max_exposure_ms
+        self.max_iterations = max_iterations
+        self.max_ratio = max_ratio                        # Największa zmiana ekspozycji w jednej iteracji
+        self.bit_depth = bit_depth
+        self.reset()
+
+    def reset(self, initial_exposure_ms=None):
+        self.initial_exposure_ms = initial_exposure_ms
+        self.exposure_ms = initial_exposure_ms
+        self.iterations = 0
+        self.converged = False
+        self.done = False
+        self.level_fraction = None
+        self.saturated_fraction = None
+        self.history = []
+
+    def clone(self, initial_exposure_ms=None):
+        """Nowy kontroler z tymi samymi ustawieniami (każde pasmo ma własny)."""
+        controller = copy.copy(self)
+        controller.reset(initial_exposure_ms)
+        return controller
+
+    def budget_ms(self, initial_exposure_ms):
+        """Najdłuższy łączny czas naświetlania iteracji (do limitu czasu skanu)."""
+        total = 0.0
+        exposure_ms = initial_exposure_ms
+        for _ in range(self.max_iterations):
+            total += exposure_ms
+            exposure_ms = min(exposure_ms * self.max_ratio, self.max_exposure_ms)
+        return total
+
+    def measure(self, image):
+        """(średni poziom, poziom jasnych obszarów, ułamek nasyconych) - ponad poziomem czerni."""
+        y0, y1, x0, x1 = roi_bounds(image.shape[0], image.shape[1], self.roi_factor)
+        if y1 <= y0 or x1 <= x0:
+            y0, y1, x0, x1 = 0, image.shape[0], 0, image.shape[1]
+        sample = image[y0:y1:self.step, x0:x1:self.step]
+        saturation_level = self.saturation_fraction * self.bit_depth
+        saturated = float(np.count_nonzero(sample >= saturation_level)) / sample.size
+        level = float(np.mean(sample, dtype=np.float64)) - self.black_level
+        # Percentyl przez partition na kopii próbki (~1/step² klatki), bez pełnego sortowania
+        rank = min(sample.size - 1, int(sample.size * (1.0 - self.max_saturated_fraction)))
+        highlight = float(np.partition(sample, rank, axis=None)[rank]) - self.black_level
+        return max(level, 1.0), max(highlight, 1.0), saturated
+
+    def update(self, image, exposure_ms):
+        """
+        Przetwarza klatkę naświetlaną `exposure_ms`. Zwraca ekspozycję dla
+        następnej klatki; converged/done mówią, czy ta klatka jest już wynikiem.
+        """
+        if self.initial_exposure_ms is None:
+            self.initial_exposure_ms = exposure_ms
+        self.iterations += 1
+        level, highlight, saturated = self.measure(image)
+        self.level_fraction = (level + self.black_level) / self.bit_depth
+        self.saturated_fraction = saturated
+        self.history.append({
+            "exposure_ms": round(exposure_ms, 4),
+            "level_fraction": round(self.level_fraction, 4),
+            "saturated_fraction": round(saturated, 6),
+        })
+
+        usable = (1.0 - self.headroom) * self.saturation_fraction * self.bit_depth - self.black_level
+        if saturated > self.max_saturated_fraction:
+            # Poziom nasyconych pikseli jest nieznany - skrócenie o stały krok
+            ratio = 1.0 / 4.0
+        else:
+            target = self.target_fraction * self.bit_depth - self.black_level
+            # Odpowiedź liniowa: poziom ~ ekspozycja; jasne obszary poniżej nasycenia
+            ratio = min(target / level, usable / highlight)
+            if abs(ratio - 1.0) <= self.tolerance:
+                self.converged = True
+        ratio = min(max(ratio, 1.0 / self.max_ratio), self.max_ratio)
+        next_ms = min(max(exposure_ms * ratio, self.min_exposure_ms), self.max_exposure_ms)
+
+        self.exposure_ms = exposure_ms
+        if not self.converged:
+            if next_ms == exposure_ms:
+                self.done = True   # Ograniczenie zakresu ekspozycji - lepiej nie będzie
+            elif self.iterations >= self.max_iterations:
+                self.done = True
+        self.done = self.done or self.converged
+        return exposure_ms if self.done else next_ms
+
+    def summary(self):
+        """Opis doboru ekspozycji do metadanych pasma."""
+        return {
+            "initial_exposure_ms": round(self.initial_exposure_ms, 4) if self.initial_exposure_ms else None,
+            "final_exposure_ms": round(self.exposure_ms, 4) if self.exposure_ms else None,
+            "iterations": self.iterations,
+            "converged": self.converged,
+            "level_fraction": round(self.level_fraction, 4) if self.level_fraction is not None else None,
+            "saturated_fraction": self.saturated_fraction,
+            "target_fraction": self.target_fraction,
+            "history": self.history,
+        }
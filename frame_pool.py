@@ -0,0 +1,140 @@
+"""
+frame_pool.py
+
+Pula wstępnie zaalokowanych buforów klatek 16-bit.
+Klatka z kamery kopiowana jest raz do wolnego bufora i przekazywana dalej
+przez referencję; każdy posiadacz zwalnia ją jawnie przez release().
+W stanie ustalonym strumieniowanie nie alokuje nowych tablic.
+FrameMailbox przekazuje do podglądu tylko najnowszą klatkę.
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class PooledFrame:
+    """Bufor klatki z puli wraz z metadanymi akwizycji."""
+
+    __slots__ = ("pool", "image", "flat", "frame_count", "timestamp",
+                 "exposure_us", "gain_db", "settled", "_refs")
+
+    def __init__(self, pool, height, width, dtype):
+        self.pool = pool
+        self.image = np.zeros((height, width), dtype=dtype)
+        self.flat = self.image.reshape(-1)  # Widok 1D do kopiowania z SDK
+        self.frame_count = 0      # Numer klatki z SDK
+        self.timestamp = 0.0      # Chwila odbioru (time.perf_counter)
+        self.exposure_us = 0      # Ekspozycja, z którą klatka została naświetlona
+        self.gain_db = 0.0
+        self.settled = False      # Całe naświetlanie po ostatniej zmianie ustawień
+        self._refs = 0
+
+    def retain(self):
+        """Dodaje posiadacza klatki (np. kolejkę zapisu). Zwraca self."""
+        with self.pool.lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        """Zwalnia klatkę; ostatnie zwolnienie oddaje bufor do puli."""
+        self.pool._release(self)
+
+
+class FramePool:
+    """
+    Stała pula buforów o wymiarach kamery (wysokość/szerokość ustalane raz).
+    acquire() zwraca None, gdy wszystkie bufory są zajęte - klatka jest wtedy
+    pomijana zamiast alokować nową pamięć.
+    """
+
+    def __init__(self, width, height, size=8, dtype=np.uint16):
+        self.width = width
+        self.height = height
+        self.lock = threading.Lock()
+        self._frames = [PooledFrame(self, height, width, dtype) for _ in range(size)]
+        self._free = deque(self._frames)
+        self.exhausted_count = 0
+
+    @property
+    def size(self):
+        return len(self._frames)
+
+    def free_count(self):
+        with self.lock:
+            return len(self._free)
+
+    def acquire(self):
+        """Pobiera wolny bufor (licznik posiadaczy = 1) lub None."""
+        with self.lock:
+            if not self._free:
+                self.exhausted_count += 1
+                return None
+            frame = self._free.popleft()
+            frame._refs = 1
+            return frame
+
+    def _release(self, frame):
+        with self.lock:
+            if frame._refs <= 0:
+                return
+            frame._refs -= 1
+            if frame._refs == 0:
+                self._free.append(frame)
+
+
+class FrameMailbox:
+    """
+    Jednoelementowa skrzynka "ostatnia klatka wygrywa".
+    Nowa klatka zastępuje nieodebraną (ta jest zwalniana i liczona jako pominięta),
+    więc odbiorca zawsze dostaje najświeższy obraz, a kolejka nigdy nie rośnie.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._available = threading.Condition(self.lock)
+        self._frame = None
+        self.posted_count = 0
+        self.taken_count = 0
+        self.dropped_count = 0
+
+    def post(self, frame):
+        """Wkłada klatkę. Zwraca True, gdy skrzynka była pusta (trzeba powiadomić odbiorcę)."""
+        with self.lock:
+            previous = self._frame
+            self._frame = frame
+            self.posted_count += 1
+            if previous is not None:
+                self.dropped_count += 1
+            self._available.notify()
+        if previous is not None:
+            previous.release()
+        return previous is None
+
+    def take(self):
+        """Odbiera najnowszą klatkę (przejmując ją) lub None."""
+        with self.lock:
+            frame = self._frame
+            self._frame = None
+            if frame is not None:
+                self.taken_count += 1
+        return frame
+
+    def wait_take(self, timeout):
+        """Jak take(), ale czeka maksymalnie timeout sekund na klatkę."""
+        with self.lock:
+            if self._frame is None:
+                self._available.wait(timeout)
+            frame = self._frame
+            self._frame = None
+            if frame is not None:
+                self.taken_count += 1
+        return frame
+
+    def clear(self):
+        with self.lock:
+            frame = self._frame
+            self._frame = None
+        if frame is not None:
+            frame.release()
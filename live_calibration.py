@@ -0,0 +1,274 @@
+"""
+live_calibration.py
+
+Kalibracja filtrów na żywo - z klatek kamery zamiast ręcznie
+przygotowanych zdjęć bieli. LiveCalibrator objeżdża koło (kolejność
+najkrótszej drogi, jak skan), na każdej pozycji zamawia klatkę naświetlaną
+w całości po dojeździe i mierzy średnią ROI (te same założenia co
+calibration.py: cel 80% zakresu 16-bit, ROI 20% boku obrazu).
+Klatka prześwietlona lub zbyt ciemna jest powtarzana z poprawioną
+ekspozycją, a po trafionym pomiarze wykonywane są dodatkowe ekspozycje
+(linearity_fractions), z których dopasowywany jest model liniowości
+(offset + nachylenie, calibration_engine.fit_filter_models). Mnożniki
+względem filtra referencyjnego trafiają atomowo do config.json.
+"""
+
+import time
+
+from PySide6.QtCore import QObject, Signal, Slot, QTimer
+
+from calibration_engine import (
+    BIT_DEPTH, TARGET_PERCENT, ROI_FACTOR, fit_filter_models, image_roi_stats, optimal_exposure, save_config
+)
+from wheel_path import plan_visit_order, direction_suffix
+from workers import next_capture_id
+
+REF_SUFFIX = " (Ref)"
+
+
+class LiveCalibrator(QObject):
+    """
+    Automat stanów kalibracji: ruch koła -> klatka -> pomiar ROI.
+    Jak ScanScheduler komunikuje się ze sprzętem wyłącznie sygnałami.
+    """
+    # Polecenia (Kalibrator -> sprzęt)
+    wheel_command_requested = Signal(str)
+    exposure_requested = Signal(float)
+    capture_requested = Signal(int)
+    capture_cancelled = Signal(int)
+
+    # Raportowanie
+    progress = Signal(str)
+    finished = Signal(dict)
+    error = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self.bit_depth = BIT_DEPTH
+        self.target_percent = TARGET_PERCENT
+        self.roi_factor = ROI_FACTOR
+        # Pomiar ważny, gdy średnia ROI mieści się w tym przedziale zakresu
+        self.saturation_fraction = 0.95
+        self.min_fraction = 0.05
+        self.max_attempts = 5
+        # Dodatkowe ekspozycje (ułamki trafionej) do dopasowania offsetu i nachylenia
+        self.linearity_fractions = (0.5, 0.25)
+        self.min_exposure_ms = 0.1
+        self.max_exposure_ms = 60000.0
+        self.capture_timeout_ms = 5000  # Zapas ponad czas naświetlania
+
+        self.active = False
+        self.config_path = "config.json"
+        self.steps = []
+        self.reference_position = None
+        self.current_step = 0
+        self.results = {}
+        self._exposure_ms = 0.0
+        self._attempts = 0
+        self._points = []
+        self._extra_exposures = None   # Po trafionym pomiarze: pozostałe ekspozycje dodatkowe
+        self._capture_id = None
+        self._start = 0.0
+
+    # ---------------------------------------------------
+    # Sterowanie
+    # ---------------------------------------------------
+    def start(self, filters, reference_position, config_path="config.json", start_position=None):
+        """
+        filters - wpisy pozycji (position, name, exposure_ms - ekspozycja startowa;
+        pozostałe klucze przechodzą do config.json bez zmian).
+        """
+        if self.active:
+            return
+        by_position = {entry['position']: entry for entry in filters}
+        if reference_position not in by_position:
+            self.error.emit(f"Kalibracja: brak pozycji referencyjnej {reference_position}.")
+            return
+        plan, travel = plan_visit_order(list(by_position), start_position)
+        self.steps = [dict(by_position[position], delta=delta) for position, delta in plan]
+        self.reference_position = reference_position
+        self.config_path = config_path
+        self.results = {}
+        self.current_step = 0
+        self.active = True
+        self._start = time.perf_counter()
+        print(f"--- START KALIBRACJI --- kolejność {[s['position'] for s in self.steps]}, "
+              f"referencja {reference_position}")
+        self._start_step()
+
+    def stop(self, error=False):
+        """Przerywa kalibrację bez zapisu konfiguracji."""
+        if not self.active:
+            return
+        self._end({"error": error, "completed": False, "bands": list(self.results.values())})
+
+    def _end(self, summary):
+        self.active = False
+        if self._capture_id is not None:
+            self.capture_cancelled.emit(self._capture_id)
+            self._capture_id = None
+        summary["total_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+        print(f"--- KONIEC KALIBRACJI --- {summary['total_ms']:.0f} ms")
+        self.finished.emit(summary)
+
+    # ---------------------------------------------------
+    # Etapy pomiaru
+    # ---------------------------------------------------
+    def _start_step(self):
+        step = self.steps[self.current_step]
+        self._attempts = 0
+        self._points = []
+        self._extra_exposures = None   # Po trafionym pomiarze: pozostałe ekspozycje dodatkowe
+        self._set_exposure(step['exposure_ms'])
+        self.progress.emit(f"Kalibracja: {self.current_step + 1}/{len(self.steps)} ({step['name']})")
+        self.wheel_command_requested.emit(f"GOTO:{step['position']}{direction_suffix(step['delta'])}\n")
+
+    def _set_exposure(self, exposure_ms):
+        self._exposure_ms = min(max(exposure_ms, self.min_exposure_ms), self.max_exposure_ms)
+        self.exposure_requested.emit(self._exposure_ms)
+
+    def _request_frame(self):
+        self._attempts += 1
+        request_id = next_capture_id()
+        self._capture_id = request_id
+        self.capture_requested.emit(request_id)
+        timeout_ms = int(self._exposure_ms * 3) + self.capture_timeout_ms
+        QTimer.singleShot(timeout_ms, lambda: self._on_capture_timeout(request_id))
+
+    @Slot(str)
+    def on_wheel_response(self, response):
+        if not self.active or self._capture_id is not None:
+            return
+        if response.startswith("ERROR:"):
+            self.error.emit(response)
+            self.stop(error=True)
+            return
+        if response == f"OK:{self.steps[self.current_step]['position']}":
+            self._request_frame()
+
+    @Slot(str)
+    def on_wheel_error(self, message):
+        if self.active:
+            self.stop(error=True)
+
+    def _on_capture_timeout(self, request_id):
+        if self.active and request_id == self._capture_id:
+            self.error.emit("Kalibracja: brak klatki z kamery.")
+            self.stop(error=True)
+
+    @Slot(int, object)
+    def on_frame_captured(self, request_id, frame):
+        if request_id != self._capture_id:
+            return  # Zamówienie innego odbiorcy
+        self._capture_id = None
+        try:
+            mean_value, saturated = image_roi_stats(frame.image, self.roi_factor, self.bit_depth)
+            # Ekspozycja faktycznie użyta przez kamerę (po zaokrągleniu przez SDK)
+            exposure_ms = frame.exposure_us / 1000.0
+        finally:
+            frame.release()
+        if not self.active:
+            return
+
+        step = self.steps[self.current_step]
+        fraction = mean_value / self.bit_depth
+        self._points.append((exposure_ms, mean_value, saturated))
+        print(f"Kalibracja: pozycja {step['position']} - ekspozycja {exposure_ms:.3f} ms, "
+              f"średnia ROI {mean_value:.0f} ({fraction:.1%})")
+
+        if self._extra_exposures is not None:
+            # Punkty dodatkowe do modelu liniowości
+            if self._extra_exposures:
+                self._set_exposure(self._extra_exposures.pop(0))
+                self._request_frame()
+            else:
+                self._finish_step()
+            return
+
+        clipped = exposure_ms >= self.max_exposure_ms or exposure_ms <= self.min_exposure_ms
+        in_range = self.min_fraction <= fraction <= self.saturation_fraction
+        if not in_range and not clipped and self._attempts < self.max_attempts:
+            if fraction > self.saturation_fraction:
+                # Przy nasyceniu średnia nie mówi, ile światła jest naprawdę
+                self._set_exposure(exposure_ms / 4)
+            else:
+                self._set_exposure(optimal_exposure(mean_value, exposure_ms, self.bit_depth, self.target_percent))
+            self._request_frame()
+            return
+        if in_range and self.linearity_fractions:
+            self._extra_exposures = [exposure_ms * f for f in self.linearity_fractions]
+            self._set_exposure(self._extra_exposures.pop(0))
+            self._request_frame()
+            return
+        self._finish_step()
+
+    def _finish_step(self):
+        step = self.steps[self.current_step]
+        self.results[step['position']] = {
+            "position": step['position'],
+            "attempts": self._attempts,
+            "points": [
+                {"exposure_ms": round(t, 4), "roi_mean": round(mean_value, 1), "saturated_fraction": round(saturated, 6)}
+                for t, mean_value, saturated in self._points
+            ],
+        }
+        self.current_step += 1
+        if self.current_step < len(self.steps):
+            self._start_step()
+        else:
+            self._finish()
+
+    # ---------------------------------------------------
+    # Wynik
+    # ---------------------------------------------------
+    def _finish(self):
+        """Modele liniowości wszystkich pozycji, mnożniki względem referencji i atomowy zapis config.json."""
+        positions = sorted(self.results)
+        models = dict(zip(positions, fit_filter_models(
+            [[(p["exposure_ms"], p["roi_mean"], p["saturated_fraction"]) for p in self.results[position]["points"]]
+             for position in positions],
+            self.bit_depth, self.target_percent,
+        )))
+        ref_time = models[self.reference_position]["optimal_exposure_ms"]
+        if ref_time is None:
+            self.error.emit("Kalibracja: brak sygnału na pozycji referencyjnej.")
+            self._end({"error": True, "completed": False, "bands": list(self.results.values())})
+            return
+
+        filters = []
+        warnings = []
+        for step in sorted(self.steps, key=lambda s: s['position']):
+            position = step['position']
+            model = models[position]
+            entry = {k: v for k, v in step.items() if k not in ("delta", "exposure_ms")}
+            name = entry.get('name', f"Filtr {position}")
+            if name.endswith(REF_SUFFIX):
+                name = name[:-len(REF_SUFFIX)]
+            entry['name'] = name + REF_SUFFIX if position == self.reference_position else name
+            if model["optimal_exposure_ms"] is None:
+                entry['exposure_multiplier'] = entry.get('exposure_multiplier', 1.0)
+                warnings.append(f"Filtr {position}: brak sygnału - mnożnik bez zmian.")
+            else:
+                entry['exposure_multiplier'] = round(model["optimal_exposure_ms"] / ref_time, 4)
+            entry['linearity'] = model
+            if "nonlinear" in model["flags"] or "single_exposure" in model["flags"]:
+                warnings.append(f"Filtr {position}: {', '.join(model['flags'])}.")
+            filters.append(entry)
+
+        calibration = {
+            "method": "live",
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "reference_position": self.reference_position,
+            "target_percent": self.target_percent,
+            "roi_factor": self.roi_factor,
+            "bands": [self.results[position] for position in positions],
+        }
+        summary = {"error": False, "completed": True, "filters": filters, "warnings": warnings,
+                   "config_path": self.config_path, "bands": calibration["bands"]}
+        try:
+            save_config(self.config_path, filters, calibration)
+        except OSError as e:
+            self.error.emit(f"Kalibracja: nie można zapisać {self.config_path}: {e}")
+            summary["error"] = True
+            summary["completed"] = False
+        self._end(summary)
@@ -1,51 +1,92 @@
 import sys
 import json
+import argparse
+import functools
 import time
 import os
-import numpy as np
-import cv2
-import tifffile
+import threading
+
+_process_start = time.perf_counter()  # Czasy etapów startu liczone od uruchomienia
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget,
     QVBoxLayout, QHBoxLayout, QPushButton,
     QGridLayout, QLabel, QDoubleSpinBox, QGroupBox,
-    QMessageBox, QFileDialog, QComboBox
+    QMessageBox, QFileDialog, QComboBox, QLineEdit, QSpinBox, QCheckBox
 )
 from PySide6.QtGui import QPixmap, QImage, QFont
-from PySide6.QtCore import Qt, Slot, QThread, QThreadPool, QTimer
+from PySide6.QtCore import Qt, Signal, Slot, QThread, QTimer
 
 # Import tylko prawdziwych klas obsługi sprzętu
-from workers import RealCameraService, RealSerialWorker
+from workers import RealCameraService, FilterWheelConnection, WheelCommandQueue, next_capture_id
+from preview import PreviewRenderer, ContrastEngine
+from saving import ImageSaveQueue, TiffCubeWriter, MemmapCubeWriter, create_scan_directory, write_image
+from scan import ScanScheduler, parse_band_selection
+from timelapse import TimeLapseScheduler
+from live_calibration import LiveCalibrator, REF_SUFFIX
+from exposure import AutoExposure
+from correction import MasterFrames, FrameCorrector, DTYPE_FLOAT32, DTYPE_UINT16, describe_masters
+
+
+def preload_modules():
+    """Import OpenCV i tifffile w tle, równolegle ze startem kamery - pierwszy podgląd i zapis nie czekają."""
+    import cv2
+    import tifffile
 
 
 class FilterWheelApp(QMainWindow):
-    def __init__(self):
+    # Polecenia dla wątku koła filtrów (GUI -> Worker)
+    wheel_command_requested = Signal(str)
+    # Seria klatek do pliku (GUI -> wątek kamery)
+    burst_requested = Signal(str, int)
+    burst_stop_requested = Signal()
+    # Klatki wzorcowe dark/flat jako średnia N klatek (GUI -> wątek kamery)
+    master_stack_requested = Signal(int, int, float, bool)
+    master_capture_cancelled = Signal(int)
+
+    def __init__(self, simulate=False, telemetry_decimation=0, serial_port="COM3"):
         super().__init__()
+        self.startup_timings = {}  # Etapy startu [ms od uruchomienia procesu]
 
         # --- Konfiguracja i zmienne ---
         self.filter_config = {}
         self.current_filter_pos = 0
-        self.current_science_frame = None  # Przechowuje surowe dane 16-bit
+        self.current_science_frame = None  # PooledFrame z surowymi danymi 16-bit
+
+        # Podgląd: limit odświeżania (ostatnia klatka wygrywa)
+        self.preview_max_fps = 30.0
+        self.preview_renderer = None
 
         self.load_config()
 
-        # Zmienne dla Trybu Automatycznego
-        self.auto_mode_active = False
-        self.auto_mode_steps = []
-        self.auto_mode_current_step = 0
+        # Korekcja dark/flat: wzorce w pamięci i w katalogu master_frames
+        self.masters = MasterFrames("master_frames")
+        self.corrector = FrameCorrector(self.masters)
+        self.master_capture_timeout_ms = 5000  # Zapas ponad łączny czas naświetlania
+        self._master_request = None            # (id zamówienia, rodzaj, pozycja) nagrywanego wzorca
+
+        # Tryb Automatyczny (katalogi skanów tworzone w output_base_dir)
+        self.output_base_dir = "."
 
         self.setWindowTitle("Sterownik Koła Filtrów i Kamery Thorlabs (16-bit TIFF)")
         self.setGeometry(100, 100, 1100, 750)
 
         # Inicjalizacja wątków
-        self.thread_pool = QThreadPool()
         self.camera_thread = QThread()
         self.camera_worker = None
+        self.wheel_thread = QThread()
+        self.wheel_connection = None
 
-        self.is_filter_wheel_busy = False
-        self.serial_port = "COM3"
+        self.serial_port = serial_port  # "auto" = wyszukanie sterownika na dostępnych portach
         self.serial_baud = 115200
+        self.telemetry_decimation = telemetry_decimation  # Telemetria enkodera koła (0 = wył.)
+
+        # Tryb symulacji: syntetyczna kamera i emulator ESP32 zamiast sprzętu
+        self.simulate = simulate
+        self.camera_sdk_factory = None
+        self.wheel_emulator = None
+        if simulate:
+            self._setup_simulation()
 
         # --- Budowa Interfejsu (GUI) ---
         main_widget = QWidget()
@@ -85,8 +126,12 @@ class FilterWheelApp(QMainWindow):
         self.base_exposure_spinbox.setValue(10.0)
         self.base_exposure_spinbox.setSuffix(" ms")
         self.base_exposure_spinbox.valueChanged.connect(self.recalculate_current_exposure)
+        # Dobór ekspozycji w trybie auto (mnożnik z config.json jako punkt startowy)
+        self.auto_exposure_checkbox = QCheckBox("Auto-ekspozycja")
+        self.auto_exposure_checkbox.setToolTip("Tryb auto: dobór ekspozycji każdego pasma na pierwszych klatkach")
         base_exp_layout.addWidget(base_exp_label)
         base_exp_layout.addWidget(self.base_exposure_spinbox)
+        base_exp_layout.addWidget(self.auto_exposure_checkbox)
         camera_layout.addLayout(base_exp_layout)
 
         # Ekspozycja Aktualna (Wynikowa)
@@ -119,6 +164,51 @@ class FilterWheelApp(QMainWindow):
         self.auto_mode_button.clicked.connect(self.toggle_auto_mode)
         camera_layout.addWidget(self.auto_mode_button)
 
+        # Pasma trybu auto (pusty = wszystkie; kolejność ustala planer drogi koła)
+        bands_layout = QHBoxLayout()
+        bands_label = QLabel("Pasma trybu auto:")
+        self.auto_bands_edit = QLineEdit()
+        self.auto_bands_edit.setPlaceholderText("wszystkie (np. 1,3,5 lub 2-6)")
+        bands_layout.addWidget(bands_label)
+        bands_layout.addWidget(self.auto_bands_edit)
+        camera_layout.addLayout(bands_layout)
+
+        # Uśrednianie klatek pasma (domyślnie; 'frames_per_band' w config.json ma pierwszeństwo)
+        stacking_layout = QHBoxLayout()
+        stacking_label = QLabel("Klatki na pasmo:")
+        self.frames_per_band_spinbox = QSpinBox()
+        self.frames_per_band_spinbox.setRange(1, 256)
+        self.frames_per_band_spinbox.setValue(1)
+        self.sigma_clip_checkbox = QCheckBox("Odrzucanie 3σ")
+        self.save_variance_checkbox = QCheckBox("Wariancja")
+        stacking_layout.addWidget(stacking_label)
+        stacking_layout.addWidget(self.frames_per_band_spinbox)
+        stacking_layout.addWidget(self.sigma_clip_checkbox)
+        stacking_layout.addWidget(self.save_variance_checkbox)
+        camera_layout.addLayout(stacking_layout)
+
+        # Sesja poklatkowa: powtarzanie skanu (czas sesji 0 = pojedynczy skan)
+        timelapse_layout = QHBoxLayout()
+        timelapse_label = QLabel("Sesja co:")
+        self.timelapse_interval_spinbox = QDoubleSpinBox()
+        self.timelapse_interval_spinbox.setRange(0.0, 86400.0)
+        self.timelapse_interval_spinbox.setSuffix(" s")
+        self.timelapse_interval_spinbox.setToolTip("0 = skany jeden po drugim")
+        self.timelapse_duration_spinbox = QSpinBox()
+        self.timelapse_duration_spinbox.setRange(0, 10080)
+        self.timelapse_duration_spinbox.setPrefix("przez ")
+        self.timelapse_duration_spinbox.setSuffix(" min")
+        self.timelapse_duration_spinbox.setToolTip("0 = pojedynczy skan")
+        self.timelapse_keep_spinbox = QSpinBox()
+        self.timelapse_keep_spinbox.setRange(0, 100000)
+        self.timelapse_keep_spinbox.setPrefix("zachowaj ")
+        self.timelapse_keep_spinbox.setToolTip("Liczba ostatnich skanów na dysku (0 = wszystkie)")
+        timelapse_layout.addWidget(timelapse_label)
+        timelapse_layout.addWidget(self.timelapse_interval_spinbox)
+        timelapse_layout.addWidget(self.timelapse_duration_spinbox)
+        timelapse_layout.addWidget(self.timelapse_keep_spinbox)
+        camera_layout.addLayout(timelapse_layout)
+
         # Wybór formatu zapisu
         format_layout = QHBoxLayout()
         format_label = QLabel("Format zapisu:")
@@ -128,6 +218,89 @@ class FilterWheelApp(QMainWindow):
         format_layout.addWidget(self.save_format_combo)
         camera_layout.addLayout(format_layout)
 
+        # Wyjście trybu automatycznego
+        output_layout = QHBoxLayout()
+        output_label = QLabel("Wyjście trybu auto:")
+        self.auto_output_combo = QComboBox()
+        self.auto_output_combo.addItem("Osobne pliki", None)
+        self.auto_output_combo.addItem("Kostka TIFF (wielostronicowa)", TiffCubeWriter)
+        self.auto_output_combo.addItem("Kostka NPY (memmap)", MemmapCubeWriter)
+        output_layout.addWidget(output_label)
+        output_layout.addWidget(self.auto_output_combo)
+        camera_layout.addLayout(output_layout)
+
+        # Seria klatek z pełną szybkością sensora (zapis do .npy z wątku akwizycji)
+        burst_layout = QHBoxLayout()
+        burst_label = QLabel("Seria klatek:")
+        self.burst_frames_spinbox = QSpinBox()
+        self.burst_frames_spinbox.setRange(2, 100000)
+        self.burst_frames_spinbox.setValue(100)
+        self.burst_button = QPushButton("Nagraj serię")
+        self.burst_button.setCheckable(True)
+        self.burst_button.clicked.connect(self.toggle_burst)
+        burst_layout.addWidget(burst_label)
+        burst_layout.addWidget(self.burst_frames_spinbox)
+        burst_layout.addWidget(self.burst_button)
+        camera_layout.addLayout(burst_layout)
+
+        # Kalibracja na żywo: objazd koła i mnożniki ekspozycji względem referencji
+        calibration_layout = QHBoxLayout()
+        calibration_label = QLabel("Kalibracja, referencja:")
+        self.calibration_ref_spinbox = QSpinBox()
+        self.calibration_ref_spinbox.setRange(1, 8)
+        self.calibration_ref_spinbox.setPrefix("poz. ")
+        self.calibration_ref_spinbox.setValue(self.reference_position())
+        self.calibration_button = QPushButton("Kalibruj na żywo")
+        self.calibration_button.setCheckable(True)
+        self.calibration_button.clicked.connect(self.toggle_live_calibration)
+        calibration_layout.addWidget(calibration_label)
+        calibration_layout.addWidget(self.calibration_ref_spinbox)
+        calibration_layout.addWidget(self.calibration_button)
+        camera_layout.addLayout(calibration_layout)
+
+        # Korekcja dark/flat zapisywanych klatek (i opcjonalnie podglądu)
+        correction_layout = QHBoxLayout()
+        correction_label = QLabel("Korekcja dark/flat:")
+        self.correction_save_checkbox = QCheckBox("Zapis")
+        self.correction_preview_checkbox = QCheckBox("Podgląd")
+        self.correction_preview_checkbox.toggled.connect(self.on_correction_preview_toggled)
+        self.correction_dtype_combo = QComboBox()
+        self.correction_dtype_combo.addItem("float32", DTYPE_FLOAT32)
+        self.correction_dtype_combo.addItem("uint16", DTYPE_UINT16)
+        self.correction_dtype_combo.currentIndexChanged.connect(self.on_correction_dtype_changed)
+        correction_layout.addWidget(correction_label)
+        correction_layout.addWidget(self.correction_save_checkbox)
+        correction_layout.addWidget(self.correction_preview_checkbox)
+        correction_layout.addWidget(self.correction_dtype_combo)
+        camera_layout.addLayout(correction_layout)
+
+        # Nagrywanie wzorców: dark dla bieżącej ekspozycji/gain, flat dla bieżącej pozycji
+        masters_layout = QHBoxLayout()
+        masters_label = QLabel("Wzorce, klatki:")
+        self.master_frames_spinbox = QSpinBox()
+        self.master_frames_spinbox.setRange(1, 256)
+        self.master_frames_spinbox.setValue(16)
+        self.master_dark_button = QPushButton("Nagraj dark")
+        self.master_dark_button.clicked.connect(lambda: self.capture_master("dark"))
+        self.master_flat_button = QPushButton("Nagraj flat")
+        self.master_flat_button.clicked.connect(lambda: self.capture_master("flat"))
+        masters_layout.addWidget(masters_label)
+        masters_layout.addWidget(self.master_frames_spinbox)
+        masters_layout.addWidget(self.master_dark_button)
+        masters_layout.addWidget(self.master_flat_button)
+        camera_layout.addLayout(masters_layout)
+
+        # Tryb kontrastu podglądu
+        contrast_layout = QHBoxLayout()
+        contrast_label = QLabel("Kontrast podglądu:")
+        self.contrast_mode_combo = QComboBox()
+        self.contrast_mode_combo.addItem("Min/Max", ContrastEngine.MODE_MINMAX)
+        self.contrast_mode_combo.addItem("Percentyle (stabilny)", ContrastEngine.MODE_PERCENTILE)
+        self.contrast_mode_combo.currentIndexChanged.connect(self.on_contrast_mode_changed)
+        contrast_layout.addWidget(contrast_label)
+        contrast_layout.addWidget(self.contrast_mode_combo)
+        camera_layout.addLayout(contrast_layout)
+
         camera_group_box.setLayout(camera_layout)
 
         # --- Panel Koła Filtrów ---
@@ -169,11 +342,15 @@ class FilterWheelApp(QMainWindow):
         self.status_current_filter_label = QLabel("Aktualny filtr: ?")
         self.status_auto_mode_label = QLabel("Tryb Auto: ⚪ Nieaktywny")
         self.status_auto_mode_label.setStyleSheet("font-weight: bold;")
+        self.status_frames_label = QLabel("Klatki: -")
+        self.status_save_label = QLabel("Zapis: ⚪ Bezczynny")
 
         status_layout.addWidget(self.status_camera_label)
         status_layout.addWidget(self.status_filter_label)
         status_layout.addWidget(self.status_current_filter_label)
         status_layout.addWidget(self.status_auto_mode_label)
+        status_layout.addWidget(self.status_frames_label)
+        status_layout.addWidget(self.status_save_label)
         status_group_box.setLayout(status_layout)
 
         # Dodanie paneli do prawej kolumny
@@ -183,8 +360,45 @@ class FilterWheelApp(QMainWindow):
         right_column_layout.addStretch(1)
         main_layout.addLayout(right_column_layout, stretch=0)
 
-        # Start systemu
-        self.start_camera_service()
+        # Zapis obrazów w tle (ograniczona kolejka)
+        self.save_queue = ImageSaveQueue()
+        self.save_queue.error.connect(self.on_image_save_error)
+        self.save_queue.pending_changed.connect(self.on_save_pending_changed)
+        self.save_queue.start()
+
+        # Kolejka zleceń ruchu koła (scalanie celów, Następny/Poprzedni bez blokowania)
+        self.wheel_queue = WheelCommandQueue()
+        self.wheel_queue.queue_changed.connect(self.on_wheel_queue_changed)
+        self.wheel_queue.target_reached.connect(self.on_wheel_target_reached)
+
+        # Harmonogram trybu automatycznego (ruch koła / klatka / zapis w potoku)
+        self.scan_scheduler = ScanScheduler(self.save_queue)
+        self.scan_scheduler.exposure_requested.connect(self.exposure_spinbox.setValue)
+        self.scan_scheduler.progress.connect(self.status_auto_mode_label.setText)
+        self.scan_scheduler.error.connect(self.show_error_message)
+        self.scan_scheduler.step_finished.connect(self.on_scan_step_finished)
+        self.scan_scheduler.scan_finished.connect(self.on_scan_finished)
+
+        # Sesja poklatkowa (powtarzanie skanów harmonogramu)
+        self.timelapse = TimeLapseScheduler(self.scan_scheduler, self.save_queue)
+        self.timelapse.progress.connect(self.status_auto_mode_label.setText)
+        self.timelapse.session_finished.connect(self.on_timelapse_finished)
+
+        # Kalibracja na żywo (zapis mnożników do config.json)
+        self.live_calibrator = LiveCalibrator()
+        self.live_calibrator.exposure_requested.connect(self.exposure_spinbox.setValue)
+        self.live_calibrator.progress.connect(self.status_auto_mode_label.setText)
+        self.live_calibrator.error.connect(self.show_error_message)
+        self.live_calibrator.finished.connect(self.on_live_calibration_finished)
+
+        # Odświeżanie statystyk klatek (1 Hz)
+        self.frame_stats_timer = QTimer(self)
+        self.frame_stats_timer.timeout.connect(self.update_frame_statistics)
+        self.frame_stats_timer.start(1000)
+
+        # Start systemu dopiero po wyświetleniu okna; kamera i koło łączą się równolegle
+        self._mark_startup("window_built_ms", "okno zbudowane")
+        QTimer.singleShot(0, self.start_devices)
 
     # ---------------------------------------------------
     # Metody Konfiguracji
@@ -200,88 +414,208 @@ class FilterWheelApp(QMainWindow):
             print(f"Błąd konfiguracji: {e}")
             self.filter_config = {}
 
+    def reference_position(self):
+        """Pozycja filtra referencyjnego z config.json (nazwa z "(Ref)"), domyślnie 1."""
+        for position, item in self.filter_config.items():
+            if item.get('name', '').endswith(REF_SUFFIX):
+                return position
+        return 1
+
+    def apply_filter_config(self, filters):
+        """Podmienia konfigurację filtrów (np. po kalibracji) i odświeża przyciski."""
+        self.filter_config = {item['position']: item for item in filters}
+        for i, button in enumerate(self.filter_buttons, start=1):
+            button.setText(self.filter_config.get(i, {}).get('name', f'Filtr {i}'))
+        config_name = self.filter_config.get(self.current_filter_pos, {}).get('name', f'Pozycja {self.current_filter_pos}')
+        self.status_current_filter_label.setText(f"Aktualny filtr: {config_name}")
+        self.recalculate_current_exposure()
+
+    @Slot()
+    def start_devices(self):
+        """Uruchamia kamerę i koło filtrów (każde we własnym wątku) oraz import modułów w tle."""
+        self._mark_startup("window_shown_ms", "okno wyświetlone")
+        threading.Thread(target=preload_modules, name="PreloadModules", daemon=True).start()
+        self.start_camera_service()
+        self.start_wheel_connection()
+
+    def _mark_startup(self, phase, label):
+        """Zapisuje i wypisuje czas etapu startu; po podglądzie i kole - podsumowanie."""
+        if phase in self.startup_timings:
+            return
+        self.startup_timings[phase] = round((time.perf_counter() - _process_start) * 1000, 1)
+        print(f"[Start] {label}: {self.startup_timings[phase]:.0f} ms")
+        if phase in ("first_preview_ms", "wheel_ready_ms") and \
+                "first_preview_ms" in self.startup_timings and "wheel_ready_ms" in self.startup_timings:
+            print(f"[Start] Etapy startu: {self.startup_timings}")
+
+    @Slot(dict)
+    def on_camera_started(self, timings):
+        self.startup_timings["camera"] = timings
+        self._mark_startup("camera_ready_ms", f"kamera gotowa {timings}")
+
+    def _setup_simulation(self):
+        """Podmienia sprzęt na backendy symulowane (pomiary bez kamery i koła)."""
+        from simulation import SimulatedScene, SimulatedCameraSDK, Esp32Emulator
+
+        scene = SimulatedScene()
+        self.camera_sdk_factory = functools.partial(SimulatedCameraSDK, scene=scene)
+        self.wheel_emulator = Esp32Emulator(scene=scene)
+        self.serial_port = self.wheel_emulator.start()
+        print(f"Tryb symulacji: emulator koła na {self.serial_port}")
+
     def start_camera_service(self):
         """Uruchamia dedykowany wątek obsługi kamery."""
         self.camera_thread = QThread()
-        self.camera_worker = RealCameraService()
+        self.camera_worker = RealCameraService(sdk_factory=self.camera_sdk_factory)
 
         self.camera_worker.moveToThread(self.camera_thread)
 
+        # Podgląd 8-bit przygotowywany w osobnym wątku
+        self.preview_renderer = PreviewRenderer(self.camera_worker.preview_mailbox, self.preview_max_fps)
+        self.preview_renderer.set_display_size(self.image_label.width(), self.image_label.height())
+        self.preview_renderer.preview_ready.connect(self.update_image_label)
+        self.preview_renderer.start()
+
         # Podłączenie sygnałów
-        self.camera_worker.new_image.connect(self.update_image_label)
         self.camera_worker.error.connect(self.show_error_message)
         self.camera_worker.status.connect(self.update_camera_status)
         self.camera_worker.gain_supported.connect(self.on_gain_supported)
+        self.camera_worker.streaming_started.connect(self.on_camera_started)
 
         # Sterowanie (GUI -> Worker)
         self.exposure_spinbox.valueChanged.connect(self.camera_worker.set_exposure)
         self.gain_spinbox.valueChanged.connect(self.camera_worker.set_gain)
+        self.scan_scheduler.capture_requested.connect(self.camera_worker.request_capture)
+        self.scan_scheduler.stack_requested.connect(self.camera_worker.request_stack)
+        self.scan_scheduler.auto_exposed_requested.connect(self.camera_worker.request_auto_exposed)
+        self.scan_scheduler.capture_cancelled.connect(self.camera_worker.cancel_capture)
+        self.camera_worker.frame_captured.connect(self.scan_scheduler.on_frame_captured)
+        self.live_calibrator.capture_requested.connect(self.camera_worker.request_capture)
+        self.live_calibrator.capture_cancelled.connect(self.camera_worker.cancel_capture)
+        self.camera_worker.frame_captured.connect(self.live_calibrator.on_frame_captured)
+        self.master_stack_requested.connect(self.camera_worker.request_stack)
+        self.master_capture_cancelled.connect(self.camera_worker.cancel_capture)
+        self.camera_worker.frame_captured.connect(self.on_master_frame_captured)
+        self.burst_requested.connect(self.camera_worker.start_burst)
+        self.burst_stop_requested.connect(self.camera_worker.stop_burst)
+        self.camera_worker.burst_finished.connect(self.on_burst_finished)
 
         self.camera_thread.started.connect(self.camera_worker.start_streaming)
         self.camera_thread.start()
 
+    def start_wheel_connection(self):
+        """Otwiera stałe połączenie z kołem filtrów w dedykowanym wątku."""
+        self.wheel_thread = QThread()
+        self.wheel_connection = FilterWheelConnection(
+            self.serial_port, self.serial_baud, telemetry_decimation=self.telemetry_decimation
+        )
+
+        self.wheel_connection.moveToThread(self.wheel_thread)
+
+        self.wheel_connection.serial_response.connect(self.handle_filter_response)
+        self.wheel_connection.error.connect(self.handle_filter_error)
+        self.wheel_connection.status.connect(self.update_filter_status)
+        self.wheel_connection.ready.connect(self.on_wheel_ready)
+
+        self.wheel_command_requested.connect(self.wheel_connection.send_command)
+        self.wheel_queue.command_requested.connect(self.wheel_connection.send_command)
+        self.wheel_connection.serial_response.connect(self.wheel_queue.on_response)
+        self.wheel_connection.error.connect(self.wheel_queue.on_error)
+        self.wheel_connection.finished.connect(self.wheel_queue.on_finished)
+        self.wheel_connection.ready.connect(self.wheel_queue.set_position)
+        self.scan_scheduler.wheel_command_requested.connect(self.wheel_connection.send_command)
+        self.wheel_connection.serial_response.connect(self.scan_scheduler.on_wheel_response)
+        self.wheel_connection.move_completed.connect(self.scan_scheduler.on_wheel_move)
+        self.wheel_connection.move_completed.connect(self.on_wheel_move_completed)
+        self.wheel_connection.homing_reported.connect(self.on_homing_reported)
+        self.wheel_connection.error.connect(self.scan_scheduler.on_wheel_error)
+        self.live_calibrator.wheel_command_requested.connect(self.wheel_connection.send_command)
+        self.wheel_connection.serial_response.connect(self.live_calibrator.on_wheel_response)
+        self.wheel_connection.error.connect(self.live_calibrator.on_wheel_error)
+
+        self.wheel_thread.started.connect(self.wheel_connection.open)
+        self.wheel_thread.start()
+
     # ---------------------------------------------------
     # Obsługa Koła Filtrów
     # ---------------------------------------------------
     @Slot(int)
     def request_filter_change(self, filter_number):
-        if self.is_filter_wheel_busy:
-            if not self.auto_mode_active:
-                self.show_error_message("Koło filtrów jest zajęte. Poczekaj.")
-            return
-
+        # Zlecenie w trakcie ruchu zastępuje poprzedni oczekujący cel
         print(f"Zmiana na filtr: {filter_number}")
-        self.is_filter_wheel_busy = True
-        self.status_filter_label.setText("Koło: 🟡 Wysyłam polecenie...")
-
-        # Uruchomienie workera w puli wątków
-        command = f"GOTO:{filter_number}\n"
-        worker = RealSerialWorker(self.serial_port, self.serial_baud, command)
+        self.wheel_queue.request_target(filter_number)
 
-        worker.signals.serial_response.connect(self.handle_filter_response)
-        worker.signals.error.connect(self.handle_filter_error)
-        worker.signals.finished.connect(self.on_filter_task_finished)
-        worker.signals.status.connect(self.update_filter_status)
+    @Slot(int, int)
+    def on_wheel_queue_changed(self, in_flight, pending):
+        if pending:
+            self.status_filter_label.setText(f"Koło: 🟡 Ruch do {in_flight}, następnie {pending}")
+        elif in_flight:
+            self.status_filter_label.setText(f"Koło: 🟡 Ruch do {in_flight}")
 
-        self.thread_pool.start(worker)
+    @Slot(int)
+    def on_wheel_target_reached(self, position):
+        self.status_filter_label.setText("Koło filtrów: ✅ Gotowe")
+        print(f"Koło na pozycji docelowej: {position}")
 
     @Slot(str)
     def handle_filter_response(self, response):
         print(f"Odpowiedź koła: {response}")
-        if response.startswith("OK:"):
+        if response.startswith("OK:") or response.startswith("AT:"):
             filter_num = int(response.split(":")[-1])
             self.current_filter_pos = filter_num
+            if self.preview_renderer:
+                self.preview_renderer.position = filter_num
             self.status_filter_label.setText("Koło filtrów: ✅ Gotowe")
 
             # Aktualizacja GUI
             config_name = self.filter_config.get(filter_num, {}).get('name', f'Pozycja {filter_num}')
             self.status_current_filter_label.setText(f"Aktualny filtr: {config_name}")
 
-            # Przeliczenie ekspozycji na podstawie mnożnika
+            # Przeliczenie ekspozycji na podstawie mnożnika (w trybie auto i kalibracji ustawia ją harmonogram)
             multiplier = self.filter_config.get(filter_num, {}).get('exposure_multiplier')
-            if multiplier is not None:
+            if multiplier is not None and not self.scan_scheduler.active and not self.live_calibrator.active:
                 base_val = self.base_exposure_spinbox.value()
-                calculated_exposure = base_val * multiplier
-                if not self.auto_mode_active:
-                    self.exposure_spinbox.setValue(calculated_exposure)
-
-            # Kontynuacja trybu automatycznego
-            if self.auto_mode_active:
-                self._auto_mode_set_exposure_and_wait()
+                self.exposure_spinbox.setValue(base_val * multiplier)
 
-        elif response.startswith("ERROR:"):
+        elif response.startswith("ERROR:") and not self.scan_scheduler.active and not self.live_calibrator.active:
+            # Podczas skanu i kalibracji błędy koła obsługuje (i zgłasza) harmonogram
             self.handle_filter_error(response)
-            if self.auto_mode_active:
-                self.stop_auto_mode(error=True)
 
     @Slot(str)
     def handle_filter_error(self, error_message):
         self.status_filter_label.setText("Koło filtrów: ❌ Błąd")
         self.show_error_message(error_message)
 
-    @Slot()
-    def on_filter_task_finished(self):
-        self.is_filter_wheel_busy = False
+    @Slot(int)
+    def on_wheel_ready(self, position):
+        """Synchronizuje pozycję zgłoszoną przez sterownik po połączeniu."""
+        self._mark_startup("wheel_ready_ms", "koło gotowe")
+        if position < 1:
+            return
+        self.current_filter_pos = position
+        if self.preview_renderer:
+            self.preview_renderer.position = position
+        config_name = self.filter_config.get(position, {}).get('name', f'Pozycja {position}')
+        self.status_current_filter_label.setText(f"Aktualny filtr: {config_name}")
+
+    @Slot(dict)
+    def on_homing_reported(self, result):
+        """Podsumowanie bazowania sterownika po resecie (linia HOMED)."""
+        print(
+            f"Bazowanie: {result['duration_ms']} ms, kroki korekcji {result['correction_steps']}, "
+            f"błąd końcowy {result['final_error_deg']}°"
+        )
+
+    @Slot(dict)
+    def on_wheel_move_completed(self, result):
+        """Podsumowanie profilu ruchu z telemetrii enkodera (gdy włączona)."""
+        profile = result.get("profile")
+        if profile is None:
+            return
+        print(
+            f"Ruch do {result['position']}: jazda {profile['travel_ms']} ms, "
+            f"domykanie {profile['settle_ms']} ms, przeregulowanie {profile['overshoot_deg']}°"
+        )
 
     @Slot(str)
     def update_filter_status(self, message):
@@ -298,37 +632,51 @@ class FilterWheelApp(QMainWindow):
     # ---------------------------------------------------
     # Obsługa Kamery i Obrazu
     # ---------------------------------------------------
-    @Slot(np.ndarray)
-    def update_image_label(self, cv_img_16bit):
+    @Slot()
+    def update_image_label(self):
         """
-        Odbiera i wyświetla obraz.
-        1. Zapisuje surowe dane 16-bit.
-        2. Normalizuje i konwertuje do 8-bit dla podglądu.
+        Wyświetla gotowy podgląd 8-bit przygotowany przez PreviewRenderer.
+        1. Przechowuje klatkę 16-bit z puli (bez kopiowania), zwalniając poprzednią.
+        2. Wyświetla obraz już przeskalowany do rozmiaru etykiety.
         """
+        preview = self.preview_renderer.display_mailbox.take() if self.preview_renderer else None
+        if preview is None:
+            return
         try:
-            self.current_science_frame = cv_img_16bit.copy()
-
-            if cv_img_16bit.ndim == 2:
-                # Normalizacja (Auto-Contrast) dla podglądu
-                display_img_8bit = cv2.normalize(
-                    cv_img_16bit, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U
-                )
-                height, width = display_img_8bit.shape
-                bytes_per_line = width
-                q_img = QImage(display_img_8bit.data, width, height, bytes_per_line, QImage.Format.Format_Grayscale8)
-            else:
-                self.image_label.clear()
-                return
-
-            pixmap = QPixmap.fromImage(q_img)
-            self.image_label.setPixmap(pixmap.scaled(
-                self.image_label.size(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            ))
+            if self.current_science_frame is not None:
+                self.current_science_frame.release()
+            self.current_science_frame = preview.frame
+
+            display_img_8bit = preview.image
+            height, width = display_img_8bit.shape
+            bytes_per_line = display_img_8bit.strides[0]
+            q_img = QImage(display_img_8bit.data, width, height, bytes_per_line, QImage.Format.Format_Grayscale8)
+            self.image_label.setPixmap(QPixmap.fromImage(q_img))
+            self._mark_startup("first_preview_ms", "pierwszy podgląd")
         except Exception as e:
             print(f"Błąd wyświetlania: {e}")
 
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.preview_renderer:
+            self.preview_renderer.set_display_size(self.image_label.width(), self.image_label.height())
+
+    @Slot(int)
+    def on_contrast_mode_changed(self, index):
+        if self.preview_renderer:
+            self.preview_renderer.contrast.set_mode(self.contrast_mode_combo.itemData(index))
+
+    @Slot()
+    def update_frame_statistics(self):
+        if not self.camera_worker:
+            return
+        stats = self.camera_worker.frame_statistics()
+        display_mailbox = self.preview_renderer.display_mailbox
+        self.status_frames_label.setText(
+            f"Klatki: pozyskane {stats['acquired']} / wyświetlone {display_mailbox.taken_count}"
+            f" / pominięte {stats['dropped'] + display_mailbox.dropped_count}"
+        )
+
     @Slot(str)
     def update_camera_status(self, message):
         self.status_camera_label.setText(message)
@@ -373,38 +721,197 @@ class FilterWheelApp(QMainWindow):
         )
 
         if file_path:
-            self._save_image_to_path(file_path, force_format_str=selected_filter)
+            if not self._save_image_to_path(file_path, force_format_str=selected_filter):
+                self.show_error_message("Kolejka zapisu jest pełna. Spróbuj ponownie za chwilę.")
 
     def _save_image_to_path(self, file_path, force_format_str=""):
-        """Logika zapisu obrazu z obsługą formatów 16-bit i 8-bit."""
-        if self.current_science_frame is None:
+        """
+        Zleca zapis bieżącej klatki (16-bit lub 8-bit) do wątku zapisu;
+        z włączoną korekcją klatka jest korygowana w wątku zapisu.
+        Zwraca False, gdy brak klatki lub kolejka zapisu jest pełna.
+        """
+        frame = self.current_science_frame
+        if frame is None:
             return False
+        if not self.correction_save_checkbox.isChecked():
+            return self.save_queue.submit(file_path, frame, force_format_str)
+        correction = self.corrector.plan(frame, self.current_filter_pos)
+        print(f"Korekcja: dark {correction.info['dark']}, flat {correction.info['flat']}")
+        return self.save_queue.submit_task(
+            lambda image: write_image(file_path, correction.apply(image), force_format_str), frame, file_path
+        )
+
+    @Slot(str)
+    def on_image_save_error(self, message):
+        self.show_error_message(message)
+        self.stop_auto_mode(error=True)
 
+    @Slot(int)
+    def on_save_pending_changed(self, pending):
+        if pending:
+            self.status_save_label.setText(f"Zapis: 🟡 W kolejce {pending}")
+        else:
+            self.status_save_label.setText("Zapis: ✅ Bezczynny")
+
+    # ---------------------------------------------------
+    # Korekcja Dark/Flat
+    # ---------------------------------------------------
+    @Slot(bool)
+    def on_correction_preview_toggled(self, checked):
+        if self.preview_renderer:
+            self.preview_renderer.position = self.current_filter_pos
+            self.preview_renderer.corrector = self.corrector if checked else None
+
+    @Slot(int)
+    def on_correction_dtype_changed(self, index):
+        self.corrector.dtype = self.correction_dtype_combo.itemData(index)
+
+    def capture_master(self, kind):
+        """Zamawia średnią N klatek jako master dark (bieżąca ekspozycja/gain) lub flat (bieżąca pozycja)."""
+        if self._master_request is not None or self.camera_worker is None:
+            return
+        if kind == "flat" and self.current_filter_pos < 1:
+            self.show_error_message("Nieznana pozycja koła - flat wymaga ustawionego filtra.")
+            return
+        prompt = ("Zasłoń obiektyw. Dark zostanie nagrany dla bieżącej ekspozycji i wzmocnienia."
+                  if kind == "dark" else
+                  "Skieruj kamerę na równomiernie oświetlony wzorzec. Flat zostanie nagrany dla bieżącej pozycji koła.")
+        if QMessageBox.question(self, "Klatki wzorcowe", prompt) != QMessageBox.StandardButton.Yes:
+            return
+
+        frames = self.master_frames_spinbox.value()
+        request_id = next_capture_id()
+        self._master_request = (request_id, kind, self.current_filter_pos)
+        self.set_ui_enabled(False)
+        self.auto_mode_button.setEnabled(False)
+        self.status_auto_mode_label.setText(f"Wzorce: 🟡 Nagrywanie ({kind}, {frames} kl.)")
+        # Odrzucanie 3σ usuwa z wzorca promienie kosmiczne (gorące piksele są stałe i zostają)
+        self.master_stack_requested.emit(request_id, frames, 3.0, False)
+        timeout_ms = int(self.exposure_spinbox.value() * frames * 3) + self.master_capture_timeout_ms
+        QTimer.singleShot(timeout_ms, lambda: self._on_master_capture_timeout(request_id))
+
+    def _on_master_capture_timeout(self, request_id):
+        if self._master_request is not None and self._master_request[0] == request_id:
+            self.master_capture_cancelled.emit(request_id)
+            self._finish_master_capture("Wzorce: ❌ Brak klatek z kamery")
+
+    def _finish_master_capture(self, status):
+        self._master_request = None
+        self.auto_mode_button.setEnabled(True)
+        self.set_ui_enabled(True)
+        self.status_auto_mode_label.setText(status)
+
+    @Slot(int, object)
+    def on_master_frame_captured(self, request_id, frame):
+        if self._master_request is None or request_id != self._master_request[0]:
+            return  # Zamówienie innego odbiorcy
+        _, kind, position = self._master_request
         try:
-            save_as_16bit = True
-
-            # Decyzja o formacie na podstawie wyboru użytkownika i rozszerzenia
-            if "PNG" in force_format_str or "8-bit" in force_format_str:
-                save_as_16bit = False
-            if file_path.lower().endswith('.png') or file_path.lower().endswith('.jpg'):
-                save_as_16bit = False
-
-            if save_as_16bit:
-                # Zapis naukowy (16-bit TIFF)
-                tifffile.imwrite(file_path, self.current_science_frame)
-                print(f"Zapisano (16-bit): {file_path}")
+            if kind == "dark":
+                path = self.masters.store_dark(frame.image, frame.exposure_us, frame.gain_db)
             else:
-                # Zapis podglądu (8-bit z auto-kontrastem)
-                img_8bit = cv2.normalize(
-                    self.current_science_frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U
-                )
-                cv2.imwrite(file_path, img_8bit)
-                print(f"Zapisano (8-bit): {file_path}")
-
-            return True
-        except Exception as e:
-            self.show_error_message(f"Błąd zapisu: {e}")
-            return False
+                path, dark_info = self.masters.store_flat(frame.image, position, frame.exposure_us, frame.gain_db)
+                if dark_info is None:
+                    print("Korekcja: flat nagrany bez darka dla tego wzmocnienia - zawiera poziom ciemny.")
+        except (OSError, ValueError) as e:
+            self._finish_master_capture("Wzorce: ❌ Błąd")
+            self.show_error_message(f"Nie można zapisać wzorca: {e}")
+            return
+        finally:
+            frame.release()
+        print(f"Korekcja: {describe_masters(self.masters)}")
+        self._finish_master_capture(f"Wzorce: ✅ {os.path.basename(path)}")
+
+    # ---------------------------------------------------
+    # Seria Klatek
+    # ---------------------------------------------------
+    @Slot(bool)
+    def toggle_burst(self, checked):
+        if not checked:
+            self.burst_stop_requested.emit()
+            self.burst_button.setText("Nagraj serię")
+            self.auto_mode_button.setEnabled(True)
+            self.calibration_button.setEnabled(True)
+            self.master_dark_button.setEnabled(True)
+            self.master_flat_button.setEnabled(True)
+            return
+        try:
+            burst_dir = create_scan_directory(self.output_base_dir, prefix="burst")
+        except OSError as e:
+            self.burst_button.setChecked(False)
+            self.show_error_message(f"Nie można utworzyć katalogu serii: {e}")
+            return
+        self.burst_button.setText("Przerwij serię")
+        self.auto_mode_button.setEnabled(False)
+        self.calibration_button.setEnabled(False)
+        self.master_dark_button.setEnabled(False)
+        self.master_flat_button.setEnabled(False)
+        self.status_auto_mode_label.setText("Seria: 🔴 Nagrywanie")
+        self.burst_requested.emit(os.path.join(burst_dir, "burst.npy"), self.burst_frames_spinbox.value())
+
+    @Slot(dict)
+    def on_burst_finished(self, summary):
+        self.burst_button.setChecked(False)
+        self.burst_button.setText("Nagraj serię")
+        self.auto_mode_button.setEnabled(True)
+        self.calibration_button.setEnabled(True)
+        self.master_dark_button.setEnabled(True)
+        self.master_flat_button.setEnabled(True)
+        self.status_auto_mode_label.setText(
+            f"Seria: ⚪ {summary['recorded_frames']} klatek, utracone {summary['dropped_sdk']}"
+        )
+        fps = f"{summary['fps']:.1f} kl./s" if summary["fps"] else "-"
+        print(
+            f"Seria: {summary['recorded_frames']}/{summary['requested_frames']} klatek w {summary['duration_s']:.3f} s "
+            f"({fps}), utracone przez SDK: {summary['dropped_sdk']} -> {summary['metadata_file']}"
+        )
+
+    # ---------------------------------------------------
+    # Kalibracja na żywo
+    # ---------------------------------------------------
+    @Slot(bool)
+    def toggle_live_calibration(self, checked):
+        if not checked:
+            self.live_calibrator.stop()
+            return
+        if self.wheel_queue.is_busy():
+            self.calibration_button.setChecked(False)
+            self.show_error_message("Koło filtrów jest w ruchu. Poczekaj na dojazd.")
+            return
+        # Ekspozycja startowa z dotychczasowego mnożnika - zwykle bez powtórek pomiaru
+        base_exposure = self.base_exposure_spinbox.value()
+        filters = []
+        for position in range(1, self.wheel_queue.filter_count + 1):
+            entry = dict(self.filter_config.get(position, {}), position=position)
+            entry.setdefault('name', f'Filtr {position}')
+            entry['exposure_ms'] = base_exposure * entry.get('exposure_multiplier', 1.0)
+            filters.append(entry)
+
+        self.calibration_button.setText("Przerwij kalibrację")
+        self.set_ui_enabled(False)
+        self.calibration_button.setEnabled(True)
+        self.auto_mode_button.setEnabled(False)
+        self.live_calibrator.start(
+            filters, self.calibration_ref_spinbox.value(),
+            config_path="config.json", start_position=self.current_filter_pos,
+        )
+
+    @Slot(dict)
+    def on_live_calibration_finished(self, summary):
+        self.calibration_button.setChecked(False)
+        self.calibration_button.setText("Kalibruj na żywo")
+        self.auto_mode_button.setEnabled(True)
+        self.set_ui_enabled(True)
+        if not summary["completed"]:
+            status = "❌ Błąd" if summary["error"] else "⚪ Przerwano"
+            self.status_auto_mode_label.setText(f"Kalibracja: {status}")
+            return
+        self.apply_filter_config(summary["filters"])
+        self.status_auto_mode_label.setText(f"Kalibracja: ✅ Zapisano {summary['config_path']}")
+        for entry in summary["filters"]:
+            print(f"Kalibracja: {entry['name']} (pozycja {entry['position']}) - mnożnik x{entry['exposure_multiplier']}")
+        if summary["warnings"]:
+            self.show_error_message("\n".join(summary["warnings"]))
 
     # ---------------------------------------------------
     # Tryb Automatyczny
@@ -417,28 +924,81 @@ class FilterWheelApp(QMainWindow):
             self.stop_auto_mode()
 
     def start_auto_mode(self):
-        print("--- START TRYBU AUTO ---")
-        self.auto_mode_active = True
-        self.auto_mode_button.setText("Zatrzymaj Tryb Automatyczny")
+        if self.wheel_queue.is_busy():
+            self.auto_mode_button.setChecked(False)
+            self.show_error_message("Koło filtrów jest w ruchu. Poczekaj na dojazd.")
+            return
+        try:
+            positions = parse_band_selection(self.auto_bands_edit.text(), self.filter_config.keys())
+        except ValueError as e:
+            self.auto_mode_button.setChecked(False)
+            self.show_error_message(f"Niepoprawna lista pasm: {e}")
+            return
+        if not positions:
+            self.auto_mode_button.setChecked(False)
+            self.show_error_message("Brak pasm do skanowania (sprawdź config.json).")
+            return
 
-        self.auto_mode_steps = [
-            self.filter_config[key] for key in sorted(self.filter_config.keys())
-        ]
-        self.auto_mode_current_step = 0
-        self.status_auto_mode_label.setText("Tryb Auto: 🟡 Uruchamianie...")
+        self.auto_mode_button.setText("Zatrzymaj Tryb Automatyczny")
         self.set_ui_enabled(False)
-        self._run_auto_mode_step()
+        self.scan_scheduler.frames_per_band = self.frames_per_band_spinbox.value()
+        self.scan_scheduler.sigma_clip = 3.0 if self.sigma_clip_checkbox.isChecked() else 0.0
+        self.scan_scheduler.save_variance = self.save_variance_checkbox.isChecked()
+        self.scan_scheduler.auto_exposure = AutoExposure() if self.auto_exposure_checkbox.isChecked() else None
+        self.scan_scheduler.corrector = self.corrector if self.correction_save_checkbox.isChecked() else None
+        scan = self.timelapse if self.timelapse_duration_spinbox.value() > 0 else self.scan_scheduler
+        if scan is self.timelapse:
+            self.timelapse.interval_s = self.timelapse_interval_spinbox.value()
+            self.timelapse.duration_s = self.timelapse_duration_spinbox.value() * 60.0
+            self.timelapse.keep_scans = self.timelapse_keep_spinbox.value()
+        scan.start(
+            [self.filter_config[position] for position in positions],
+            self.base_exposure_spinbox.value(),
+            format_str=self.save_format_combo.currentText(),
+            cube_class=self.auto_output_combo.currentData(),
+            output_base_dir=self.output_base_dir,
+            start_position=self.current_filter_pos,
+        )
 
     def stop_auto_mode(self, error=False):
-        print("--- STOP TRYBU AUTO ---")
-        self.auto_mode_active = False
+        if self.timelapse.active:
+            self.timelapse.stop(error)
+        else:
+            self.scan_scheduler.stop(error)
+
+    def _finish_auto_mode(self, error):
         self.auto_mode_button.setChecked(False)
         self.auto_mode_button.setText("Uruchom Tryb Automatyczny")
-
         status_text = "Tryb Auto: ❌ Błąd" if error else "Tryb Auto: ⚪ Zakończono"
         self.status_auto_mode_label.setText(status_text)
         self.set_ui_enabled(True)
 
+    @Slot(dict)
+    def on_scan_finished(self, summary):
+        print(
+            f"Skan: {summary['bands']} pasm w {summary['total_ms']:.0f} ms "
+            f"(ekspozycje {summary['exposure_sum_ms']:.0f} ms, ruchy koła {summary['move_sum_ms']:.0f} ms)"
+        )
+        # W sesji poklatkowej interfejs odblokowuje dopiero koniec sesji
+        if not self.timelapse.active:
+            self._finish_auto_mode(summary["error"])
+
+    @Slot(dict)
+    def on_timelapse_finished(self, summary):
+        self._finish_auto_mode(summary["error"])
+        print(
+            f"Sesja: {summary['scans']} skanów w {summary['elapsed_s']:.0f} s, "
+            f"największy dryf startu {summary['max_start_drift_ms']:.0f} ms, spóźnione starty {summary['overruns']}"
+        )
+
+    @Slot(dict)
+    def on_scan_step_finished(self, timing):
+        print(
+            f"Pasmo {timing['name']} (pozycja {timing['position']}, {timing['delta']:+d}): ruch {timing['move_ms']:.0f} ms "
+            f"(sterownik {timing['wheel_ms']} ms), klatka {timing['capture_ms']:.0f} ms, krok {timing['step_ms']:.0f} ms"
+            + (f", dobór ekspozycji {timing['exposure_iterations']} kl." if "exposure_iterations" in timing else "")
+        )
+
     def set_ui_enabled(self, enabled):
         """Blokuje/odblokowuje interfejs podczas pracy automatycznej."""
         for button in self.filter_buttons:
@@ -449,6 +1009,24 @@ class FilterWheelApp(QMainWindow):
         self.exposure_spinbox.setEnabled(enabled)
         self.gain_spinbox.setEnabled(enabled)
         self.save_format_combo.setEnabled(enabled)
+        self.auto_output_combo.setEnabled(enabled)
+        self.auto_bands_edit.setEnabled(enabled)
+        self.frames_per_band_spinbox.setEnabled(enabled)
+        self.sigma_clip_checkbox.setEnabled(enabled)
+        self.save_variance_checkbox.setEnabled(enabled)
+        self.auto_exposure_checkbox.setEnabled(enabled)
+        self.timelapse_interval_spinbox.setEnabled(enabled)
+        self.timelapse_duration_spinbox.setEnabled(enabled)
+        self.timelapse_keep_spinbox.setEnabled(enabled)
+        self.burst_frames_spinbox.setEnabled(enabled)
+        self.burst_button.setEnabled(enabled)
+        self.calibration_ref_spinbox.setEnabled(enabled)
+        self.calibration_button.setEnabled(enabled)
+        self.correction_save_checkbox.setEnabled(enabled)
+        self.correction_dtype_combo.setEnabled(enabled)
+        self.master_frames_spinbox.setEnabled(enabled)
+        self.master_dark_button.setEnabled(enabled)
+        self.master_flat_button.setEnabled(enabled)
 
         # Inteligentne odblokowanie Gain (tylko jeśli dostępny)
         if enabled and "N/A" not in self.gain_spinbox.suffix():
@@ -456,77 +1034,17 @@ class FilterWheelApp(QMainWindow):
         elif not enabled:
             self.gain_spinbox.setEnabled(False)
 
-    def _run_auto_mode_step(self):
-        """KROK 1: Zleć zmianę filtra."""
-        if not self.auto_mode_active:
-            return
-        if self.auto_mode_current_step >= len(self.auto_mode_steps):
-            self.stop_auto_mode()
-            return
-
-        step_data = self.auto_mode_steps[self.auto_mode_current_step]
-        name = step_data['name']
-        self.status_auto_mode_label.setText(
-            f"Tryb Auto: Krok {self.auto_mode_current_step + 1}/{len(self.auto_mode_steps)} ({name})"
-        )
-        self.request_filter_change(step_data['position'])
-
-    def _auto_mode_set_exposure_and_wait(self):
-        """KROK 2: Ustaw ekspozycję i czekaj na stabilizację."""
-        if not self.auto_mode_active:
-            return
-
-        step_data = self.auto_mode_steps[self.auto_mode_current_step]
-        multiplier = step_data.get('exposure_multiplier', 1.0)
-        base_val = self.base_exposure_spinbox.value()
-        target_exposure = base_val * multiplier
-
-        self.status_auto_mode_label.setText(f"Tryb Auto: Ekspozycja {target_exposure:.1f} ms")
-        self.exposure_spinbox.setValue(target_exposure)
-
-        # Czas na stabilizację sensora (1s)
-        QTimer.singleShot(1000, self._auto_mode_save_and_continue)
-
-    def _auto_mode_save_and_continue(self):
-        """KROK 3: Zapisz plik i przejdź dalej."""
-        if not self.auto_mode_active:
-            return
-
-        step_data = self.auto_mode_steps[self.auto_mode_current_step]
-        name = step_data['name']
-        format_setting = self.save_format_combo.currentText()
-
-        extension = ".png" if "PNG" in format_setting else ".tif"
-        file_name = f"auto_{name.replace(' ', '_').replace('/', '-')}{extension}"
-
-        self.status_auto_mode_label.setText(f"Tryb Auto: Zapis...")
-
-        if self._save_image_to_path(file_name, force_format_str=format_setting):
-            self.auto_mode_current_step += 1
-            self._run_auto_mode_step()
-        else:
-            self.stop_auto_mode(error=True)
-
     # ---------------------------------------------------
     # Pomocnicze
     # ---------------------------------------------------
     @Slot()
     def request_next_filter(self):
-        if self.current_filter_pos == 0:
-            self.request_filter_change(1)
-        elif self.current_filter_pos == 8:
-            self.request_filter_change(1)
-        else:
-            self.request_filter_change(self.current_filter_pos + 1)
+        # Względem ostatniego zleconego celu - kolejne kliknięcia sumują się
+        self.wheel_queue.request_step(1)
 
     @Slot()
     def request_prev_filter(self):
-        if self.current_filter_pos == 0:
-            self.request_filter_change(1)
-        elif self.current_filter_pos == 1:
-            self.request_filter_change(8)
-        else:
-            self.request_filter_change(self.current_filter_pos - 1)
+        self.wheel_queue.request_step(-1)
 
     @Slot(str)
     def show_error_message(self, message):
@@ -535,18 +1053,36 @@ class FilterWheelApp(QMainWindow):
 
     def closeEvent(self, event):
         self.stop_auto_mode()
+        self.live_calibrator.stop()
         if self.camera_worker:
             self.camera_worker.stop_streaming()
         if self.camera_thread:
             self.camera_thread.quit()
             self.camera_thread.wait()
-        self.is_filter_wheel_busy = True
-        self.thread_pool.waitForDone()
+        if self.preview_renderer:
+            self.preview_renderer.stop()
+        self.save_queue.stop()
+        if self.wheel_thread:
+            self.wheel_thread.quit()
+            self.wheel_thread.wait()
+        if self.wheel_connection:
+            self.wheel_connection.close()
+        if self.wheel_emulator:
+            self.wheel_emulator.stop()
         event.accept()
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = FilterWheelApp()
+    parser = argparse.ArgumentParser(description="Sterownik koła filtrów i kamery Thorlabs")
+    parser.add_argument("--telemetry", type=int, default=0, metavar="N",
+                        help="telemetria enkodera koła: co N-ta próbka korekcji (0 = wyłączona)")
+    parser.add_argument("--sim", action="store_true",
+                        help="symulowana kamera i emulator ESP32 (bez sprzętu)")
+    parser.add_argument("--port", default="COM3",
+                        help="port szeregowy koła filtrów lub 'auto' (wyszukanie sterownika)")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = FilterWheelApp(simulate=args.sim, telemetry_decimation=args.telemetry, serial_port=args.port)
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
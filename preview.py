@@ -0,0 +1,205 @@
+"""
+preview.py
+
+Przygotowanie podglądu 8-bit poza wątkiem GUI.
+Pełna klatka 16-bit jest najpierw zmniejszana do rozmiaru etykiety podglądu,
+dopiero potem rozciągana kontrastowo do 8 bit. Wątek GUI tylko wyświetla
+gotowy bufor; oryginalna klatka 16-bit pozostaje nietknięta do zapisu.
+
+ContrastEngine oferuje dwa tryby rozciągania: min/max (jak dotychczas) oraz
+percentylowy - granice liczone z próbki pikseli, wygładzane w czasie
+i nakładane przez tablicę LUT 65536 -> 256.
+
+Opcjonalnie (corrector, correction.py) podgląd pokazuje klatkę po korekcji
+dark/flat - wynik uint16 w buforze wątku podglądu, bez zmiany klatki z puli.
+Plan korekcji jest zapamiętywany i ustalany ponownie tylko po zmianie
+pozycji koła, ekspozycji, Gain lub wzorców.
+
+OpenCV importowane jest przy pierwszym renderowaniu (w wątku podglądu),
+nie przy starcie aplikacji.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from PySide6.QtCore import QObject, Signal
+
+from correction import DTYPE_UINT16
+from frame_pool import FrameMailbox
+
+
+class PreviewImage:
+    """Gotowy obraz podglądu 8-bit wraz z klatką źródłową 16-bit (PooledFrame)."""
+
+    __slots__ = ("image", "frame")
+
+    def __init__(self, image, frame):
+        self.image = image
+        self.frame = frame
+
+    def release(self):
+        self.frame.release()
+
+
+class ContrastEngine:
+    """
+    Rozciąganie kontrastu 16 -> 8 bit dla podglądu.
+    Tryb "percentile": dolny/górny percentyl z histogramu próbki co `stride`
+    pikseli, wygładzanie wykładnicze między klatkami i LUT przeliczana tylko
+    przy zmianie granic. Pojedynczy gorący piksel nie spłaszcza obrazu.
+    """
+    MODE_MINMAX = "minmax"
+    MODE_PERCENTILE = "percentile"
+
+    def __init__(self, mode=MODE_MINMAX, low_percent=0.5, high_percent=99.5,
+                 smoothing=0.2, max_samples=65536):
+        self.mode = mode
+        self.low_percent = low_percent
+        self.high_percent = high_percent
+        self.smoothing = smoothing  # Waga nowej klatki w średniej wykładniczej
+        self.max_samples = max_samples
+
+        self._levels = np.arange(65536, dtype=np.float32)
+        self._lut_float = np.empty(65536, dtype=np.float32)
+        self.lut = np.empty(65536, dtype=np.uint8)
+        self._lut_limits = None
+        self.low = None
+        self.high = None
+
+    def set_mode(self, mode):
+        """Zmienia tryb; wygładzone granice liczone są od nowa."""
+        self.low = None
+        self.high = None
+        self.mode = mode
+
+    def apply(self, small_16bit, full_16bit):
+        """Zwraca obraz 8-bit; granice percentyli szacowane z pełnej klatki."""
+        if self.mode != self.MODE_PERCENTILE:
+            import cv2
+            return cv2.normalize(small_16bit, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+        low, high = self._estimate_limits(full_16bit)
+        if self.low is None:
+            self.low, self.high = low, high
+        else:
+            a = self.smoothing
+            self.low += a * (low - self.low)
+            self.high += a * (high - self.high)
+
+        limits = (int(round(self.low)), max(int(round(self.high)), int(round(self.low)) + 1))
+        if limits != self._lut_limits:
+            self._build_lut(*limits)
+        return self.lut[small_16bit]
+
+    def _estimate_limits(self, image):
+        """Percentyle z histogramu (65536 przedziałów) próbki z krokiem `stride`."""
+        stride = max(1, int(np.sqrt(image.size / self.max_samples)))
+        sample = image[::stride, ::stride]
+        histogram = np.bincount(sample.ravel(), minlength=65536)
+        cumulative = np.cumsum(histogram)
+        total = cumulative[-1]
+        low = np.searchsorted(cumulative, total * self.low_percent / 100.0)
+        high = np.searchsorted(cumulative, total * self.high_percent / 100.0)
+        return float(low), float(high)
+
+    def _build_lut(self, low, high):
+        np.subtract(self._levels, low, out=self._lut_float)
+        np.multiply(self._lut_float, 255.0 / (high - low), out=self._lut_float)
+        np.clip(self._lut_float, 0, 255, out=self._lut_float)
+        self.lut[:] = self._lut_float
+        self._lut_limits = (low, high)
+
+
+class PreviewRenderer(QObject):
+    """
+    Wątek podglądu: pobiera najnowszą klatkę ze skrzynki kamery, skaluje ją
+    do rozmiaru wyświetlania i konwertuje do 8 bit. Wynik trafia do
+    display_mailbox, a preview_ready jest emitowany tylko gdy była pusta.
+    """
+    preview_ready = Signal()
+
+    def __init__(self, source_mailbox, max_fps=30.0):
+        super().__init__()
+        self.source_mailbox = source_mailbox
+        self.display_mailbox = FrameMailbox()
+        self.max_fps = max_fps
+        self.display_size = (640, 480)
+        self.contrast = ContrastEngine()
+        self.corrector = None   # correction.FrameCorrector (None = surowa klatka)
+        self.position = 0       # Pozycja koła - wybór flatu (ustawiana z wątku GUI)
+        self._plan = None       # Ostatni plan korekcji i klucz, dla którego go ustalono
+        self._plan_key = None
+        self._is_running = False
+        self._thread = None
+
+    def set_display_size(self, width, height):
+        """Rozmiar obszaru podglądu (wywoływane z wątku GUI)."""
+        self.display_size = (max(1, width), max(1, height))
+
+    def start(self):
+        self._is_running = True
+        self._thread = threading.Thread(target=self._render_loop, name="PreviewRenderer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._is_running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.display_mailbox.clear()
+
+    def _render_loop(self):
+        last_render = 0.0
+        while self._is_running:
+            # Limit odświeżania - w międzyczasie nowsze klatki zastępują starsze
+            wait = last_render + 1.0 / self.max_fps - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+            frame = self.source_mailbox.wait_take(0.2)
+            if frame is None:
+                continue
+            last_render = time.perf_counter()
+
+            try:
+                image = frame.image
+                corrector = self.corrector
+                if corrector is not None:
+                    # Kontrast percentylowy wymaga danych 16-bit
+                    image = self._correction_plan(corrector, frame).apply(image)
+                image_8bit = self.render(image)
+            except Exception as e:
+                print(f"Błąd podglądu: {e}")
+                frame.release()
+                continue
+
+            if self.display_mailbox.post(PreviewImage(image_8bit, frame)):
+                self.preview_ready.emit()
+
+    def _correction_plan(self, corrector, frame):
+        """Plan korekcji podglądu (w wątku podglądu) - nowy tylko po zmianie ustawień lub wzorców."""
+        key = (corrector, corrector.masters.revision, corrector.scale, self.position,
+               frame.exposure_us, frame.gain_db, frame.image.shape)
+        if key != self._plan_key:
+            self._plan = corrector.plan(frame, self.position, dtype=DTYPE_UINT16)
+            self._plan_key = key
+        return self._plan
+
+    def render(self, image_16bit):
+        """Zmniejszenie do rozmiaru wyświetlania (z zachowaniem proporcji), potem kontrast."""
+        height, width = image_16bit.shape[:2]
+        box_w, box_h = self.display_size
+        scale = min(box_w / width, box_h / height)
+
+        target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if target == (width, height):
+            small = image_16bit
+        else:
+            import cv2
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            small = cv2.resize(image_16bit, target, interpolation=interpolation)
+
+        # Auto-Contrast na zmniejszonym obrazie
+        return self.contrast.apply(small, image_16bit)
@@ -0,0 +1,223 @@
+"""
+saving.py
+
+Zapis obrazów w tle. ImageSaveQueue przyjmuje klatki (PooledFrame) do
+ograniczonej kolejki i zapisuje je w osobnym wątku, dzięki czemu GUI
+i tryb automatyczny nie czekają na dysk. Gdy kolejka jest pełna,
+submit() zwraca False (przeciwciśnienie) - wywołujący ponawia próbę po
+sygnale saved/error.
+
+Skan trybu automatycznego może trafić do jednego pliku (kostki pasm):
+wielostronicowego TIFF z metadanymi pasma w opisie każdej strony lub
+wstępnie zaalokowanego numpy.memmap (.npy), wraz z opisem scan.json.
+
+tifffile i OpenCV importowane są przy pierwszym zapisie (w wątku zapisu),
+co skraca start aplikacji.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from PySide6.QtCore import QObject, Signal
+
+
+def is_16bit_format(file_path, force_format_str=""):
+    """Decyzja o formacie na podstawie wyboru użytkownika i rozszerzenia."""
+    if "PNG" in force_format_str or "8-bit" in force_format_str:
+        return False
+    if file_path.lower().endswith('.png') or file_path.lower().endswith('.jpg'):
+        return False
+    return True
+
+
+def write_image(file_path, image, force_format_str=""):
+    """Zapisuje obraz jako 16-bit TIFF (dane naukowe) lub 8-bit z auto-kontrastem."""
+    if is_16bit_format(file_path, force_format_str):
+        # Zapis naukowy (16-bit TIFF)
+        import tifffile
+        tifffile.imwrite(file_path, image)
+        print(f"Zapisano (16-bit): {file_path}")
+    else:
+        # Zapis podglądu (8-bit z auto-kontrastem)
+        import cv2
+        img_8bit = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        if not cv2.imwrite(file_path, img_8bit):
+            raise IOError(f"Nie udało się zapisać pliku {file_path}")
+        print(f"Zapisano (8-bit): {file_path}")
+
+
+def create_scan_directory(base_dir=".", prefix="scan"):
+    """Tworzy katalog skanu ze znacznikiem czasu (np. scan_20250101_120000)."""
+    path = os.path.join(base_dir, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}")
+    candidate = path
+    suffix = 1
+    while os.path.exists(candidate):
+        candidate = f"{path}_{suffix}"
+        suffix += 1
+    os.makedirs(candidate)
+    return candidate
+
+
+def write_scan_metadata(scan_dir, metadata):
+    """Zapisuje opis skanu (pasma, ekspozycje, pliki) do scan.json."""
+    with open(os.path.join(scan_dir, "scan.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=4, ensure_ascii=False)
+
+
+class TiffCubeWriter:
+    """
+    Kostka pasm jako wielostronicowy TIFF; strona = pasmo, opis strony = metadane JSON.
+    Strony dopisywane są w kolejności akwizycji - page_bands[strona] to indeks pasma.
+    """
+
+    extension = ".tif"
+
+    def __init__(self, file_path, band_count):
+        self.file_path = file_path
+        self.band_count = band_count
+        self.page_count = 0
+        self.page_bands = []
+        self._writer = None
+
+    def write_band(self, image, metadata, band_index):
+        """Dopisuje pasmo jako kolejną stronę; zwraca numer strony."""
+        if self._writer is None:
+            import tifffile
+            self._writer = tifffile.TiffWriter(self.file_path, bigtiff=True)
+        # Nieskompresowane strony - odczyt pasma to jeden odczyt ciągłego bloku
+        self._writer.write(
+            image, photometric='minisblack', contiguous=False,
+            description=json.dumps(metadata, ensure_ascii=False), metadata=None
+        )
+        self.page_bands.append(band_index)
+        self.page_count += 1
+        print(f"Zapisano pasmo {self.page_count}/{self.band_count}: {self.file_path}")
+        return self.page_count - 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class MemmapCubeWriter:
+    """
+    Kostka pasm jako wstępnie zaalokowana tablica .npy (numpy.memmap, kształt pasma x Y x X).
+    Pasmo trafia pod swój indeks widmowy niezależnie od kolejności akwizycji.
+    """
+
+    extension = ".npy"
+
+    def __init__(self, file_path, band_count):
+        self.file_path = file_path
+        self.band_count = band_count
+        self.page_count = 0
+        self.page_bands = list(range(band_count))
+        self._cube = None
+
+    def write_band(self, image, metadata, band_index):
+        """Zapisuje pasmo pod indeksem band_index; zwraca numer strony (= band_index)."""
+        if self._cube is None:
+            self._cube = np.lib.format.open_memmap(
+                self.file_path, mode='w+', dtype=image.dtype, shape=(self.band_count,) + image.shape
+            )
+        self._cube[band_index] = image
+        self.page_count += 1
+        print(f"Zapisano pasmo {self.page_count}/{self.band_count}: {self.file_path}")
+        return band_index
+
+    def close(self):
+        if self._cube is not None:
+            self._cube.flush()
+            self._cube = None
+
+
+class _SaveTask:
+    __slots__ = ("write", "frame", "label")
+
+    def __init__(self, write, frame, label):
+        self.write = write    # Funkcja wywoływana w wątku zapisu: write(image) lub write()
+        self.frame = frame    # PooledFrame albo None dla zadań sterujących
+        self.label = label
+
+
+class ImageSaveQueue(QObject):
+    """
+    Wątek zapisu z ograniczoną kolejką. Klatki są przytrzymywane (retain)
+    do końca zapisu, więc bufor z puli nie zostanie nadpisany.
+    Limit max_pending dotyczy klatek; zadania sterujące (np. zamknięcie
+    kostki) są przyjmowane zawsze i wykonywane w kolejności zgłoszenia.
+    """
+    saved = Signal(str)
+    error = Signal(str)
+    pending_changed = Signal(int)
+
+    def __init__(self, max_pending=4):
+        super().__init__()
+        self.max_pending = max_pending
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending_frames = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ImageSaveQueue", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Kończy pracę po zapisaniu wszystkich oczekujących obrazów."""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def pending_count(self):
+        with self._lock:
+            return self._pending_frames
+
+    def submit(self, file_path, frame, force_format_str=""):
+        """Dodaje klatkę do zapisu jako plik. Zwraca False, gdy kolejka jest pełna."""
+        return self.submit_task(
+            lambda image: write_image(file_path, image, force_format_str), frame, file_path
+        )
+
+    def submit_task(self, write, frame=None, label=""):
+        """
+        Dodaje dowolne zadanie zapisu. Dla klatki write(image) dostaje jej obraz
+        (zwraca False przy pełnej kolejce); bez klatki wywoływane jest write().
+        """
+        if frame is not None:
+            with self._lock:
+                if self._pending_frames >= self.max_pending:
+                    return False
+                self._pending_frames += 1
+            frame.retain()
+        self._queue.put(_SaveTask(write, frame, label))
+        if frame is not None:
+            self.pending_changed.emit(self.pending_count())
+        return True
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            try:
+                if task.frame is not None:
+                    task.write(task.frame.image)
+                    self.saved.emit(task.label)
+                else:
+                    task.write()
+            except Exception as e:
+                self.error.emit(f"Błąd zapisu: {e}")
+            finally:
+                if task.frame is not None:
+                    task.frame.release()
+                    with self._lock:
+                        self._pending_frames -= 1
+                    self.pending_changed.emit(self.pending_count())
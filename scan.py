@@ -0,0 +1,532 @@
+"""
+scan.py
+
+Harmonogram skanu multispektralnego (tryb automatyczny).
+ScanScheduler prowadzi sekwencję ruch koła -> klatka -> zapis tak, aby etapy
+nakładały się w czasie: po przechwyceniu klatki pasma od razu ustawiana jest
+ekspozycja kolejnego pasma i zlecany ruch koła, a zapis poprzedniego pasma
+trwa w tle (ImageSaveQueue). Dla każdego kroku raportowane są czasy.
+
+Pasma odwiedzane są w kolejności najkrótszej drogi koła od bieżącej pozycji
+(wheel_path.plan_visit_order), a nie rosnąco - metadane każdego pasma
+zawierają jego indeks w widmie (band_index) i kolejność akwizycji.
+
+Cały plan trafia do sterownika jednym poleceniem SEQ; kolejne ruchy
+wyzwala krótkie NEXT (sterownik nie parsuje już GOTO dla każdego pasma).
+Starszy firmware bez SEQ jest wykrywany i skan przechodzi na GOTO.
+
+Pasmo może być średnią kilku klatek (frames_per_band w config.json lub
+domyślna wartość z GUI) - kamera akumuluje je w miejscu (stacking.py),
+a zapisywana jest średnia float32 i opcjonalnie wariancja.
+
+Opcjonalny automatyczny dobór ekspozycji (auto_exposure, exposure.py)
+koryguje w pętli zamkniętej ekspozycję z mnożnika config.json na
+pierwszych klatkach pasma; ekspozycja końcowa trafia do metadanych,
+a kolejny skan (np. w sesji poklatkowej) zaczyna od niej.
+
+Z korektorem (corrector, correction.py) pasma zapisywane są po odjęciu
+darka i podzieleniu przez flat pozycji - korekcja wykonywana jest
+w wątku zapisu, a użyte wzorce trafiają do metadanych pasma.
+"""
+
+import os
+import time
+
+from PySide6.QtCore import QObject, Signal, Slot, QTimer
+
+from saving import create_scan_directory, write_scan_metadata, write_image
+from wheel_path import plan_visit_order, direction_suffix, sequence_command
+from workers import next_capture_id
+
+
+def parse_band_selection(text, available_positions):
+    """
+    Lista pozycji z tekstu typu "1,3,5" lub "2-6" (pusty tekst = wszystkie).
+    Zgłasza ValueError dla pozycji spoza konfiguracji.
+    """
+    available = sorted(available_positions)
+    text = text.strip()
+    if not text:
+        return available
+    selected = []
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = (int(value) for value in part.split("-", 1))
+            selected.extend(range(first, last + 1))
+        else:
+            selected.append(int(part))
+    unknown = [position for position in selected if position not in available]
+    if unknown:
+        raise ValueError(f"Nieznane pozycje filtrów: {unknown}")
+    return sorted(set(selected))
+
+
+def public_timing(timing, exclude=()):
+    """Kopia czasów kroku bez pól roboczych (prefiks "_")."""
+    return {k: v for k, v in timing.items() if not k.startswith("_") and k not in exclude}
+
+
+class ScanScheduler(QObject):
+    """
+    Automat stanów skanu. Nie tworzy widgetów - komunikuje się wyłącznie
+    sygnałami z kołem filtrów, kamerą i kolejką zapisu, więc działa
+    zarówno w GUI, jak i bez niego.
+    """
+    # Polecenia (Scheduler -> sprzęt)
+    wheel_command_requested = Signal(str)
+    exposure_requested = Signal(float)
+    capture_requested = Signal(int)
+    stack_requested = Signal(int, int, float, bool)  # id, klatki, sigma, wariancja
+    auto_exposed_requested = Signal(int, object, int, float, bool, bool)  # + kontroler ekspozycji, akumulacja
+    capture_cancelled = Signal(int)
+
+    # Raportowanie
+    progress = Signal(str)
+    step_finished = Signal(dict)
+    scan_finished = Signal(dict)    # Koniec akwizycji (zapis może jeszcze trwać)
+    output_written = Signal(dict)   # Wszystkie pasma zapisane, scan.json gotowy
+    error = Signal(str)
+
+    _output_closed = Signal(object)  # Z wątku zapisu: (podsumowanie, czasy kroków, start skanu)
+
+    def __init__(self, save_queue):
+        super().__init__()
+        self.save_queue = save_queue
+        self.capture_timeout_ms = 5000  # Zapas ponad czas naświetlania
+        self.use_sequence = True        # SEQ/NEXT zamiast GOTO (gdy firmware obsługuje)
+        # Uśrednianie pasm: domyślna liczba klatek (wpis 'frames_per_band' ma pierwszeństwo)
+        self.frames_per_band = 1
+        self.sigma_clip = 0.0           # 0 = bez odrzucania
+        self.save_variance = False
+        self.auto_exposure = None       # Wzorzec exposure.AutoExposure (None = ekspozycje z mnożników)
+        self._auto_exposure_ms = {}     # Pozycja -> ekspozycja dobrana w poprzednim skanie
+        self.corrector = None           # correction.FrameCorrector (None = zapis surowych danych)
+
+        self.active = False
+        self.steps = []
+        self.start_position = None
+        self.travel_filters = 0
+        self.current_step = 0
+        self._sequence_mode = False      # Skan prowadzony sekwencją SEQ
+        self._sequence_open = False      # Sterownik jest w trakcie sekwencji
+        self.base_exposure_ms = 10.0
+        self.format_str = "TIFF 16-bit"
+        self.cube_class = None
+        self.output_base_dir = "."
+
+        self.scan_dir = None
+        self.cube = None
+        self.variance_cube = None
+        self._stacking = False           # Wszystkie pasma skanu przez akumulator float32
+        self.bands = []
+        self.step_timings = []
+        self.started = ""
+        self._scan_start = 0.0
+
+        self._frame = None               # Klatka oczekująca na miejsce w kolejce zapisu
+        self._capture_id = None
+        self._exposure_controller = None
+        self._issued_capture_ids = set()
+        self._save_labels = {}           # etykieta zadania zapisu -> (czasy kroku, chwila zlecenia)
+        self._summary = None
+
+        self._output_closed.connect(self._on_output_closed)
+        self.save_queue.saved.connect(self.on_image_saved)
+
+    # ---------------------------------------------------
+    # Sterowanie
+    # ---------------------------------------------------
+    def start(self, steps, base_exposure_ms, format_str="TIFF 16-bit", cube_class=None,
+              output_base_dir=".", start_position=None):
+        """
+        Rozpoczyna skan pasm `steps` (wpisy z config.json w kolejności widmowej).
+        start_position to bieżąca pozycja koła (None/0 - nieznana).
+        """
+        if self.active:
+            return
+        print("--- START TRYBU AUTO ---")
+        self.steps = self._plan_steps(steps, start_position)
+        self.base_exposure_ms = base_exposure_ms
+        self.format_str = format_str
+        self.cube_class = cube_class
+        self.output_base_dir = output_base_dir
+        # Jednolity typ danych w skanie: przy uśrednianiu każde pasmo to średnia float32
+        self._stacking = self.save_variance or any(self.band_frames(i) > 1 for i in range(len(self.steps)))
+        if self.auto_exposure is None:
+            self._auto_exposure_ms.clear()
+
+        self.active = True
+        self.current_step = 0
+        self._sequence_mode = self.use_sequence
+        self._sequence_open = False
+        self.bands = []
+        self.step_timings = []
+        # _save_labels nie jest czyszczone - zapis poprzedniego skanu może jeszcze trwać
+        self._summary = None
+        self._scan_start = time.perf_counter()
+        self._open_output()
+
+        self.progress.emit("Tryb Auto: 🟡 Uruchamianie...")
+        self._stage_exposure(0)
+        self._start_move(0)
+
+    def stop(self, error=False):
+        """Kończy skan (również przerwany lub po błędzie) i zamyka pliki wyjściowe."""
+        if not self.active:
+            return
+        print("--- STOP TRYBU AUTO ---")
+        self.active = False
+        self._capture_id = None
+        if self._sequence_open:
+            # Przerwanie skanu kończy sekwencję w sterowniku
+            self._sequence_open = False
+            self.wheel_command_requested.emit("STOP\n")
+        if self._frame is not None:
+            self._frame.release()
+            self._frame = None
+
+        total_ms = (time.perf_counter() - self._scan_start) * 1000
+        self._summary = {
+            "scan_dir": self.scan_dir,
+            "error": error,
+            "completed": not error and len(self.bands) == len(self.steps),
+            "bands": len(self.bands),
+            "total_ms": round(total_ms, 1),
+            "exposure_sum_ms": round(sum(b["exposure_us"] for b in self.bands) / 1000, 1),
+            "move_sum_ms": round(sum(t["move_ms"] for t in self.step_timings), 1),
+            "visit_order": [step['position'] for step in self.steps],
+            "travel_filters": self.travel_filters,
+            "wheel_protocol": "SEQ" if self._sequence_mode else "GOTO",
+            "steps": [public_timing(t) for t in self.step_timings],
+        }
+        self._close_output(error)
+        self.scan_finished.emit(self._summary)
+
+    def _plan_steps(self, steps, start_position):
+        """Kroki skanu w kolejności najmniejszej drogi koła, z indeksem pasma i kierunkiem ruchu."""
+        bands = {}
+        for step in steps:
+            # Indeksy pasm bez luk - indeks widmowy to zarazem strona kostki .npy
+            if step['position'] not in bands:
+                bands[step['position']] = (len(bands), step)
+        plan, travel = plan_visit_order(list(bands), start_position)
+
+        self.start_position = start_position or None
+        self.travel_filters = travel
+        planned = []
+        for position, delta in plan:
+            band_index, step = bands[position]
+            planned.append(dict(step, band_index=band_index, delta=delta))
+        print(f"Kolejność pasm: {[step['position'] for step in planned]} (droga koła: {travel} poz.)")
+        return planned
+
+    def band_frames(self, index):
+        return max(1, int(self.steps[index].get('frames_per_band', self.frames_per_band)))
+
+    def target_exposure(self, index):
+        """Ekspozycja startowa pasma: z mnożnika lub dobrana w poprzednim skanie (auto_exposure)."""
+        step = self.steps[index]
+        if self.auto_exposure is not None and step['position'] in self._auto_exposure_ms:
+            return self._auto_exposure_ms[step['position']]
+        multiplier = step.get('exposure_multiplier', 1.0)
+        return self.base_exposure_ms * multiplier
+
+    # ---------------------------------------------------
+    # Etapy kroku
+    # ---------------------------------------------------
+    def _stage_exposure(self, index):
+        """Ustawia ekspozycję pasma z wyprzedzeniem - kamera zmienia ją w trakcie ruchu koła."""
+        self.exposure_requested.emit(self.target_exposure(index))
+
+    def _start_move(self, index):
+        step = self.steps[index]
+        self.step_timings.append({
+            "band_index": step['band_index'],
+            "acquisition_index": index,
+            "position": step['position'],
+            "delta": step['delta'],
+            "name": step['name'],
+            "move_ms": 0.0,
+            "wheel_ms": None,
+            "capture_ms": 0.0,
+            "step_ms": 0.0,
+            "save_ms": None,
+            "_t_move": time.perf_counter(),
+        })
+        self.progress.emit(f"Tryb Auto: Krok {index + 1}/{len(self.steps)} ({step['name']})")
+        self.wheel_command_requested.emit(self._move_command(index))
+
+    def _move_command(self, index):
+        if self._sequence_open:
+            return "NEXT\n"
+        if self._sequence_mode and index == 0:
+            self._sequence_open = True
+            return sequence_command([(step['position'], step['delta']) for step in self.steps])
+        # Kierunek z planu - sterownik nie musi wybierać go samodzielnie
+        step = self.steps[index]
+        return f"GOTO:{step['position']}{direction_suffix(step['delta'])}\n"
+
+    @Slot(str)
+    def on_wheel_response(self, response):
+        if not self.active:
+            return
+        if response.startswith("ERROR:"):
+            if self._sequence_open and self.current_step == 0 and "Unknown command" in response:
+                # Firmware bez SEQ - ten sam plan poleceniami GOTO
+                print("Sterownik nie obsługuje SEQ - skan poleceniami GOTO.")
+                self._sequence_open = False
+                self._sequence_mode = False
+                self.wheel_command_requested.emit(self._move_command(0))
+                return
+            self.error.emit(response)
+            self.stop(error=True)
+            return
+        arrived = response.startswith("AT:") if self._sequence_open else response.startswith("OK:")
+        if not arrived:
+            return
+
+        timing = self.step_timings[self.current_step]
+        now = time.perf_counter()
+        timing["move_ms"] = round((now - timing["_t_move"]) * 1000, 1)
+        timing["_t_arrived"] = now
+
+        # Klatka musi być naświetlana w całości po zatrzymaniu koła
+        target_exposure = self.target_exposure(self.current_step)
+        self.progress.emit(f"Tryb Auto: Ekspozycja {target_exposure:.1f} ms")
+        request_id = next_capture_id()
+        self._capture_id = request_id
+        self._issued_capture_ids.add(request_id)
+        frames = self.band_frames(self.current_step)
+        timeout_ms = int(target_exposure * 3 * frames) + self.capture_timeout_ms
+        self._exposure_controller = None
+        if self.auto_exposure is not None:
+            controller = self.auto_exposure.clone(target_exposure)
+            self._exposure_controller = controller
+            self.auto_exposed_requested.emit(request_id, controller, frames, self.sigma_clip,
+                                             self.save_variance, self._stacking)
+            # Iteracje doboru mogą wydłużyć ekspozycję - także klatek akumulowanych
+            timeout_ms += int(controller.budget_ms(target_exposure) * 3
+                              + controller.max_exposure_ms * 3 * (frames - 1))
+        elif self._stacking:
+            self.stack_requested.emit(request_id, frames, self.sigma_clip, self.save_variance)
+        else:
+            self.capture_requested.emit(request_id)
+
+        QTimer.singleShot(timeout_ms, lambda: self._on_capture_timeout(request_id))
+
+    @Slot(dict)
+    def on_wheel_move(self, result):
+        """Czas ruchu zmierzony przez sterownik (linia INFO) dla bieżącego kroku."""
+        if self.active and self.current_step < len(self.step_timings):
+            timing = self.step_timings[self.current_step]
+            timing["wheel_ms"] = result["firmware_ms"]
+            profile = result.get("profile")
+            if profile is not None:
+                timing["travel_ms"] = profile["travel_ms"]
+                timing["settle_ms"] = profile["settle_ms"]
+                timing["overshoot_deg"] = profile["overshoot_deg"]
+
+    @Slot(str)
+    def on_wheel_error(self, message):
+        if self.active:
+            self.stop(error=True)
+
+    def _on_capture_timeout(self, request_id):
+        if self.active and request_id == self._capture_id:
+            self.capture_cancelled.emit(request_id)
+            self.error.emit("Tryb Auto: brak klatki z kamery.")
+            self.stop(error=True)
+
+    @Slot(int, object)
+    def on_frame_captured(self, request_id, frame):
+        """Klatka pasma gotowa - zapis w tle i natychmiastowy start kolejnego ruchu."""
+        if request_id not in self._issued_capture_ids:
+            return  # Zamówienie innego odbiorcy
+        self._issued_capture_ids.discard(request_id)
+        if not self.active or request_id != self._capture_id:
+            frame.release()
+            return
+        self._capture_id = None
+
+        timing = self.step_timings[self.current_step]
+        now = time.perf_counter()
+        timing["capture_ms"] = round((now - timing.pop("_t_arrived")) * 1000, 1)
+        timing["step_ms"] = round((now - timing.pop("_t_move")) * 1000, 1)
+        controller = self._exposure_controller
+        if controller is not None:
+            timing["exposure_iterations"] = controller.iterations
+            final_ms = frame.exposure_us / 1000.0
+            self._auto_exposure_ms[self.steps[self.current_step]['position']] = final_ms
+            # Kamera ma już ekspozycję dobraną w wątku akwizycji - wyświetlana wartość nadąża
+            self.exposure_requested.emit(final_ms)
+
+        self._frame = frame
+        self._queue_frame()
+
+    def _queue_frame(self):
+        """Przekazuje klatkę do zapisu; przy pełnej kolejce czeka na sygnał saved."""
+        index = self.current_step
+        step = self.steps[index]
+        frame = self._frame
+
+        band = {
+            "band_index": step['band_index'],
+            "acquisition_index": index,
+            "position": step['position'],
+            "name": step['name'],
+            "exposure_multiplier": step.get('exposure_multiplier', 1.0),
+            "exposure_us": frame.exposure_us,
+            "gain_db": frame.gain_db,
+            "frame_count": frame.frame_count,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        variance = None
+        controller = self._exposure_controller
+        if controller is not None:
+            # Ekspozycja końcowa (exposure_us) i przebieg doboru
+            band["auto_exposure"] = controller.summary()
+        if self._stacking:
+            band["frames"] = frame.frames
+            band["frame_numbers"] = frame.frame_numbers
+            band["sigma_clip"] = frame.sigma_clip
+            band["rejected_pixels"] = frame.rejected_count
+            band["dtype"] = "float32"
+            variance = frame.variance
+        correction = self.corrector.plan(frame, step['position']) if self.corrector is not None else None
+        if correction is not None:
+            band["correction"] = correction.info
+            band["dtype"] = correction.dtype
+
+        cube = self.cube
+        if cube is not None:
+            # Pasmo jako strona kostki (surowe dane 16-bit, średnia float32 lub wynik korekcji);
+            # numer strony zależy od formatu - .npy w kolejności widmowej, TIFF w kolejności akwizycji
+            band_index = step['band_index']
+            label = f"{cube.file_path}#{band_index}"
+            variance_cube = self.variance_cube
+
+            def write(image):
+                if correction is not None:
+                    image = correction.apply(image)
+                band["page"] = cube.write_band(image, band, band_index)
+                if variance is not None and variance_cube is not None:
+                    variance_cube.write_band(variance, band, band_index)
+        else:
+            extension = ".png" if "PNG" in self.format_str else ".tif"
+            stem = f"auto_{step['name'].replace(' ', '_').replace('/', '-')}"
+            band["file"] = stem + extension
+            label = os.path.join(self.scan_dir, band["file"])
+            format_str = self.format_str
+            variance_path = None
+            if variance is not None:
+                band["variance_file"] = stem + "_var.tif"
+                variance_path = os.path.join(self.scan_dir, band["variance_file"])
+
+            def write(image):
+                if correction is not None:
+                    image = correction.apply(image)
+                write_image(label, image, format_str)
+                if variance_path is not None:
+                    import tifffile
+                    tifffile.imwrite(variance_path, variance)
+
+        # Średnia i wariancja w jednym zadaniu - jedno miejsce w kolejce zapisu
+        queued = self.save_queue.submit_task(write, frame, label)
+
+        if not queued:
+            return  # Dysk nie nadąża - ponowienie w on_image_saved
+
+        # Kolejka przytrzymuje klatkę - zwalniamy własną referencję
+        frame.release()
+        self._frame = None
+        self._save_labels[label] = (self.step_timings[index], time.perf_counter())
+        self.bands.append(band)
+        self.step_finished.emit(public_timing(self.step_timings[index]))
+
+        self.current_step += 1
+        if self.current_step >= len(self.steps):
+            if self._sequence_open:
+                # Ostatnie NEXT zamyka sekwencję (OK:SEQ)
+                self._sequence_open = False
+                self.wheel_command_requested.emit("NEXT\n")
+            self.stop()
+            return
+
+        # Ruch do kolejnego pasma nakłada się z zapisem bieżącego
+        self._stage_exposure(self.current_step)
+        self._start_move(self.current_step)
+
+    @Slot(str)
+    def on_image_saved(self, label):
+        entry = self._save_labels.pop(label, None)
+        if entry is not None:
+            timing, queued_at = entry
+            timing["save_ms"] = round((time.perf_counter() - queued_at) * 1000, 1)
+
+        # Zwolniło się miejsce w kolejce - ponów zapis oczekującej klatki
+        if self.active and self._frame is not None:
+            self._queue_frame()
+
+    # ---------------------------------------------------
+    # Pliki wyjściowe
+    # ---------------------------------------------------
+    def _open_output(self):
+        """Tworzy katalog skanu i (opcjonalnie) plik kostki pasm."""
+        self.scan_dir = create_scan_directory(self.output_base_dir)
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.cube = None
+        self.variance_cube = None
+        if self.cube_class is not None:
+            cube_path = os.path.join(self.scan_dir, "cube" + self.cube_class.extension)
+            self.cube = self.cube_class(cube_path, len(self.steps))
+            if self._stacking and self.save_variance:
+                variance_path = os.path.join(self.scan_dir, "variance" + self.cube_class.extension)
+                self.variance_cube = self.cube_class(variance_path, len(self.steps))
+        print(f"Katalog skanu: {self.scan_dir}")
+
+    def _close_output(self, error=False):
+        """Zamyka kostkę i zapisuje scan.json - w wątku zapisu, po ostatnim paśmie."""
+        scan_dir = self.scan_dir
+        # Kolejny skan (sesja poklatkowa) może ruszyć przed końcem zapisu tego
+        closed = (self._summary, self.step_timings, self._scan_start)
+        cube = self.cube
+        variance_cube = self.variance_cube
+        metadata = {
+            "started": self.started,
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "completed": self._summary["completed"],
+            "base_exposure_ms": self.base_exposure_ms,
+            "start_position": self.start_position,
+            "visit_order": [step['position'] for step in self.steps],
+            "travel_filters": self.travel_filters,
+            "wheel_protocol": "SEQ" if self._sequence_mode else "GOTO",
+            "cube_file": os.path.basename(cube.file_path) if cube else None,
+            "variance_cube_file": os.path.basename(variance_cube.file_path) if variance_cube else None,
+            "bands": self.bands,
+            # Czasy zapisu nie są jeszcze znane - raportuje je output_written
+            "timings": [public_timing(t, exclude=("save_ms",)) for t in self.step_timings],
+        }
+
+        def finalize():
+            try:
+                if cube:
+                    cube.close()
+                    # Strona kostki -> indeks pasma (znany dopiero po zapisie wszystkich pasm)
+                    metadata["cube_page_bands"] = list(cube.page_bands)
+                if variance_cube:
+                    variance_cube.close()
+                write_scan_metadata(scan_dir, metadata)
+            finally:
+                self._output_closed.emit(closed)
+
+        self.save_queue.submit_task(finalize, label=scan_dir)
+
+    @Slot(object)
+    def _on_output_closed(self, closed):
+        summary, step_timings, scan_start = closed
+        summary["total_with_save_ms"] = round((time.perf_counter() - scan_start) * 1000, 1)
+        summary["steps"] = [public_timing(t) for t in step_timings]
+        self.output_written.emit(summary)
@@ -0,0 +1,439 @@
+"""
+simulation.py
+
+Symulowane odpowiedniki sprzętu do testów i pomiarów wydajności bez kamery
+i koła filtrów:
+* SimulatedCameraSDK / SimulatedCamera - syntetyczna kamera 16-bit
+  z tym samym interfejsem co TLCameraSDK / TLCamera,
+* Esp32Emulator - emulator sterownika ESP32 na pseudoterminalu (pty),
+  mówiący protokołem z stepper.ino (GOTO/SEQ/NEXT/STOP, OK:/AT:/ERROR:/INFO: Czas zmiany).
+"""
+
+import math
+import os
+import select
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from wheel_path import FILTER_COUNT, filter_delta
+
+# Względna transmisja filtrów w symulowanej scenie (pozycja 1..8)
+DEFAULT_TRANSMISSION = {1: 1.5, 2: 0.9, 3: 0.6, 4: 1.0, 5: 1.0, 6: 0.25, 7: 0.05, 8: 8.0}
+
+GainRange = namedtuple("GainRange", ["min", "max"])
+
+
+class SimulatedScene:
+    """
+    Wspólny stan sceny dla kamery i koła filtrów.
+    Emulator koła ustawia pozycję, kamera skaluje jasność obrazu transmisją filtra.
+    """
+
+    def __init__(self, transmission=None):
+        self.transmission = dict(transmission or DEFAULT_TRANSMISSION)
+        self.filter_position = 1
+        self.illumination = 1.0
+
+    def brightness(self):
+        return self.illumination * self.transmission.get(self.filter_position, 1.0)
+
+
+# -----------------------------------------------------------------
+# SYMULOWANA KAMERA
+# -----------------------------------------------------------------
+
+class SimulatedFrame:
+    """Klatka o tym samym kształcie co ramka z thorlabs_tsi_sdk."""
+
+    def __init__(self, image_buffer, frame_count, time_stamp_ns):
+        self.image_buffer = image_buffer
+        self.frame_count = frame_count
+        self.time_stamp_relative_ns_or_null = time_stamp_ns
+
+
+class SimulatedCamera:
+    """
+    Syntetyczna kamera 16-bit. Generuje klatki z zadaną rozdzielczością
+    i częstotliwością; okres klatki wydłuża się przy długiej ekspozycji.
+    """
+
+    # Liczba zliczeń na mikrosekundę przy jasności sceny 1.0 i Gain 0 dB
+    COUNTS_PER_US = 2.5
+    DARK_LEVEL = 100.0
+    NOISE_VARIANTS = 4
+
+    def __init__(self, width=1440, height=1080, fps=30.0, scene=None):
+        self.image_width_pixels = width
+        self.image_height_pixels = height
+        self.fps = fps
+        self.scene = scene or SimulatedScene()
+
+        self.exposure_time_us = 14000
+        self.gain = 0
+        self.gain_range = GainRange(0, 480)  # Indeks = dziesiąte części dB
+        self.frames_per_trigger_zero_for_unlimited = 0
+        self.image_poll_timeout_ms = 1000
+
+        self._armed = False
+        self._triggered = False
+        self._frame_count = 0
+        self._start_time = 0.0
+        self._next_frame_time = 0.0
+        self._rng = np.random.default_rng(0)
+        self._pattern = self._build_pattern()
+        self._cache_key = None
+        self._cache = []
+
+    def _build_pattern(self):
+        """Gradient z jasną plamą w centrum, wartości 0..1."""
+        h, w = self.image_height_pixels, self.image_width_pixels
+        y = np.linspace(-1.0, 1.0, h, dtype=np.float32)[:, None]
+        x = np.linspace(-1.0, 1.0, w, dtype=np.float32)[None, :]
+        spot = np.exp(-(x * x + y * y) * 4.0)
+        gradient = 0.3 + 0.2 * (x + 1.0)
+        return (0.5 * gradient + 0.5 * spot).astype(np.float32)
+
+    # --- Interfejs TLCamera ---
+    def convert_decibels_to_gain(self, db_value):
+        return int(round(min(max(db_value, 0.0), 48.0) * 10))
+
+    def convert_gain_to_decibels(self, gain_index):
+        return gain_index / 10.0
+
+    def arm(self, frames_to_buffer):
+        self._armed = True
+        self._frame_count = 0
+
+    def issue_software_trigger(self):
+        if not self._armed:
+            raise RuntimeError("Kamera nie jest uzbrojona (arm).")
+        self._triggered = True
+        self._start_time = time.perf_counter()
+        self._next_frame_time = self._start_time + self._frame_period()
+
+    def disarm(self):
+        self._armed = False
+        self._triggered = False
+
+    def dispose(self):
+        self.disarm()
+        self._cache_key = None
+        self._cache = []
+
+    def get_pending_frame_or_null(self):
+        """Zwraca klatkę lub None; blokuje maksymalnie image_poll_timeout_ms."""
+        if not self._triggered:
+            return None
+
+        now = time.perf_counter()
+        wait = self._next_frame_time - now
+        if wait > 0:
+            timeout = self.image_poll_timeout_ms / 1000.0
+            if wait > timeout:
+                time.sleep(timeout)
+                return None
+            time.sleep(wait)
+
+        # Klatki nieodebrane na czas przepadają (luka w frame_count, jak w SDK)
+        period = self._frame_period()
+        missed = int((time.perf_counter() - self._next_frame_time) / period)
+        arrival = self._next_frame_time + missed * period
+        self._next_frame_time = arrival + period
+        self._frame_count += 1 + missed
+
+        images = self._images()
+        image = images[self._frame_count % len(images)]
+        time_stamp_ns = int((arrival - self._start_time) * 1e9)
+        return SimulatedFrame(image, self._frame_count, time_stamp_ns)
+
+    # --- Generowanie obrazu ---
+    def _frame_period(self):
+        return max(1.0 / self.fps, self.exposure_time_us / 1e6)
+
+    def _images(self):
+        """Zestaw zaszumionych klatek dla bieżących ustawień (z pamięci podręcznej)."""
+        key = (self.exposure_time_us, self.gain, self.scene.brightness())
+        if key != self._cache_key:
+            gain_linear = 10 ** (self.convert_gain_to_decibels(self.gain) / 20.0)
+            signal = self._pattern * (
+                self.exposure_time_us * self.COUNTS_PER_US * gain_linear * key[2]
+            )
+            signal += self.DARK_LEVEL
+            self._cache = []
+            for _ in range(self.NOISE_VARIANTS):
+                noise = self._rng.normal(0.0, 1.0, signal.shape).astype(np.float32)
+                noisy = signal + noise * np.sqrt(signal)
+                np.clip(noisy, 0, 65535, out=noisy)
+                self._cache.append(noisy.astype(np.uint16).reshape(-1))
+            self._cache_key = key
+        return self._cache
+
+
+class SimulatedCameraSDK:
+    """Odpowiednik TLCameraSDK udostępniający jedną symulowaną kamerę."""
+
+    def __init__(self, width=1440, height=1080, fps=30.0, scene=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.scene = scene
+
+    def discover_available_cameras(self):
+        return ["SIM00001"]
+
+    def open_camera(self, camera_serial_number):
+        return SimulatedCamera(self.width, self.height, self.fps, self.scene)
+
+    def dispose(self):
+        pass
+
+
+# -----------------------------------------------------------------
+# EMULATOR STEROWNIKA KOŁA FILTRÓW (ESP32)
+# -----------------------------------------------------------------
+
+class Esp32Emulator:
+    """
+    Emulator firmware'u stepper.ino podłączony do pseudoterminala.
+    Ścieżkę `port` można przekazać do FilterWheelConnection jak port COM.
+    Czasy ruchu wynikają z profilu AccelStepper (prędkość, przyspieszenie)
+    i pętli korekcji enkodera.
+    """
+
+    STEPS_PER_FILTER = 25
+    MAX_SPEED = 6000.0       # kroki/s
+    ACCELERATION = 4000.0    # kroki/s^2
+    CORRECTION_SEC = 0.12    # Domykanie pozycji na podstawie enkodera
+    HOMING_SEC = 0.5
+    ENCODER_HOME_POSITION = 510
+    ENCODER_STEPS_PER_FILTER = 512
+    CORRECTION_SAMPLE_SEC = 0.001   # Jeden obieg pętli korekcji
+
+    def __init__(self, scene=None, time_scale=1.0):
+        if not hasattr(os, "openpty"):
+            raise RuntimeError("Emulator koła wymaga systemu z obsługą pty (Linux/macOS).")
+        self.scene = scene
+        self.time_scale = time_scale
+        self.current_position = 1
+        self.telemetry_decimation = 0
+        self._homing = (0, 0, 0)         # Podsumowanie bazowania: ms, kroki korekcji, błąd końcowy
+        self._master_fd = None
+        self._slave_fd = None
+        self.port = None
+        self._thread = None
+        self._running = False
+
+        # Stan sekwencji SEQ (jak w firmware)
+        self._sequence = []              # Lista (pozycja, kierunek)
+        self._sequence_index = -1
+        self._sequence_dwell = None      # Sekundy postoju lub None (czekanie na NEXT)
+        self._sequence_waiting = False
+        self._sequence_resume_at = 0.0
+
+    def start(self):
+        import tty
+
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="Esp32Emulator", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master_fd = self._slave_fd = None
+
+    # --- Pętla firmware'u ---
+    def _run(self):
+        self._sleep(self.HOMING_SEC)
+        self._homing = (int(self.HOMING_SEC * 1000), 0, 0)
+        self._report_homing()
+        self._println(f"READY:{self.current_position}")
+
+        buffer = b""
+        while self._running:
+            timeout = 0.1
+            if self._sequence and not self._sequence_waiting:
+                timeout = max(0.0, self._sequence_resume_at - time.perf_counter())
+            readable, _, _ = select.select([self._master_fd], [], [], timeout)
+            if not readable:
+                if self._sequence and not self._sequence_waiting and \
+                        time.perf_counter() >= self._sequence_resume_at:
+                    self._advance_sequence()
+                continue
+            try:
+                chunk = os.read(self._master_fd, 1024)
+            except OSError:
+                break
+            buffer += chunk
+            while b"\n" in buffer:
+                raw, buffer = buffer.split(b"\n", 1)
+                self._parse_command(raw.decode("utf-8", errors="replace").strip())
+
+    def _parse_command(self, command):
+        if not command:
+            return
+        if command == "PING":
+            self._report_homing()
+            self._println(f"READY:{self.current_position}")
+        elif command.startswith("TELEM:"):
+            mode = command[6:]
+            decimation = 0 if mode == "OFF" else int(mode) if mode.isdigit() else -1
+            if decimation < 0 or (mode != "OFF" and decimation == 0):
+                self._println("ERROR: Invalid telemetry mode (OFF lub liczba > 0)")
+            else:
+                self.telemetry_decimation = decimation
+                self._println("OK:TELEM")
+        elif command.startswith("SEQ:"):
+            self._start_sequence(command[4:])
+        elif command == "NEXT":
+            if self._sequence and self._sequence_waiting:
+                self._sequence_waiting = False
+                self._advance_sequence()
+            else:
+                self._println("ERROR: No sequence waiting")
+        elif command == "STOP":
+            if self._sequence:
+                self._finish_sequence()
+            else:
+                self._println(f"OK:{self.current_position}")
+        elif self._sequence:
+            self._println("ERROR: Sequence active")
+        elif command.startswith("GOTO:"):
+            argument, _, direction_text = command[5:].partition(":")
+            direction = {"": 0, "+": 1, "-": -1}.get(direction_text)
+            if direction is None:
+                self._println("ERROR: Invalid direction (musi być + lub -)")
+                return
+            try:
+                target = int(argument)
+            except ValueError:
+                target = 0
+            if 1 <= target <= FILTER_COUNT:
+                self._move_filter(target, direction)
+                self._println(f"OK:{target}")
+            else:
+                self._println("ERROR: Invalid filter ID (musi być 1-8)")
+        else:
+            self._println("ERROR: Unknown command")
+
+    def _start_sequence(self, arguments):
+        items, _, dwell_text = arguments.partition("@")
+        sequence = []
+        try:
+            for item in items.split(","):
+                item = item.strip()
+                direction = {"+": 1, "-": -1}.get(item[-1:], 0)
+                target = int(item[:-1] if direction else item)
+                if not 1 <= target <= FILTER_COUNT:
+                    raise ValueError(item)
+                sequence.append((target, direction))
+            dwell = int(dwell_text) / 1000.0 if dwell_text else None
+        except ValueError:
+            sequence = []
+        if not sequence or len(sequence) > 16:
+            self._println("ERROR: Invalid sequence (pozycje 1-8, max 16)")
+            return
+        self._sequence = sequence
+        self._sequence_index = -1
+        self._sequence_dwell = dwell
+        self._sequence_waiting = False
+        self._advance_sequence()
+
+    def _advance_sequence(self):
+        self._sequence_index += 1
+        if self._sequence_index >= len(self._sequence):
+            self._finish_sequence()
+            return
+        target, direction = self._sequence[self._sequence_index]
+        self._move_filter(target, direction)
+        self._println(f"AT:{target}")
+        if self._sequence_dwell is None:
+            self._sequence_waiting = True
+        else:
+            self._sequence_resume_at = time.perf_counter() + self._sequence_dwell * self.time_scale
+
+    def _finish_sequence(self):
+        self._sequence = []
+        self._sequence_waiting = False
+        self._println(f"OK:SEQ:{self.current_position}")
+
+    def _move_filter(self, target, direction=0):
+        start = time.perf_counter()
+        if target == self.current_position:
+            self._println("INFO: Czas zmiany: 0 ms (juz na miejscu)")
+            return
+
+        # Ruch względny po obwodzie (najkrótszy lub w wymuszonym kierunku), jak w firmware
+        steps = abs(filter_delta(self.current_position, target, direction)) * self.STEPS_PER_FILTER
+        self._sleep(self.move_duration(steps))
+        if self.telemetry_decimation > 0:
+            self._send_move_telemetry(self.current_position, target, steps)
+        self.current_position = target
+        if self.scene is not None:
+            self.scene.filter_position = target
+
+        duration_ms = int((time.perf_counter() - start) * 1000)
+        self._println(f"INFO: Czas zmiany: {duration_ms} ms")
+
+    def _report_homing(self):
+        self._println("HOMED:{},{},{}".format(*self._homing))
+
+    def _send_move_telemetry(self, start_position, target, steps):
+        """Syntetyczny profil ruchu: jazda silnika, potem tłumione domykanie korekcją."""
+        def angle(position, error=0):
+            base = self.ENCODER_HOME_POSITION + (position - 1) * self.ENCODER_STEPS_PER_FILTER
+            return int(base - error) % 4096
+
+        start_error = (target - start_position) * self.ENCODER_STEPS_PER_FILTER
+        travel_ms = int((self.move_duration(steps) - self.CORRECTION_SEC) * 1000)
+        lines = [f"T:S,0,{angle(start_position)},{start_error}"]
+
+        samples = int(self.CORRECTION_SEC / self.CORRECTION_SAMPLE_SEC)
+        initial_error = 40.0
+        for i in range(samples):
+            t = i * self.CORRECTION_SAMPLE_SEC
+            error = int(initial_error * math.exp(-t / 0.03) * math.cos(2 * math.pi * t / 0.05))
+            t_ms = travel_ms + int(t * 1000)
+            if i == 0:
+                lines.append(f"T:R,{t_ms},{angle(target, error)},{error}")
+            elif i % self.telemetry_decimation == 0:
+                lines.append(f"T:C,{t_ms},{angle(target, error)},{error}")
+        end_ms = travel_ms + int(self.CORRECTION_SEC * 1000)
+        lines.append(f"T:E,{end_ms},{angle(target)},0")
+        for line in lines:
+            self._println(line)
+
+    def move_duration(self, steps):
+        """Czas ruchu trapezowego z przyspieszeniem plus korekcja enkodera."""
+        accel_steps = self.MAX_SPEED ** 2 / (2 * self.ACCELERATION)
+        if steps <= 2 * accel_steps:
+            travel = 2 * math.sqrt(steps / self.ACCELERATION)
+        else:
+            cruise = (steps - 2 * accel_steps) / self.MAX_SPEED
+            travel = 2 * self.MAX_SPEED / self.ACCELERATION + cruise
+        return travel + self.CORRECTION_SEC
+
+    def _sleep(self, seconds):
+        time.sleep(seconds * self.time_scale)
+
+    def _println(self, text):
+        if self._master_fd is None:
+            return
+        try:
+            os.write(self._master_fd, (text + "\r\n").encode("utf-8"))
+        except OSError:
+            pass
@@ -0,0 +1,158 @@
+"""
+stacking.py
+
+Uśrednianie wielu klatek jednego pasma (tryb automatyczny).
+FrameStack akumuluje kolejne klatki 16-bit w miejscu - średnia i suma
+kwadratów odchyleń (algorytm Welforda) w buforach float32 zaalokowanych
+raz. Opcjonalne odrzucanie sigma pomija piksele odstające od bieżącej
+średniej o więcej niż k odchyleń (np. promienie kosmiczne, gorące piksele).
+Wynik ma interfejs klatki z puli (image, exposure_us, retain/release),
+więc trafia do kolejki zapisu jak pojedyncza klatka.
+"""
+
+import threading
+
+import numpy as np
+
+
+class FrameStack:
+    """Akumulator N klatek: średnia (image) i opcjonalnie wariancja (variance)."""
+
+    def __init__(self, pool, height, width):
+        self.pool = pool
+        shape = (height, width)
+        self.image = np.zeros(shape, dtype=np.float32)     # Bieżąca średnia
+        self._m2 = np.zeros(shape, dtype=np.float32)       # Suma kwadratów odchyleń
+        self._sample = np.empty(shape, dtype=np.float32)   # Klatka wejściowa jako float32
+        self._delta = np.empty(shape, dtype=np.float32)
+        self._limit = np.empty(shape, dtype=np.float32)
+        self._accepted = np.empty(shape, dtype=bool)
+        self._counts = np.zeros(shape, dtype=np.float32)   # Liczba przyjętych próbek na piksel
+        self.variance = None
+
+        self.frames = 0
+        self.target_frames = 1
+        self.sigma_clip = 0.0
+        self.min_clip_frames = 3   # Odrzucanie dopiero, gdy jest z czego szacować odchylenie
+        self.with_variance = False
+        self.rejected_count = 0
+        self.frame_numbers = []
+        self.timestamps = []
+
+        # Metadane jak w PooledFrame (z pierwszej klatki)
+        self.frame_count = 0
+        self.timestamp = 0.0
+        self.exposure_us = 0
+        self.gain_db = 0.0
+        self.settled = True
+        self._refs = 0
+
+    def reset(self, target_frames, sigma_clip=0.0, with_variance=False):
+        self.frames = 0
+        self.target_frames = max(1, int(target_frames))
+        self.sigma_clip = sigma_clip
+        self.with_variance = with_variance
+        self.rejected_count = 0
+        self.frame_numbers = []
+        self.timestamps = []
+        self.variance = None
+
+    def is_complete(self):
+        return self.frames >= self.target_frames
+
+    def add(self, frame):
+        """Dodaje klatkę (PooledFrame) - wszystkie operacje na buforach stosu."""
+        np.copyto(self._sample, frame.image, casting='unsafe')
+        self.frames += 1
+        self.frame_numbers.append(frame.frame_count)
+        self.timestamps.append(frame.timestamp)
+
+        if self.frames == 1:
+            self.frame_count = frame.frame_count
+            self.timestamp = frame.timestamp
+            self.exposure_us = frame.exposure_us
+            self.gain_db = frame.gain_db
+            np.copyto(self.image, self._sample)
+            self._m2.fill(0.0)
+            self._counts.fill(1.0)
+            return
+
+        np.subtract(self._sample, self.image, out=self._delta)
+        if self.sigma_clip > 0 and self.frames > self.min_clip_frames:
+            # Wariancja z dotychczasowych próbek (n - 1 w mianowniku), nie mniejsza
+            # niż szum śrutowy (wariancja = średnia) - z kilku klatek estymata bywa zaniżona
+            np.subtract(self._counts, 1.0, out=self._limit)
+            np.maximum(self._limit, 1.0, out=self._limit)
+            np.divide(self._m2, self._limit, out=self._limit)
+            np.maximum(self._limit, self.image, out=self._limit)
+            np.maximum(self._limit, 1.0, out=self._limit)
+            np.sqrt(self._limit, out=self._limit)
+            np.multiply(self._limit, self.sigma_clip, out=self._limit)
+            np.abs(self._delta, out=self._sample)
+            np.less_equal(self._sample, self._limit, out=self._accepted)
+            self.rejected_count += int(self._accepted.size - np.count_nonzero(self._accepted))
+            # Odrzucone piksele: delta = 0, licznik bez zmian
+            np.multiply(self._delta, self._accepted, out=self._delta)
+            np.add(self._counts, self._accepted, out=self._counts)
+            np.add(self.image, self._delta, out=self._sample)  # x dla przyjętych, średnia dla odrzuconych
+        else:
+            np.add(self._counts, 1.0, out=self._counts)
+            np.add(self.image, self._delta, out=self._sample)  # x
+
+        # mean += delta / n ; m2 += delta * (x - mean_nowa)
+        np.divide(self._delta, self._counts, out=self._limit)
+        np.add(self.image, self._limit, out=self.image)
+        np.subtract(self._sample, self.image, out=self._sample)
+        np.multiply(self._delta, self._sample, out=self._delta)
+        np.add(self._m2, self._delta, out=self._m2)
+
+    def finish(self):
+        """Zamyka akumulację; wariancja (n - 1) liczona w buforze m2."""
+        if self.with_variance:
+            np.subtract(self._counts, 1.0, out=self._limit)
+            np.maximum(self._limit, 1.0, out=self._limit)
+            np.divide(self._m2, self._limit, out=self._m2)
+            self.variance = self._m2
+        return self
+
+    def retain(self):
+        with self.pool.lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        self.pool._release(self)
+
+
+class StackPool:
+    """Kilka wstępnie zaalokowanych akumulatorów (skan zapisuje pasmo, gdy zbiera kolejne)."""
+
+    def __init__(self, width, height, size=2):
+        self.width = width
+        self.height = height
+        self.size = size
+        self.lock = threading.Lock()
+        self._stacks = []
+        self._free = []
+
+    def acquire(self, target_frames, sigma_clip=0.0, with_variance=False):
+        """Wolny akumulator (alokowany przy pierwszym użyciu) lub None."""
+        with self.lock:
+            if self._free:
+                stack = self._free.pop()
+            elif len(self._stacks) < self.size:
+                stack = FrameStack(self, self.height, self.width)
+                self._stacks.append(stack)
+            else:
+                return None
+            stack._refs = 1
+        stack.reset(target_frames, sigma_clip, with_variance)
+        return stack
+
+    def _release(self, stack):
+        with self.lock:
+            if stack._refs <= 0:
+                return
+            stack._refs -= 1
+            if stack._refs == 0:
+                self._free.append(stack)
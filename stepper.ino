@@ -19,6 +19,30 @@ const float CORRECTION_SPEED = 500;
 int currentFilterPosition = 1;
 String incomingCommand = ""; 
 
+// Telemetria enkodera (TELEM): 0 = wyłączona, N = co N-ta próbka pętli korekcji.
+// Linia CSV: T:<faza>,<ms od startu ruchu>,<kąt 0-4095>,<błąd>
+// Fazy: S - start ruchu, R - koniec ruchu silnika, C - korekcja, H - homing, E - ustalone
+int telemetryDecimation = 0;
+unsigned long telemetrySampleCount = 0;
+unsigned long telemetryStartMs = 0;
+
+// Podsumowanie bazowania: homing w setup() działa przed TELEM, więc zamiast próbek
+// wysyłane jest przed każdym READY:<n> jako HOMED:<ms>,<kroki korekcji>,<błąd końcowy>
+unsigned long homingDurationMs = 0;
+long homingSteps = 0;
+int homingFinalError = 0;
+
+// Sekwencja ruchów (SEQ): lista pozycji odwiedzanych bez pośrednictwa hosta
+const int MAX_SEQUENCE_LENGTH = 16;
+int sequenceTargets[MAX_SEQUENCE_LENGTH];
+int sequenceDirections[MAX_SEQUENCE_LENGTH];
+int sequenceLength = 0;
+int sequenceIndex = 0;
+bool sequenceActive = false;
+bool sequenceWaitingForNext = false;  // Bez czasu postoju czekamy na NEXT od hosta
+long sequenceDwellMs = -1;            // -1 = postój do NEXT
+unsigned long sequenceResumeAt = 0;
+
 AccelStepper stepper(MOTOR_INTERFACE_TYPE, STEP_PIN, DIR_PIN);
 AS5600 as5600; 
 void setup() {
@@ -32,26 +56,64 @@ void setup() {
   stepper.setMaxSpeed(6000);  
   stepper.setAcceleration(4000); 
   runHomingSequence();
+  reportHoming();
+  Serial.println("READY:" + String(currentFilterPosition));
+}
+
+void reportHoming() {
+  Serial.println("HOMED:" + String(homingDurationMs) + "," + String(homingSteps) + "," + String(homingFinalError));
+}
+
+void startTelemetry() {
+  telemetryStartMs = millis();
+  telemetrySampleCount = 0;
+}
+
+// Próbki C/H są przerzedzane, pozostałe fazy wysyłane zawsze (gdy telemetria włączona)
+void telemetrySample(char phase, int angle, int error) {
+  if (telemetryDecimation <= 0) {
+    return;
+  }
+  if (phase == 'C' || phase == 'H') {
+    telemetrySampleCount++;
+    if (telemetrySampleCount % telemetryDecimation != 0) {
+      return;
+    }
+  }
+  Serial.print("T:");
+  Serial.print(phase);
+  Serial.print(',');
+  Serial.print(millis() - telemetryStartMs);
+  Serial.print(',');
+  Serial.print(angle);
+  Serial.print(',');
+  Serial.println(error);
+}
+
+int encoderError(int targetEncoderPosition, int currentAngle) {
+  int error = targetEncoderPosition - currentAngle;
+  if (error > ENCODER_MID_RANGE) {
+    error -= ENCODER_RANGE;
+  } else if (error < -ENCODER_MID_RANGE) {
+    error += ENCODER_RANGE;
+  }
+  return error;
 }
 
 void runHomingSequence() {
   stepper.setSpeed(HOMING_SPEED);
+  startTelemetry();
+  homingSteps = 0;
   while (true) {
     int currentAngle = as5600.readAngle();
-    float degrees = currentAngle * (360.0 / 4095.0);
-    Serial.print("Surowy kąt (0-4095): ");
-    Serial.print(currentAngle);
-    Serial.print("\t Kąt (stopnie): ");
-    Serial.println(degrees, 2);
-    int error = ENCODER_HOME_POSITION - currentAngle;
-    if (error > ENCODER_MID_RANGE) {
-      error -= ENCODER_RANGE;
-    } else if (error < -ENCODER_MID_RANGE) {
-      error += ENCODER_RANGE;
-    }
+    int error = encoderError(ENCODER_HOME_POSITION, currentAngle);
+    telemetrySample('H', currentAngle, error);
     if (abs(error) <= ENCODER_TOLERANCE) {
+      telemetrySample('E', currentAngle, error);
+      homingFinalError = error;
       break; 
     }
+    homingSteps++;
     if (error > 0) {
       stepper.move(1);
     } else {
@@ -61,9 +123,13 @@ void runHomingSequence() {
   }
   stepper.setCurrentPosition(0);
   currentFilterPosition = 1;
+  homingDurationMs = millis() - telemetryStartMs;
 }
 void loop() {
   checkSerialCommands();
+  if (sequenceActive && !sequenceWaitingForNext && (long)(millis() - sequenceResumeAt) >= 0) {
+    advanceSequence();
+  }
 }
 void checkSerialCommands() {
   if (Serial.available() > 0) {
@@ -73,12 +139,58 @@ void checkSerialCommands() {
   }
 }
 void parseCommand(String command) {
-  if (command.startsWith("GOTO:")) {
+  if (command == "PING") {
+    reportHoming();
+    Serial.println("READY:" + String(currentFilterPosition));
+  } else if (command.startsWith("TELEM:")) {
+    // TELEM:OFF lub TELEM:<N> (co N-ta próbka korekcji)
+    String mode = command.substring(6);
+    int decimation = mode == "OFF" ? 0 : mode.toInt();
+    if (mode != "OFF" && decimation <= 0) {
+      Serial.println("ERROR: Invalid telemetry mode (OFF lub liczba > 0)");
+    } else {
+      telemetryDecimation = decimation;
+      Serial.println("OK:TELEM");
+    }
+  } else if (command.startsWith("SEQ:")) {
+    startSequence(command.substring(4));
+  } else if (command == "NEXT") {
+    if (sequenceActive && sequenceWaitingForNext) {
+      sequenceWaitingForNext = false;
+      advanceSequence();
+    } else {
+      Serial.println("ERROR: No sequence waiting");
+    }
+  } else if (command == "STOP") {
+    if (sequenceActive) {
+      finishSequence();
+    } else {
+      Serial.println("OK:" + String(currentFilterPosition));
+    }
+  } else if (sequenceActive) {
+    Serial.println("ERROR: Sequence active");
+  } else if (command.startsWith("GOTO:")) {
+    // GOTO:<n> - najkrótsza droga, GOTO:<n>:+ / GOTO:<n>:- - wymuszony kierunek
     String filterIdString = command.substring(5);
+    int direction = 0;
+    int separator = filterIdString.indexOf(':');
+    if (separator >= 0) {
+      String directionString = filterIdString.substring(separator + 1);
+      filterIdString = filterIdString.substring(0, separator);
+      if (directionString == "+") {
+        direction = 1;
+      } else if (directionString == "-") {
+        direction = -1;
+      } else {
+        Serial.println("ERROR: Invalid direction (musi być + lub -)");
+        return;
+      }
+    }
     int targetFilter = filterIdString.toInt();
     if (targetFilter >= 1 && targetFilter <= FILTER_COUNT) {
       unsigned long startTime = millis();
-      moveFilter(targetFilter, startTime);
+      moveFilter(targetFilter, direction, startTime);
+      Serial.println("OK:" + String(currentFilterPosition));
     } else {
       Serial.println("ERROR: Invalid filter ID (musi być 1-8)");
     }
@@ -86,12 +198,96 @@ void parseCommand(String command) {
     Serial.println("ERROR: Unknown command");
   }
 }
-void moveFilter(int targetFilter, unsigned long startTime) {
+// SEQ:<n>[+|-],<n>[+|-],...[@<postój ms>]
+// Każde dojście potwierdzane jest przez AT:<n>; bez @ kolejny ruch rusza po NEXT.
+// Koniec (lub STOP) potwierdza OK:SEQ:<n>.
+void startSequence(String arguments) {
+  long dwellMs = -1;
+  int dwellSeparator = arguments.indexOf('@');
+  if (dwellSeparator >= 0) {
+    dwellMs = arguments.substring(dwellSeparator + 1).toInt();
+    arguments = arguments.substring(0, dwellSeparator);
+  }
+
+  int length = 0;
+  int start = 0;
+  while (start < (int)arguments.length()) {
+    int comma = arguments.indexOf(',', start);
+    if (comma < 0) {
+      comma = arguments.length();
+    }
+    String item = arguments.substring(start, comma);
+    item.trim();
+    int direction = 0;
+    if (item.endsWith("+")) {
+      direction = 1;
+      item.remove(item.length() - 1);
+    } else if (item.endsWith("-")) {
+      direction = -1;
+      item.remove(item.length() - 1);
+    }
+    int target = item.toInt();
+    if (target < 1 || target > FILTER_COUNT || length >= MAX_SEQUENCE_LENGTH) {
+      Serial.println("ERROR: Invalid sequence (pozycje 1-8, max 16)");
+      return;
+    }
+    sequenceTargets[length] = target;
+    sequenceDirections[length] = direction;
+    length++;
+    start = comma + 1;
+  }
+  if (length == 0) {
+    Serial.println("ERROR: Invalid sequence (pusta lista)");
+    return;
+  }
+
+  sequenceLength = length;
+  sequenceIndex = -1;
+  sequenceDwellMs = dwellMs;
+  sequenceActive = true;
+  sequenceWaitingForNext = false;
+  advanceSequence();
+}
+
+void advanceSequence() {
+  sequenceIndex++;
+  if (sequenceIndex >= sequenceLength) {
+    finishSequence();
+    return;
+  }
+  moveFilter(sequenceTargets[sequenceIndex], sequenceDirections[sequenceIndex], millis());
+  Serial.println("AT:" + String(currentFilterPosition));
+  if (sequenceDwellMs < 0) {
+    sequenceWaitingForNext = true;
+  } else {
+    sequenceResumeAt = millis() + sequenceDwellMs;
+  }
+}
+
+void finishSequence() {
+  sequenceActive = false;
+  sequenceWaitingForNext = false;
+  Serial.println("OK:SEQ:" + String(currentFilterPosition));
+}
+
+// Liczba pozycji do przejścia (ze znakiem) po obwodzie koła.
+// direction = 0 wybiera krótszy kierunek (przy remisie do przodu).
+int filterDelta(int fromFilter, int toFilter, int direction) {
+  int forward = (toFilter - fromFilter + FILTER_COUNT) % FILTER_COUNT;
+  if (direction > 0) {
+    return forward;
+  }
+  if (direction < 0) {
+    return forward == 0 ? 0 : forward - FILTER_COUNT;
+  }
+  return forward <= FILTER_COUNT / 2 ? forward : forward - FILTER_COUNT;
+}
+
+void moveFilter(int targetFilter, int direction, unsigned long startTime) {
   if (targetFilter == currentFilterPosition) {
     unsigned long endTime = millis();
     unsigned long duration = endTime - startTime;
     Serial.println("INFO: Czas zmiany: " + String(duration) + " ms (juz na miejscu)");
-    Serial.println("OK:" + String(targetFilter));
     return;
   }
 
@@ -99,27 +295,25 @@ void moveFilter(int targetFilter, unsigned long startTime) {
 
   int targetEncoderPosition = ENCODER_HOME_POSITION + (targetFilter - 1) * ENCODER_STEPS_PER_FILTER;
 
-  stepper.moveTo(targetSteps);
+  startTelemetry();
+  if (telemetryDecimation > 0) {
+    int startAngle = as5600.readAngle();
+    telemetrySample('S', startAngle, encoderError(targetEncoderPosition, startAngle));
+  }
+
+  // Ruch względny po obwodzie - z pozycji 8 do 1 to jeden krok, nie pełny obrót wstecz
+  stepper.move((long)filterDelta(currentFilterPosition, targetFilter, direction) * STEPS_PER_FILTER);
   stepper.runToPosition();
   stepper.setSpeed(CORRECTION_SPEED);
+  bool firstSample = true;
   while (true) {
-
     int currentAngle = as5600.readAngle();
-    float degrees = currentAngle * (360.0 / 4095.0);
-    Serial.print("Surowy kąt (0-4095): ");
-  Serial.print(currentAngle);
-  Serial.print("\t Kąt (stopnie): ");
-  Serial.println(degrees, 2);
-
-    int error = targetEncoderPosition - currentAngle;
-
-    if (error > ENCODER_MID_RANGE) {
-      error -= ENCODER_RANGE;
-    } else if (error < -ENCODER_MID_RANGE) {
-      error += ENCODER_RANGE;
-    }
+    int error = encoderError(targetEncoderPosition, currentAngle);
+    telemetrySample(firstSample ? 'R' : 'C', currentAngle, error);
+    firstSample = false;
 
     if (abs(error) <= ENCODER_TOLERANCE) {
+      telemetrySample('E', currentAngle, error);
       break; 
     }
 
@@ -138,5 +332,4 @@ void moveFilter(int targetFilter, unsigned long startTime) {
   Serial.println("INFO: Czas zmiany: " + String(duration) + " ms");
 
   currentFilterPosition = targetFilter;
-  Serial.println("OK:" + String(currentFilterPosition));
 }
@@ -0,0 +1,129 @@
+"""
+telemetry.py
+
+Odbiór telemetrii enkodera ze sterownika koła (polecenie TELEM:<N>).
+Sterownik wysyła linie CSV "T:<faza>,<ms>,<kąt 0-4095>,<błąd>"; parser
+zbiera je w trakcie ruchu i po potwierdzeniu dojścia (OK:/AT:) składa
+profil ruchu: kąt w czasie, czas jazdy silnika, czas domykania korekcją
+enkodera i przeregulowanie. Parsowanie odbywa się w wątku połączenia
+szeregowego, linia po linii - bez dodatkowych odczytów portu.
+
+Bazowanie przy starcie sterownika odbywa się przed poleceniem TELEM, więc
+zamiast próbek sterownik wysyła jego podsumowanie linią
+"HOMED:<ms>,<kroki korekcji>,<błąd końcowy>" przed każdym READY:<n>.
+"""
+
+ENCODER_RANGE = 4096
+DEGREES_PER_COUNT = 360.0 / ENCODER_RANGE
+
+# Fazy próbek (jak w stepper.ino)
+PHASE_START = "S"        # Start ruchu
+PHASE_RUN_END = "R"      # Koniec ruchu silnika (przed korekcją)
+PHASE_CORRECTION = "C"
+PHASE_HOMING = "H"
+PHASE_SETTLED = "E"      # Pozycja w tolerancji
+
+
+def parse_telemetry_line(line):
+    """Zwraca (faza, ms, kąt, błąd) dla linii "T:..." lub None."""
+    if not line.startswith("T:"):
+        return None
+    fields = line[2:].split(",")
+    if len(fields) != 4:
+        return None
+    try:
+        return fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+    except ValueError:
+        return None
+
+
+def parse_homing_line(line):
+    """Podsumowanie bazowania z linii "HOMED:<ms>,<kroki>,<błąd>" lub None."""
+    if not line.startswith("HOMED:"):
+        return None
+    fields = line[6:].split(",")
+    if len(fields) != 3:
+        return None
+    try:
+        duration_ms, steps, error = (int(field) for field in fields)
+    except ValueError:
+        return None
+    return {
+        "duration_ms": duration_ms,
+        "correction_steps": steps,
+        "final_error_counts": error,
+        "final_error_deg": round(error * DEGREES_PER_COUNT, 2),
+    }
+
+
+class MoveTelemetry:
+    """
+    Strumieniowy parser telemetrii jednego połączenia.
+    feed() przyjmuje każdą linię (zwraca True, jeśli była telemetrią),
+    finish_move() zamyka bieżący ruch i zwraca jego profil (lub None,
+    gdy telemetria była wyłączona).
+    """
+
+    def __init__(self):
+        self._samples = []
+
+    def feed(self, line):
+        sample = parse_telemetry_line(line)
+        if sample is None:
+            return False
+        if sample[0] == PHASE_START:
+            self._samples = []
+        self._samples.append(sample)
+        return True
+
+    def reset(self):
+        self._samples = []
+
+    def finish_move(self, position=0):
+        samples, self._samples = self._samples, []
+        if not samples:
+            return None
+        return move_profile(samples, position)
+
+
+def move_profile(samples, position=0):
+    """
+    Profil ruchu z próbek (faza, ms, kąt, błąd):
+    travel_ms - jazda silnika do końca runToPosition (próbka R),
+    settle_ms - od końca jazdy do wejścia w tolerancję (próbka E),
+    overshoot_counts/deg - największe wychylenie po przejściu błędu przez zero.
+    """
+    times = {}
+    for phase, ms, _, _ in samples:
+        times.setdefault(phase, ms)
+
+    run_end = times.get(PHASE_RUN_END)
+    settled = None
+    for phase, ms, _, _ in samples:
+        if phase == PHASE_SETTLED:
+            settled = ms
+
+    # Przeregulowanie: błąd po pierwszej zmianie znaku względem końca jazdy
+    correction = [error for phase, _, _, error in samples
+                  if phase in (PHASE_RUN_END, PHASE_CORRECTION, PHASE_SETTLED)]
+    overshoot = 0
+    if correction:
+        initial_sign = 1 if correction[0] >= 0 else -1
+        crossed = [error for error in correction if error * initial_sign < 0]
+        if crossed:
+            overshoot = max(abs(error) for error in crossed)
+
+    return {
+        "position": position,
+        "samples": [
+            {"phase": phase, "t_ms": ms, "angle": angle,
+             "angle_deg": round(angle * DEGREES_PER_COUNT, 2), "error": error}
+            for phase, ms, angle, error in samples
+        ],
+        "travel_ms": run_end,
+        "settle_ms": settled - run_end if settled is not None and run_end is not None else None,
+        "total_ms": settled,
+        "correction_error_counts": correction[0] if correction else None,
+        "overshoot_counts": overshoot,
+        "overshoot_deg": round(overshoot * DEGREES_PER_COUNT, 2),
+    }
@@ -0,0 +1,57 @@
+import numpy as np
+
+from calibration_engine import fit_filter_models, fit_linearity
+
+
+def linear_points(offset, slope, exposures, saturated_fraction=0.0):
+    return [(t, offset + slope * t, saturated_fraction) for t in exposures]
+
+
+def test_fit_linearity_recovers_offset_and_slope_per_filter():
+    t = np.array([[2.0, 4.0, 8.0], [1.0, 3.0, np.nan]])
+    m = np.array([[500 + 1000 * 2, 500 + 1000 * 4, 500 + 1000 * 8], [200 + 50 * 1, 200 + 50 * 3, np.nan]])
+    offset, slope, two_points, used, _ = fit_linearity(t, m, np.ones_like(t, dtype=bool))
+    np.testing.assert_allclose(offset, [500, 200])
+    np.testing.assert_allclose(slope, [1000, 50])
+    assert two_points.all()
+    assert used.tolist() == [[True, True, True], [True, True, False]]
+
+
+def test_fit_linearity_drops_outlier():
+    t = np.array([[1.0, 2.0, 3.0, 4.0, 5.0]])
+    m = 100 + 1000 * t
+    m[0, 2] *= 1.3
+    offset, slope, _, used, _ = fit_linearity(t, m, np.ones_like(t, dtype=bool))
+    assert used.tolist() == [[True, True, False, True, True]]
+    np.testing.assert_allclose(slope, [1000])
+
+
+def test_saturated_points_are_excluded_and_flagged():
+    points = linear_points(1000, 2000, [2.0, 4.0, 8.0])
+    points.append((40.0, 65535.0, 0.4))
+    model = fit_filter_models([points])[0]
+    assert "saturated" in model["flags"]
+    assert model["points"] == 3
+    assert model["offset"] == 1000.0
+    assert model["slope_per_ms"] == 2000.0
+    assert model["optimal_exposure_ms"] == round((65535 * 0.8 - 1000) / 2000, 4)
+
+
+def test_single_exposure_fits_line_through_zero():
+    model = fit_filter_models([[(10.0, 26214.0, 0.0)]])[0]
+    assert model["flags"] == ["single_exposure"]
+    assert model["offset"] == 0.0
+    assert model["optimal_exposure_ms"] == 20.0
+
+
+def test_filters_without_signal_get_no_exposure():
+    models = fit_filter_models([
+        linear_points(500, 0, [2.0, 4.0]),
+        [(5.0, 65535.0, 1.0)],
+        [],
+    ])
+    for model in models:
+        assert "no_signal" in model["flags"]
+        assert model["optimal_exposure_ms"] is None
+    assert models[1]["points"] == 0 and "saturated" in models[1]["flags"]
+    assert models[2]["offset"] is None
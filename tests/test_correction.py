@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from correction import DTYPE_FLOAT32, DTYPE_UINT16, CorrectionPlan, FrameCorrector, MasterFrames
+
+SHAPE = (4, 6)
+
+
+class Frame:
+    """Klatka z puli w zakresie potrzebnym do planu korekcji."""
+
+    def __init__(self, image, exposure_us=10000, gain_db=0.0):
+        self.image = image
+        self.exposure_us = exposure_us
+        self.gain_db = gain_db
+
+
+@pytest.fixture
+def masters(tmp_path):
+    masters = MasterFrames(str(tmp_path))
+    masters.store_dark(np.full(SHAPE, 100.0), 10000, 0.0)
+    masters.store_dark(np.full(SHAPE, 300.0), 30000, 0.0)
+    return masters
+
+
+def test_exact_dark(masters):
+    dark, info = masters.dark(10000, 0.0, SHAPE)
+    assert info["method"] == "exact"
+    assert dark[0, 0] == 100.0
+
+
+def test_dark_interpolated_between_neighbours(masters):
+    dark, info = masters.dark(15000, 0.0, SHAPE)
+    assert info["method"] == "interpolated"
+    assert info["file"] == ["dark_10000us_0.0dB.npy", "dark_30000us_0.0dB.npy"]
+    np.testing.assert_allclose(dark, 150.0)
+    assert masters.dark(15000, 0.0, SHAPE)[0] is dark   # Z pamięci podręcznej
+
+
+@pytest.mark.parametrize("exposure_us, expected", [(5000, 100.0), (50000, 300.0)])
+def test_dark_outside_recorded_range_uses_nearest(masters, exposure_us, expected):
+    dark, info = masters.dark(exposure_us, 0.0, SHAPE)
+    assert info["method"] == "nearest"
+    assert dark[0, 0] == expected
+
+
+def test_dark_missing_for_other_gain_or_shape(masters):
+    assert masters.dark(10000, 6.0, SHAPE) == (None, None)
+    assert masters.dark(10000, 0.0, (2, 2)) == (None, None)
+
+
+def test_masters_reload_from_disk(masters, tmp_path):
+    reloaded = MasterFrames(str(tmp_path))
+    dark, info = reloaded.dark(20000, 0.0, SHAPE)
+    assert info["method"] == "interpolated"
+    np.testing.assert_allclose(dark, 200.0)
+
+
+def test_flat_is_dark_subtracted_and_normalised(masters):
+    flat = np.full(SHAPE, 1100.0)
+    flat[:, :3] = 2100.0
+    masters.store_flat(flat, 2, 10000, 0.0)
+    revision = masters.revision
+    plan = FrameCorrector(masters).plan(Frame(np.full(SHAPE, 1600, np.uint16)), position=2)
+    result = plan.apply(np.full(SHAPE, 1600, np.uint16))
+    assert plan.info["flat"] == {"file": "flat_pos2.npy"}
+    # (1600 - 100) / (2000 / 1500) i (1600 - 100) / (1000 / 1500)
+    np.testing.assert_allclose(result[:, :3], 1125.0)
+    np.testing.assert_allclose(result[:, 3:], 2250.0)
+    masters.store_dark(np.full(SHAPE, 50.0), 20000, 0.0)
+    assert masters.revision == revision + 1
+
+
+def test_uint16_output_is_rounded_and_clipped():
+    dark = np.full(SHAPE, 200.0, dtype=np.float32)
+    plan = CorrectionPlan(dark, None, 2.0, DTYPE_UINT16, {})
+    image = np.array([[100, 300, 33000, 40000, 250, 200]] * SHAPE[0], dtype=np.uint16)
+    result = plan.apply(image)
+    assert result.dtype == np.uint16
+    assert result[0].tolist() == [0, 200, 65535, 65535, 100, 0]
+
+
+def test_float32_output_keeps_negative_values():
+    plan = CorrectionPlan(np.full(SHAPE, 200.0, dtype=np.float32), None, 1.0, DTYPE_FLOAT32, {})
+    result = plan.apply(np.full(SHAPE, 150, dtype=np.uint16))
+    assert result.dtype == np.float32
+    assert result[0, 0] == -50.0
@@ -0,0 +1,58 @@
+import numpy as np
+
+from exposure import AutoExposure
+
+
+def sensor(rate_per_ms, shape=(64, 64), black_level=0.0):
+    """Liniowy sensor z nasyceniem: klatka dla zadanej ekspozycji."""
+    pattern = np.linspace(0.5, 1.0, shape[0] * shape[1]).reshape(shape)
+
+    def expose(exposure_ms):
+        level = black_level + rate_per_ms * exposure_ms * pattern
+        return np.clip(level, 0, 65535).astype(np.uint16)
+
+    return expose
+
+
+def run(controller, expose, exposure_ms):
+    while not controller.done:
+        exposure_ms = controller.update(expose(exposure_ms), exposure_ms)
+    return exposure_ms
+
+
+def test_converges_from_underexposed_frame():
+    controller = AutoExposure(target_fraction=0.5, step=1)
+    expose = sensor(rate_per_ms=400.0)
+    final_ms = run(controller, expose, 1.0)
+    assert controller.converged
+    assert controller.iterations <= 3
+    mean_fraction = expose(final_ms).mean() / 65535
+    assert abs(mean_fraction - 0.5) < 0.05
+
+
+def test_saturated_frame_shortens_exposure():
+    controller = AutoExposure(target_fraction=0.5, step=1)
+    expose = sensor(rate_per_ms=400.0)
+    assert controller.update(expose(1000.0), 1000.0) == 250.0
+    final_ms = run(controller, expose, 250.0)
+    assert controller.converged
+    assert controller.saturated_fraction == 0.0
+    assert abs(expose(final_ms).mean() / 65535 - 0.5) < 0.05
+
+
+def test_highlights_keep_headroom_below_saturation():
+    controller = AutoExposure(target_fraction=0.9, step=1)
+    expose = sensor(rate_per_ms=100.0)
+    final_ms = run(controller, expose, 10.0)
+    assert controller.converged
+    assert expose(final_ms).max() < 0.98 * 65535
+
+
+def test_stops_at_exposure_limit_without_converging():
+    controller = AutoExposure(target_fraction=0.8, step=1, max_exposure_ms=20.0)
+    final_ms = run(controller, sensor(rate_per_ms=10.0), 5.0)
+    assert controller.done and not controller.converged
+    assert final_ms == 20.0
+    summary = controller.summary()
+    assert summary["final_exposure_ms"] == 20.0
+    assert summary["iterations"] == len(summary["history"])
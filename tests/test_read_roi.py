@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from calibration_engine import _to_gray, read_roi, roi_bounds
+
+tifffile = pytest.importorskip("tifffile")
+
+ROI_FACTOR = 0.3
+
+
+def expected_roi(image, channel_axis=-1):
+    height, width = image.shape[1:3] if channel_axis == 0 else image.shape[:2]
+    y0, y1, x0, x1 = roi_bounds(height, width, ROI_FACTOR)
+    if channel_axis == 0:
+        return _to_gray(image[:, y0:y1, x0:x1], channel_axis=0)
+    return _to_gray(image[y0:y1, x0:x1])
+
+
+@pytest.fixture
+def gray():
+    return np.arange(120 * 160, dtype=np.uint16).reshape(120, 160)
+
+
+@pytest.mark.parametrize("options", [
+    {},                                                  # Nieskompresowany - memmap
+    {"compression": "zlib", "rowsperstrip": 16},         # Paski
+    {"compression": "zlib", "tile": (32, 48)},           # Kafelki (niepełne na brzegach)
+])
+def test_gray_roi_matches_full_read(tmp_path, gray, options):
+    path = str(tmp_path / "biel.tif")
+    tifffile.imwrite(path, gray, **options)
+    np.testing.assert_array_equal(read_roi(path, ROI_FACTOR), expected_roi(gray))
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_rgb_roi_is_converted_to_luminance(tmp_path, compression):
+    rng = np.random.default_rng(3)
+    rgb = rng.integers(0, 65535, size=(90, 100, 3), dtype=np.uint16)
+    path = str(tmp_path / "biel.tif")
+    tifffile.imwrite(path, rgb, photometric="rgb", compression=compression, rowsperstrip=8)
+    np.testing.assert_allclose(read_roi(path, ROI_FACTOR), expected_roi(rgb))
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_planar_rgb_roi(tmp_path, compression):
+    rng = np.random.default_rng(4)
+    planes = rng.integers(0, 65535, size=(3, 90, 100), dtype=np.uint16)
+    path = str(tmp_path / "biel.tif")
+    tifffile.imwrite(path, planes, photometric="rgb", planarconfig="separate", compression=compression)
+    np.testing.assert_allclose(read_roi(path, ROI_FACTOR), expected_roi(planes, channel_axis=0))
@@ -0,0 +1,35 @@
+import json
+
+import numpy as np
+import pytest
+
+from saving import MemmapCubeWriter, TiffCubeWriter
+
+
+def _write_out_of_order(writer, order=(2, 0, 1)):
+    pages = []
+    for band_index in order:
+        image = np.full((4, 5), band_index, dtype=np.uint16)
+        pages.append(writer.write_band(image, {"band_index": band_index}, band_index))
+    writer.close()
+    return pages
+
+
+def test_memmap_cube_stores_bands_at_band_index(tmp_path):
+    writer = MemmapCubeWriter(str(tmp_path / "cube.npy"), 3)
+    assert _write_out_of_order(writer) == [2, 0, 1]
+    cube = np.load(tmp_path / "cube.npy")
+    assert cube.shape == (3, 4, 5)
+    assert list(cube[:, 0, 0]) == [0, 1, 2]
+    assert writer.page_bands == [0, 1, 2]
+
+
+def test_tiff_cube_records_band_of_each_page(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    writer = TiffCubeWriter(str(tmp_path / "cube.tif"), 3)
+    assert _write_out_of_order(writer) == [0, 1, 2]
+    assert writer.page_bands == [2, 0, 1]
+    with tifffile.TiffFile(tmp_path / "cube.tif") as tif:
+        for page, band_index in zip(tif.pages, writer.page_bands):
+            assert json.loads(page.description)["band_index"] == band_index
+            assert page.asarray()[0, 0] == band_index
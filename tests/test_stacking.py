@@ -0,0 +1,58 @@
+import numpy as np
+
+from stacking import StackPool
+
+
+class Frame:
+    """Minimalna klatka z puli (image i metadane)."""
+
+    def __init__(self, image, frame_count):
+        self.image = image
+        self.frame_count = frame_count
+        self.timestamp = float(frame_count)
+        self.exposure_us = 10000
+        self.gain_db = 0.0
+
+
+def stack_frames(frames, sigma_clip=0.0, with_variance=True):
+    pool = StackPool(width=frames[0].shape[1], height=frames[0].shape[0])
+    stack = pool.acquire(len(frames), sigma_clip, with_variance)
+    for number, image in enumerate(frames, start=1):
+        stack.add(Frame(image, number))
+    assert stack.is_complete()
+    return stack.finish()
+
+
+def test_mean_and_variance_match_numpy():
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(1000, 60000, size=(6, 7), dtype=np.uint16) for _ in range(8)]
+    stack = stack_frames(frames)
+    data = np.stack(frames).astype(np.float64)
+    np.testing.assert_allclose(stack.image, data.mean(axis=0), rtol=1e-5)
+    np.testing.assert_allclose(stack.variance, data.var(axis=0, ddof=1), rtol=1e-3)
+    assert stack.image.dtype == np.float32
+    assert stack.frame_numbers == list(range(1, 9))
+    assert stack.exposure_us == 10000
+
+
+def test_sigma_clip_rejects_outlier_pixel():
+    rng = np.random.default_rng(2)
+    frames = [rng.normal(1000, 30, size=(5, 5)).astype(np.uint16) for _ in range(10)]
+    clean = np.stack(frames).astype(np.float64).mean(axis=0)
+    frames[6][2, 3] = 60000   # Promień kosmiczny
+    stack = stack_frames(frames, sigma_clip=3.0)
+    assert stack.rejected_count >= 1
+    assert abs(stack.image[2, 3] - clean[2, 3]) < 50
+    assert stack.variance[2, 3] < 100 * 30 ** 2
+
+    unclipped = stack_frames(frames)
+    assert unclipped.image[2, 3] > clean[2, 3] + 5000
+
+
+def test_pool_reuses_released_stack():
+    pool = StackPool(width=2, height=2, size=1)
+    stack = pool.acquire(2)
+    assert pool.acquire(2) is None
+    stack.release()
+    assert pool.acquire(3) is stack
+    assert stack.frames == 0 and stack.target_frames == 3
@@ -0,0 +1,46 @@
+from telemetry import MoveTelemetry, parse_homing_line, parse_telemetry_line
+
+
+def test_parse_telemetry_line():
+    assert parse_telemetry_line("T:R,120,1024,-8") == ("R", 120, 1024, -8)
+    assert parse_telemetry_line("OK:3") is None
+    assert parse_telemetry_line("T:R,120,1024") is None
+    assert parse_telemetry_line("T:R,abc,1024,0") is None
+
+
+def test_parse_homing_line():
+    assert parse_homing_line("HOMED:1830,12,-2") == {
+        "duration_ms": 1830,
+        "correction_steps": 12,
+        "final_error_counts": -2,
+        "final_error_deg": -0.18,
+    }
+    assert parse_homing_line("READY:1") is None
+    assert parse_homing_line("HOMED:1830,12") is None
+    assert parse_homing_line("HOMED:x,12,0") is None
+
+
+def test_move_profile_from_streamed_lines():
+    telemetry = MoveTelemetry()
+    lines = ["T:S,0,0,512", "T:R,300,500,12", "T:C,320,515,-3", "T:C,340,512,1", "T:E,360,512,0"]
+    assert all(telemetry.feed(line) for line in lines)
+    assert not telemetry.feed("OK:2")
+    profile = telemetry.finish_move(position=2)
+    assert profile["position"] == 2
+    assert profile["travel_ms"] == 300
+    assert profile["settle_ms"] == 60
+    assert profile["total_ms"] == 360
+    assert profile["correction_error_counts"] == 12
+    assert profile["overshoot_counts"] == 3
+    assert len(profile["samples"]) == 5
+    assert telemetry.finish_move() is None   # Bez nowych próbek (telemetria wyłączona)
+
+
+def test_new_move_discards_previous_samples():
+    telemetry = MoveTelemetry()
+    telemetry.feed("T:S,0,0,100")
+    telemetry.feed("T:R,50,90,10")
+    telemetry.feed("T:S,0,90,400")
+    profile = telemetry.finish_move()
+    assert [sample["phase"] for sample in profile["samples"]] == ["S"]
+    assert profile["travel_ms"] is None
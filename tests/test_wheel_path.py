@@ -0,0 +1,39 @@
+from wheel_path import filter_delta, plan_visit_order, sequence_command
+
+
+def test_filter_delta_wraps_around():
+    assert filter_delta(8, 1) == 1
+    assert filter_delta(1, 8) == -1
+    assert filter_delta(1, 5) == 4          # Remis - do przodu
+    assert filter_delta(1, 8, direction=1) == 7
+    assert filter_delta(3, 3, direction=-1) == 0
+
+
+def test_plan_crosses_from_last_to_first_position():
+    plan, travel = plan_visit_order([1, 2], start_position=8)
+    assert plan == [(1, 1), (2, 1)]
+    assert travel == 2
+
+
+def test_plan_visits_subset_in_shortest_order():
+    plan, travel = plan_visit_order([7, 2], start_position=1)
+    assert plan == [(2, 1), (7, -3)]
+    assert travel == 4
+
+
+def test_plan_all_positions_from_middle_goes_one_way():
+    plan, travel = plan_visit_order(range(1, 9), start_position=5)
+    assert [position for position, _ in plan] == [5, 6, 7, 8, 1, 2, 3, 4]
+    assert travel == 7
+
+
+def test_plan_without_start_begins_at_first_position_and_drops_duplicates():
+    plan, travel = plan_visit_order([3, 3, 5], start_position=None)
+    assert plan == [(3, 0), (5, 2)]
+    assert travel == 2
+    assert plan_visit_order([], start_position=4) == ([], 0)
+
+
+def test_sequence_command_marks_direction():
+    assert sequence_command([(1, 1), (8, -1), (3, 0)]) == "SEQ:1+,8-,3\n"
+    assert sequence_command([(2, 1)], dwell_ms=250) == "SEQ:2+@250\n"
@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("PySide6")
+pytest.importorskip("serial")
+
+from workers import WheelCommandQueue
+
+
+@pytest.fixture
+def queue():
+    queue = WheelCommandQueue(filter_count=8)
+    queue.sent = []
+    queue.reached = []
+    queue.command_requested.connect(queue.sent.append)
+    queue.target_reached.connect(queue.reached.append)
+    queue.set_position(1)
+    return queue
+
+
+def arrive(queue, position):
+    """Odpowiedź sterownika i koniec polecenia w wątku połączenia."""
+    queue.on_response(f"OK:{position}")
+    queue.on_finished()
+
+
+def test_requests_during_move_coalesce_into_one(queue):
+    queue.request_target(3)
+    for target in (4, 5, 6):
+        queue.request_target(target)
+    assert queue.sent == ["GOTO:3\n"]
+    assert queue.pending == 6
+    assert queue.coalesced_count == 2
+
+    arrive(queue, 3)
+    assert queue.sent == ["GOTO:3\n", "GOTO:6\n"]
+    assert queue.reached == []
+    arrive(queue, 6)
+    assert queue.reached == [6]
+    assert not queue.is_busy()
+
+
+def test_steps_count_from_latest_target_and_wrap(queue):
+    for _ in range(5):
+        queue.request_step(1)
+    assert queue.latest_target() == 6
+    arrive(queue, 2)
+    arrive(queue, 6)
+    assert queue.sent == ["GOTO:2\n", "GOTO:6\n"]
+
+    queue.request_step(3)
+    assert queue.sent[-1] == "GOTO:1\n"
+
+
+def test_returning_to_target_in_flight_cancels_pending(queue):
+    queue.request_target(4)
+    queue.request_target(7)
+    queue.request_target(4)
+    assert queue.pending is None
+    arrive(queue, 4)
+    assert queue.sent == ["GOTO:4\n"]
+    assert queue.reached == [4]
+
+
+def test_error_drops_pending_target(queue):
+    queue.request_target(3)
+    queue.request_target(5)
+    queue.on_response("ERROR:ENCODER")
+    queue.on_finished()
+    assert queue.sent == ["GOTO:3\n"]
+    assert queue.reached == []
+    assert not queue.is_busy()
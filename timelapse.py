@@ -0,0 +1,217 @@
+"""
+timelapse.py
+
+Sesja poklatkowa (time-lapse): powtarzanie pełnych skanów trybu
+automatycznego co zadany odstęp albo jeden po drugim przez zadany czas.
+TimeLapseScheduler steruje istniejącym ScanScheduler - każdy skan trafia do
+własnego katalogu w katalogu sesji i jest zapisywany strumieniowo przez
+kolejkę zapisu, więc zużycie pamięci nie rośnie z liczbą skanów.
+Wpis każdego skanu (planowany i faktyczny start, dryf, czasy) dopisywany
+jest do timelapse.jsonl; opcjonalnie zachowywane jest tylko N ostatnich
+skanów (starsze katalogi usuwa wątek zapisu).
+"""
+
+import collections
+import functools
+import json
+import os
+import shutil
+import time
+
+from PySide6.QtCore import QObject, Signal, Slot, QTimer
+
+from saving import create_scan_directory
+
+
+class TimeLapseScheduler(QObject):
+    """
+    Powtarza skany ScanScheduler według harmonogramu:
+    interval_s > 0 - starty co interval_s od początku sesji (stałe tempo,
+    spóźniony skan rusza od razu), interval_s = 0 - skany jeden po drugim.
+    Sesja kończy się po duration_s (nowy skan nie startuje po tym czasie)
+    lub po max_scans skanach (0 = bez limitu).
+    """
+    progress = Signal(str)
+    scan_logged = Signal(dict)       # Wpis skanu (jak w timelapse.jsonl)
+    session_finished = Signal(dict)
+
+    def __init__(self, scan_scheduler, save_queue):
+        super().__init__()
+        self.scan_scheduler = scan_scheduler
+        self.save_queue = save_queue
+        self.interval_s = 0.0
+        self.duration_s = 0.0
+        self.max_scans = 0
+        self.keep_scans = 0              # Ile ostatnich katalogów skanów zachować (0 = wszystkie)
+
+        self.active = False
+        self.session_dir = None
+        self.log_path = None
+        self.scan_count = 0
+        self.failed = False
+        self._scan_args = None
+        self._start_position = None
+        self._session_start = 0.0
+        self._planned_start = 0.0
+        self._actual_start = 0.0
+        self._first_scan_ms = None
+        self._max_drift_ms = 0.0
+        self._overruns = 0
+        self._kept_dirs = collections.deque()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._start_scan)
+
+        self.scan_scheduler.scan_finished.connect(self._on_scan_finished)
+        self.scan_scheduler.output_written.connect(self._on_output_written)
+
+    # ---------------------------------------------------
+    # Sterowanie
+    # ---------------------------------------------------
+    def start(self, steps, base_exposure_ms, format_str="TIFF 16-bit", cube_class=None,
+              output_base_dir=".", start_position=None):
+        """Rozpoczyna sesję; argumenty jak w ScanScheduler.start()."""
+        if self.active or self.scan_scheduler.active:
+            return
+        self.session_dir = create_scan_directory(output_base_dir, prefix="timelapse")
+        self.log_path = os.path.join(self.session_dir, "timelapse.jsonl")
+        self._scan_args = (steps, base_exposure_ms, format_str, cube_class)
+        self._start_position = start_position
+        self.active = True
+        self.failed = False
+        self.scan_count = 0
+        self._first_scan_ms = None
+        self._max_drift_ms = 0.0
+        self._overruns = 0
+        self._kept_dirs.clear()
+        self._session_start = time.perf_counter()
+        self._planned_start = self._session_start
+        print(f"--- START SESJI POKLATKOWEJ --- {self.session_dir} "
+              f"(co {self.interval_s:g} s, czas {self.duration_s:g} s, skany {self.max_scans or '-'})")
+        self._start_scan()
+
+    def stop(self, error=False):
+        """Kończy sesję; trwający skan jest przerywany."""
+        if not self.active:
+            return
+        self.failed = self.failed or error
+        self.active = False
+        self._timer.stop()
+        if self.scan_scheduler.active:
+            # scan_finished dopisze do dziennika wpis przerwanego skanu
+            self.scan_scheduler.stop(error)
+        self._finish_session()
+
+    def _finish_session(self):
+        summary = {
+            "session_dir": self.session_dir,
+            "scans": self.scan_count,
+            "error": self.failed,
+            "elapsed_s": round(time.perf_counter() - self._session_start, 3),
+            "max_start_drift_ms": round(self._max_drift_ms, 1),
+            "overruns": self._overruns,
+        }
+        print(f"--- KONIEC SESJI POKLATKOWEJ --- {summary}")
+        self.session_finished.emit(summary)
+
+    def _session_over(self, now):
+        if self.max_scans and self.scan_count >= self.max_scans:
+            return True
+        return self.duration_s > 0 and now - self._session_start >= self.duration_s
+
+    # ---------------------------------------------------
+    # Kolejne skany
+    # ---------------------------------------------------
+    @Slot()
+    def _start_scan(self):
+        if not self.active:
+            return
+        self._actual_start = time.perf_counter()
+        steps, base_exposure_ms, format_str, cube_class = self._scan_args
+        self.progress.emit(f"Sesja: skan {self.scan_count + 1}")
+        self.scan_scheduler.start(
+            steps, base_exposure_ms, format_str=format_str, cube_class=cube_class,
+            output_base_dir=self.session_dir, start_position=self._start_position,
+        )
+
+    @Slot(dict)
+    def _on_scan_finished(self, summary):
+        if self.session_dir is None or summary.get("scan_dir") is None \
+                or not summary["scan_dir"].startswith(self.session_dir):
+            return  # Skan spoza sesji (pojedynczy tryb auto)
+        self.scan_count += 1
+        drift_ms = (self._actual_start - self._planned_start) * 1000
+        self._max_drift_ms = max(self._max_drift_ms, abs(drift_ms))
+        if self._first_scan_ms is None:
+            self._first_scan_ms = summary["total_ms"]
+        entry = {
+            "scan": self.scan_count,
+            "scan_dir": os.path.basename(summary["scan_dir"]),
+            "completed": summary["completed"],
+            "planned_start_s": round(self._planned_start - self._session_start, 3),
+            "start_s": round(self._actual_start - self._session_start, 3),
+            "start_drift_ms": round(drift_ms, 1),
+            "total_ms": summary["total_ms"],
+            "duration_drift_ms": round(summary["total_ms"] - self._first_scan_ms, 1),
+            "move_sum_ms": summary["move_sum_ms"],
+            "exposure_sum_ms": summary["exposure_sum_ms"],
+        }
+        # Kolejny skan zaczyna od pozycji, na której skończył poprzedni
+        if summary["completed"] and summary["visit_order"]:
+            self._start_position = summary["visit_order"][-1]
+
+        if summary["error"] or not self.active:
+            self.failed = self.failed or summary["error"]
+            self._append_log(entry)
+            if self.active:
+                self.active = False
+                self._timer.stop()
+                self._finish_session()
+            return
+
+        now = time.perf_counter()
+        if self.interval_s > 0:
+            self._planned_start += self.interval_s
+            if self._planned_start < now:
+                # Skan dłuższy niż odstęp - następny rusza od razu, tempo zostaje
+                self._overruns += 1
+                entry["overrun"] = True
+        else:
+            self._planned_start = now
+        self._append_log(entry)
+
+        if self._session_over(max(now, self._planned_start)):
+            self.active = False
+            self._finish_session()
+            return
+        delay_ms = max(0, int((self._planned_start - now) * 1000))
+        self.progress.emit(f"Sesja: skan {self.scan_count} gotowy, następny za {delay_ms / 1000:.1f} s")
+        self._timer.start(delay_ms)
+
+    def _append_log(self, entry):
+        """Dopisuje wpis skanu do timelapse.jsonl (w wątku zapisu, za scan.json)."""
+        log_path = self.log_path
+        line = json.dumps(entry, ensure_ascii=False)
+
+        def append():
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+        self.save_queue.submit_task(append, label=log_path)
+        self.scan_logged.emit(entry)
+        print(f"Sesja: skan {entry['scan']} - start {entry['start_s']:.1f} s "
+              f"(dryf {entry['start_drift_ms']:+.0f} ms), czas {entry['total_ms']:.0f} ms")
+
+    @Slot(dict)
+    def _on_output_written(self, summary):
+        """Rotacja: po zapisie skanu usuwa katalogi ponad keep_scans najnowszych."""
+        scan_dir = summary.get("scan_dir")
+        if self.session_dir is None or scan_dir is None or not scan_dir.startswith(self.session_dir):
+            return
+        if self.keep_scans <= 0:
+            return
+        self._kept_dirs.append(scan_dir)
+        while len(self._kept_dirs) > self.keep_scans:
+            old_dir = self._kept_dirs.popleft()
+            self.save_queue.submit_task(functools.partial(shutil.rmtree, old_dir, ignore_errors=True), label=old_dir)
+            print(f"Sesja: usunięto najstarszy skan {old_dir}")
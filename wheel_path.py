@@ -0,0 +1,109 @@
+"""
+wheel_path.py
+
+Geometria koła filtrów: pozycje 1..FILTER_COUNT leżą na okręgu, więc
+z pozycji 8 do 1 jest jeden krok, a nie pełny obrót wstecz.
+filter_delta() odpowiada funkcji filterDelta() w stepper.ino;
+plan_visit_order() wybiera kolejność odwiedzania pasm skanu o najmniejszej
+łącznej drodze koła, licząc od bieżącej pozycji; sequence_command() zamienia
+plan na polecenie SEQ sterownika.
+"""
+
+FILTER_COUNT = 8
+
+
+def filter_delta(from_position, to_position, direction=0, filter_count=FILTER_COUNT):
+    """
+    Liczba pozycji do przejścia (ze znakiem: + do przodu, - wstecz).
+    direction = 0 wybiera krótszy kierunek (przy remisie do przodu).
+    """
+    forward = (to_position - from_position) % filter_count
+    if direction > 0:
+        return forward
+    if direction < 0:
+        return forward - filter_count if forward else 0
+    return forward if forward <= filter_count // 2 else forward - filter_count
+
+
+def direction_suffix(delta):
+    """Sufiks polecenia GOTO wymuszający kierunek ruchu ("" gdy brak ruchu)."""
+    if delta > 0:
+        return ":+"
+    if delta < 0:
+        return ":-"
+    return ""
+
+
+def sequence_command(plan, dwell_ms=None):
+    """
+    Polecenie SEQ dla sterownika z planu [(pozycja, delta), ...].
+    Bez dwell_ms sterownik czeka na NEXT po każdym dojściu.
+    """
+    items = ",".join(f"{position}{direction_suffix(delta)[1:]}" for position, delta in plan)
+    dwell = f"@{int(dwell_ms)}" if dwell_ms is not None else ""
+    return f"SEQ:{items}{dwell}\n"
+
+
+def plan_visit_order(positions, start_position=None, filter_count=FILTER_COUNT):
+    """
+    Kolejność odwiedzania `positions` minimalizująca łączną drogę koła.
+
+    Programowanie dynamiczne po podzbiorach (dla 8 pozycji to 2^8 stanów),
+    koszt przejścia = najkrótsza odległość po okręgu; przy równej drodze
+    wygrywa plan z mniejszą liczbą ruchów wstecz. Bez znanej pozycji
+    startowej (None lub 0) skan zaczyna się od pierwszej podanej pozycji.
+    Zwraca (lista (pozycja, delta), łączna liczba pozycji do przejścia).
+    """
+    positions = list(dict.fromkeys(positions))  # Bez duplikatów, kolejność zachowana
+    count = len(positions)
+    if count == 0:
+        return [], 0
+
+    def cost_of(a, b):
+        """(droga, ruchy wstecz) przejścia a -> b."""
+        delta = filter_delta(a, b, 0, filter_count)
+        return (abs(delta), int(delta < 0))
+
+    start = start_position if start_position else positions[0]
+    full = (1 << count) - 1
+    # cost[mask][last] - najmniejsza droga odwiedzająca `mask`, kończąca na `last`
+    infinity = (float("inf"), 0)
+    cost = [[infinity] * count for _ in range(full + 1)]
+    parent = [[-1] * count for _ in range(full + 1)]
+    for i, position in enumerate(positions):
+        cost[1 << i][i] = cost_of(start, position)
+
+    for mask in range(1, full + 1):
+        for last in range(count):
+            current = cost[mask][last]
+            if current == infinity:
+                continue
+            for nxt in range(count):
+                if mask & (1 << nxt):
+                    continue
+                step = cost_of(positions[last], positions[nxt])
+                candidate = (current[0] + step[0], current[1] + step[1])
+                next_mask = mask | (1 << nxt)
+                if candidate < cost[next_mask][nxt]:
+                    cost[next_mask][nxt] = candidate
+                    parent[next_mask][nxt] = last
+
+    last = min(range(count), key=lambda i: cost[full][i])
+    total = cost[full][last][0]
+
+    order = []
+    mask = full
+    while last != -1:
+        order.append(positions[last])
+        previous = parent[mask][last]
+        mask &= ~(1 << last)
+        last = previous
+    order.reverse()
+
+    plan = []
+    current = start
+    for position in order:
+        delta = filter_delta(current, position, 0, filter_count)
+        plan.append((position, delta))
+        current = position
+    return plan, total
@@ -1,67 +1,149 @@
 import time
+import itertools
+import threading
 import numpy as np
 import serial
-import cv2
 
-from PySide6.QtCore import QObject, Signal, Slot, QRunnable, QThread, QTimer
+from burst import BurstRecorder
+from frame_pool import FramePool, FrameMailbox
+from stacking import StackPool
+from telemetry import MoveTelemetry, parse_homing_line
+from PySide6.QtCore import QObject, Signal, Slot
 
 # --- Konfiguracja SDK Thorlabs ---
-try:
-    from windows_setup import configure_path
+# Ładowana przy pierwszym uruchomieniu kamery (w wątku kamery), a nie przy
+# imporcie modułu - konfiguracja DLL i import SDK nie opóźniają startu GUI
+_thorlabs_sdk_class = None
 
-    configure_path()
-except ImportError:
-    pass  # Ignoruj brak pliku, jeśli środowisko jest już skonfigurowane
 
-try:
-    from thorlabs_tsi_sdk.tl_camera import TLCameraSDK
+def load_thorlabs_sdk():
+    """Zwraca klasę TLCameraSDK (import przy pierwszym wywołaniu) lub None, gdy brak SDK."""
+    global _thorlabs_sdk_class
+    if _thorlabs_sdk_class is None:
+        try:
+            from windows_setup import configure_path
+
+            configure_path()
+        except (ImportError, FileNotFoundError):
+            pass  # Ignoruj brak pliku/DLL, jeśli środowisko jest już skonfigurowane
+
+        try:
+            from thorlabs_tsi_sdk.tl_camera import TLCameraSDK
+        except ImportError:
+            print("OSTRZEŻENIE: Nie znaleziono SDK Thorlabs.")
+            return None
+        _thorlabs_sdk_class = TLCameraSDK
+    return _thorlabs_sdk_class
+
+# Wspólny licznik identyfikatorów dla request_capture - wielu odbiorców
+# nasłuchuje frame_captured, każdy obsługuje tylko własne identyfikatory
+_capture_ids = itertools.count(1)
 
-    THORLABS_SDK_AVAILABLE = True
-except ImportError:
-    THORLABS_SDK_AVAILABLE = False
-    print("OSTRZEŻENIE: Nie znaleziono SDK Thorlabs.")
+
+def next_capture_id():
+    return next(_capture_ids)
 
 
 # -----------------------------------------------------------------
 # PRACOWNIK KAMERY (RealCameraService)
-# Działa w dedykowanym wątku QThread
+# Sterowanie w wątku QThread, akwizycja w osobnym wątku blokującym
 # -----------------------------------------------------------------
 
 class RealCameraService(QObject):
     """
     Obsługuje fizyczną kamerę Thorlabs.
-    Działa w pętli nieblokującej, wykorzystując QTimer do pobierania klatek.
+    Klatki pobiera dedykowany wątek akwizycji, który blokuje się w SDK
+    (image_poll_timeout_ms) do czasu pojawienia się klatki - bez aktywnego
+    odpytywania. Ustawienia (ekspozycja, Gain) obsługuje wątek QThread.
+    Parametr sdk_factory pozwala podmienić SDK (np. na SimulatedCameraSDK).
     """
     # Sygnały do komunikacji z GUI
-    new_image = Signal(np.ndarray)
+    # new_image informuje, że w preview_mailbox czeka klatka (emitowany tylko
+    # gdy skrzynka była pusta, więc w kolejce zdarzeń jest najwyżej jeden)
+    new_image = Signal()
+    # frame_captured(id, PooledFrame lub FrameStack) - odpowiedź na request_capture
+    # / request_stack; odbiorca zwalnia klatkę przez release()
+    frame_captured = Signal(int, object)
+    # burst_finished(opis serii) - seria start_burst zapisana (lub przerwana)
+    burst_finished = Signal(dict)
     error = Signal(str)
     status = Signal(str)
     gain_supported = Signal(bool)
+    # Kamera uzbrojona, wątek akwizycji działa; argument: czasy etapów startu [ms]
+    streaming_started = Signal(dict)
 
-    def __init__(self):
+    def __init__(self, sdk_factory=None):
         super().__init__()
+        self.sdk_factory = sdk_factory
         self._is_running = False
         self.sdk = None
         self.camera = None
-        self.timer = None
+        self.acquisition_thread = None
+        self.poll_timeout_ms = 500  # Górna granica czasu reakcji na zatrzymanie
+        self.frame_pool = None
+        # Podgląd i GUI trzymają do 4 klatek, reszta na kolejkę zapisu
+        self.frame_pool_size = 12
+        self.preview_mailbox = FrameMailbox()
+        # Akumulatory uśredniania pasm (jeden zbierany, jeden w kolejce zapisu)
+        self.stack_pool = None
+        self.stack_pool_size = 2
+        # Seria klatek do pliku (BurstRecorder) - zapisuje ją wątek akwizycji
+        self._burst = None
+        self._burst_lock = threading.Lock()
+
+        # Ustawienia faktycznie przyjęte przez kamerę (odczyt zwrotny)
+        self.exposure_us = 0
+        self.gain_db = 0.0
+
+        # Śledzenie zmian ustawień: klatka jest "ustalona", gdy jej naświetlanie
+        # zaczęło się po ostatniej zmianie i nie była w trakcie naświetlania w chwili zmiany.
+        # Blokada obejmuje też zapis właściwości SDK (ekspozycję zmienia również wątek akwizycji)
+        self._settings_lock = threading.Lock()
+        self._settings_changed_at = 0.0
+        self._settled_from_count = 0
+        self._previous_exposure_us = 0
+        self._previous_gain_db = 0.0
+        self._capture_requests = []
+        self.readout_margin_s = 0.002
+
+        # Statystyki akwizycji
+        self.acquired_count = 0
+        self.sdk_dropped_count = 0
+        self._last_frame_count = None
 
     @Slot()
     def start_streaming(self):
         """Inicjalizuje kamerę i rozpoczyna pobieranie klatek."""
-        if not THORLABS_SDK_AVAILABLE:
+        timings = {}
+        phase_start = time.perf_counter()
+
+        def phase_done(name):
+            nonlocal phase_start
+            now = time.perf_counter()
+            timings[name] = round((now - phase_start) * 1000, 1)
+            phase_start = now
+
+        self.status.emit("Kamera: 🟡 Ładowanie SDK...")
+        sdk_factory = self.sdk_factory or load_thorlabs_sdk()
+        if sdk_factory is None:
             self.error.emit("Nie znaleziono bibliotek SDK Thorlabs.")
             return
 
         try:
-            self.sdk = TLCameraSDK()
+            self.sdk = sdk_factory()
+            phase_done("sdk_ms")
+            self.status.emit("Kamera: 🟡 Wyszukiwanie...")
             available_cameras = self.sdk.discover_available_cameras()
+            phase_done("discovery_ms")
 
             if len(available_cameras) < 1:
                 self.error.emit("Nie wykryto żadnej kamery.")
                 return
 
             # Otwarcie pierwszej dostępnej kamery
+            self.status.emit("Kamera: 🟡 Otwieranie...")
             self.camera = self.sdk.open_camera(available_cameras[0])
+            phase_done("open_ms")
             self.status.emit("Kamera: ✅ Połączona")
 
             # Sprawdzenie obsługi wzmocnienia (Gain)
@@ -77,49 +159,312 @@ class RealCameraService(QObject):
             # Konfiguracja początkowa
             try:
                 self.camera.exposure_time_us = 14000
+                self.exposure_us = self.camera.exposure_time_us
             except Exception:
                 pass
 
             self.camera.frames_per_trigger_zero_for_unlimited = 0
-            self.camera.image_poll_timeout_ms = 1000
+            self.camera.image_poll_timeout_ms = self.poll_timeout_ms
             self.camera.arm(2)
+
+            self._last_frame_count = None
+
+            # Wymiary odczytywane raz - pula buforów alokowana przed startem
+            self.frame_pool = FramePool(
+                self.camera.image_width_pixels,
+                self.camera.image_height_pixels,
+                self.frame_pool_size
+            )
+            self.stack_pool = StackPool(
+                self.camera.image_width_pixels,
+                self.camera.image_height_pixels,
+                self.stack_pool_size
+            )
             self.camera.issue_software_trigger()
 
-            # Uruchomienie pętli akwizycji (timer co 0ms = tak szybko jak to możliwe)
-            self.timer = QTimer(self)
-            self.timer.timeout.connect(self._produce_frame)
-            self.timer.start(0)
+            # Uruchomienie wątku akwizycji (czeka w SDK na gotową klatkę)
             self._is_running = True
+            self.acquisition_thread = threading.Thread(
+                target=self._acquisition_loop, name="CameraAcquisition", daemon=True
+            )
+            self.acquisition_thread.start()
+            phase_done("arm_ms")
+            self.streaming_started.emit(timings)
 
         except Exception as e:
             self.error.emit(f"Błąd krytyczny kamery: {e}")
             self.stop_streaming()
 
-    @Slot()
+    def _acquisition_loop(self):
+        """Pętla wątku akwizycji; każde wywołanie SDK blokuje do nadejścia klatki."""
+        while self._is_running:
+            self._produce_frame()
+
     def _produce_frame(self):
-        """Pobiera pojedynczą klatkę z bufora kamery."""
+        """Pobiera pojedynczą klatkę z bufora kamery (czeka maks. poll_timeout_ms)."""
         if not self._is_running:
             return
         try:
             frame = self.camera.get_pending_frame_or_null()
             if frame is not None:
-                # Kopiowanie danych obrazu do tablicy NumPy
-                image_buffer_copy = np.copy(frame.image_buffer)
-                numpy_image_16bit = image_buffer_copy.reshape(
-                    self.camera.image_height_pixels,
-                    self.camera.image_width_pixels
-                )
-                self.new_image.emit(numpy_image_16bit)
+                self._count_frame(frame.frame_count)
+                if self._record_burst(frame):
+                    return  # W trakcie serii klatki trafiają tylko do pliku
+
+                # Jedna kopia danych z SDK do bufora z puli (bez alokacji)
+                pooled = self.frame_pool.acquire()
+                if pooled is None:
+                    return  # Wszystkie bufory zajęte przez odbiorców - klatka pominięta
+                np.copyto(pooled.flat, frame.image_buffer)
+                pooled.frame_count = frame.frame_count
+                self._tag_frame(pooled)
+                self._serve_capture_requests(pooled)
+
+                # Podgląd dostaje tylko najnowszą klatkę
+                if self.preview_mailbox.post(pooled):
+                    self.new_image.emit()
         except Exception as e:
             self.error.emit(f"Błąd akwizycji: {e}")
             self.stop_streaming()
 
+    def _tag_frame(self, pooled):
+        """Oznacza klatkę czasem odbioru i ustawieniami, z którymi była naświetlana."""
+        arrival = time.perf_counter()
+        with self._settings_lock:
+            integration_start = arrival - self.exposure_us / 1e6 - self.readout_margin_s
+            settled = (integration_start >= self._settings_changed_at
+                       and pooled.frame_count >= self._settled_from_count)
+            pooled.timestamp = arrival
+            pooled.settled = settled
+            pooled.exposure_us = self.exposure_us if settled else self._previous_exposure_us
+            pooled.gain_db = self.gain_db if settled else self._previous_gain_db
+
+    def _serve_capture_requests(self, pooled):
+        """Przekazuje klatkę oczekującym żądaniom, jeśli naświetlano ją w całości po żądaniu."""
+        with self._settings_lock:
+            # Akumulatorami zarządza wyłącznie wątek akwizycji - tu zwalniamy anulowane
+            cancelled = [r for r in self._capture_requests if r["cancelled"]]
+            for request in cancelled:
+                self._capture_requests.remove(request)
+            if not pooled.settled or not self._capture_requests:
+                ready = []
+                exposing = []
+            else:
+                integration_start = pooled.timestamp - pooled.exposure_us / 1e6 - self.readout_margin_s
+                ready = [r for r in self._capture_requests
+                         if integration_start >= r["not_before"] and pooled.frame_count >= r["min_frame_count"]]
+                # Żądania w trakcie doboru ekspozycji - klatka służy najpierw do pomiaru
+                exposing = [r for r in ready if r["auto_exposure"] is not None and not r["auto_exposure"].done]
+                ready = [r for r in ready if r not in exposing]
+                for request in ready:
+                    if not request["stacked"]:
+                        self._capture_requests.remove(request)
+        for request in cancelled:
+            if request["stack"] is not None:
+                request["stack"].release()
+        for request in exposing:
+            if self._adjust_exposure(request, pooled):
+                ready.append(request)
+        for request in ready:
+            if not request["stacked"]:
+                self.frame_captured.emit(request["id"], pooled.retain())
+            else:
+                self._accumulate(request, pooled)
+
+    def _adjust_exposure(self, request, pooled):
+        """
+        Iteracja doboru ekspozycji (w wątku akwizycji). Zwraca True, gdy
+        klatka naświetlona jest już ekspozycją docelową i staje się wynikiem żądania.
+        """
+        controller = request["auto_exposure"]
+        exposure_ms = controller.update(pooled.image, pooled.exposure_us / 1000.0)
+        if controller.done:
+            with self._settings_lock:
+                if request["cancelled"]:
+                    return False
+                if not request["stacked"]:
+                    self._capture_requests.remove(request)
+            return True
+        # Kolejna klatka musi być naświetlana w całości nową ekspozycją (_tag_frame);
+        # set_exposure zapisuje do SDK pod _settings_lock, jak zmiany z wątku sterującego
+        self.set_exposure(exposure_ms)
+        return False
+
+    def _accumulate(self, request, pooled):
+        """Dodaje klatkę do akumulatora żądania (w wątku akwizycji, bez alokacji)."""
+        stack = request["stack"]
+        if stack is None:
+            stack = self.stack_pool.acquire(request["frames"], request["sigma_clip"], request["variance"])
+            if stack is None:
+                return  # Oba akumulatory zajęte (zapis w toku) - zaczniemy od kolejnej klatki
+            request["stack"] = stack
+        stack.add(pooled)
+        if not stack.is_complete():
+            return
+        with self._settings_lock:
+            if request["cancelled"]:
+                return  # Akumulator zwolni kolejne wywołanie _serve_capture_requests
+            self._capture_requests.remove(request)
+        self.frame_captured.emit(request["id"], stack.finish())
+
+    def _record_burst(self, frame):
+        """Zapisuje klatkę SDK do trwającej serii. Zwraca False, gdy serii nie ma."""
+        with self._burst_lock:
+            burst = self._burst
+            if burst is None:
+                return False
+            complete = burst.add(frame, time.perf_counter())
+            if complete:
+                self._burst = None
+        if complete:
+            self._finish_burst(burst)
+        return True
+
+    def _finish_burst(self, burst):
+        try:
+            metadata = burst.close()
+        except Exception as e:
+            self.error.emit(f"Błąd zapisu serii: {e}")
+            return
+        summary = {key: value for key, value in metadata.items()
+                   if key not in ("frame_numbers", "timestamps_s", "sensor_timestamps_s")}
+        summary["metadata_file"] = burst.metadata_path
+        self.burst_finished.emit(summary)
+
+    @Slot(str, int)
+    def start_burst(self, file_path, frame_count):
+        """
+        Rozpoczyna serię `frame_count` kolejnych klatek zapisywanych przez wątek
+        akwizycji do wstępnie zaalokowanego pliku .npy (numpy.memmap).
+        Podgląd i request_capture nie dostają klatek do końca serii.
+        """
+        if not self.camera or not self._is_running:
+            self.error.emit("Kamera nie jest gotowa do serii.")
+            return
+        if frame_count < 1:
+            return
+        with self._burst_lock:
+            if self._burst is not None:
+                self.error.emit("Seria klatek już trwa.")
+                return
+        try:
+            burst = BurstRecorder(
+                file_path, frame_count,
+                self.camera.image_height_pixels, self.camera.image_width_pixels
+            )
+        except Exception as e:
+            self.error.emit(f"Nie można utworzyć pliku serii: {e}")
+            return
+        with self._settings_lock:
+            burst.exposure_us = self.exposure_us
+            burst.gain_db = self.gain_db
+        with self._burst_lock:
+            self._burst = burst
+        print(f"[Kamera] Seria {frame_count} klatek -> {file_path}")
+
+    @Slot()
+    def stop_burst(self):
+        """Przerywa serię; zapisane klatki i opis pozostają w pliku."""
+        with self._burst_lock:
+            burst, self._burst = self._burst, None
+        if burst is not None:
+            burst.stopped = True
+            self._finish_burst(burst)
+
+    def _mark_settings_changed(self):
+        """Wywoływane po zmianie ekspozycji/Gain (pod blokadą _settings_lock)."""
+        self._settings_changed_at = time.perf_counter()
+        # Klatka naświetlana w chwili zmiany może mieć mieszane ustawienia - pomijamy ją
+        last = self._last_frame_count or 0
+        self._settled_from_count = last + 2
+
+    @Slot(int)
+    def request_capture(self, request_id):
+        """
+        Zamawia pierwszą klatkę, której naświetlanie zaczęło się po tym wywołaniu
+        (a więc po wcześniej zleconych zmianach ekspozycji/Gain).
+        Odpowiedź przychodzi sygnałem frame_captured(request_id, klatka).
+        """
+        self._add_capture_request(request_id)
+
+    @Slot(int, int, float, bool)
+    def request_stack(self, request_id, frames, sigma_clip=0.0, with_variance=False):
+        """
+        Jak request_capture, ale uśrednia `frames` kolejnych klatek w akumulatorze
+        float32 (opcjonalnie z odrzucaniem sigma_clip i wariancją).
+        Odpowiedź: frame_captured(request_id, FrameStack).
+        """
+        self._add_capture_request(request_id, max(1, frames), sigma_clip, with_variance, stacked=True)
+
+    @Slot(int, object, int, float, bool, bool)
+    def request_auto_exposed(self, request_id, controller, frames=1, sigma_clip=0.0, with_variance=False,
+                             stacked=False):
+        """
+        Jak request_capture/request_stack, ale najpierw dobiera ekspozycję
+        kontrolerem `controller` (exposure.AutoExposure) na kolejnych klatkach.
+        Klatka, na której dobór się zakończył, jest wynikiem (lub pierwszą
+        klatką akumulatora); wynik doboru: controller.summary().
+        """
+        self._add_capture_request(request_id, max(1, frames), sigma_clip, with_variance, stacked, controller)
+
+    def _add_capture_request(self, request_id, frames=1, sigma_clip=0.0, with_variance=False, stacked=False,
+                             auto_exposure=None):
+        with self._settings_lock:
+            last = self._last_frame_count or 0
+            self._capture_requests.append({
+                "id": request_id,
+                "not_before": time.perf_counter(),
+                "min_frame_count": last + 2,
+                "stacked": stacked,
+                "frames": frames,
+                "sigma_clip": sigma_clip,
+                "variance": with_variance,
+                "stack": None,
+                "auto_exposure": auto_exposure,
+                "cancelled": False,
+            })
+
+    @Slot(int)
+    def cancel_capture(self, request_id):
+        with self._settings_lock:
+            for request in self._capture_requests:
+                if request["id"] == request_id:
+                    request["cancelled"] = True
+
+    def _count_frame(self, frame_count):
+        """Zlicza klatki i luki w numeracji SDK (klatki utracone przez kamerę)."""
+        self.acquired_count += 1
+        if self._last_frame_count is not None and frame_count > self._last_frame_count + 1:
+            self.sdk_dropped_count += frame_count - self._last_frame_count - 1
+        self._last_frame_count = frame_count
+
+    def frame_statistics(self):
+        """Liczniki klatek: pozyskane, wyświetlone i pominięte (wg przyczyny)."""
+        pool_dropped = self.frame_pool.exhausted_count if self.frame_pool else 0
+        preview_dropped = self.preview_mailbox.dropped_count
+        return {
+            "acquired": self.acquired_count,
+            "displayed": self.preview_mailbox.taken_count,
+            "dropped_preview": preview_dropped,
+            "dropped_pool": pool_dropped,
+            "dropped_sdk": self.sdk_dropped_count,
+            "dropped": preview_dropped + pool_dropped + self.sdk_dropped_count,
+        }
+
     @Slot(float)
     def set_exposure(self, ms):
-        """Ustawia czas ekspozycji w milisekundach."""
+        """
+        Ustawia czas ekspozycji w milisekundach. Wołane z wątku sterującego
+        i z wątku akwizycji (dobór ekspozycji) - zapis do SDK pod _settings_lock.
+        """
         if self.camera and self._is_running:
             try:
-                self.camera.exposure_time_us = int(ms * 1000)
+                with self._settings_lock:
+                    self.camera.exposure_time_us = int(ms * 1000)
+                    self._previous_exposure_us = self.exposure_us
+                    self._previous_gain_db = self.gain_db
+                    self.exposure_us = self.camera.exposure_time_us
+                    self._mark_settings_changed()
             except Exception as e:
                 print(f"Błąd ustawiania ekspozycji: {e}")
 
@@ -128,9 +473,14 @@ class RealCameraService(QObject):
         """Ustawia wzmocnienie (Gain) w dB, konwertując je na indeks kamery."""
         if self.camera and self._is_running:
             try:
-                raw_index = self.camera.convert_decibels_to_gain(db_value)
-                self.camera.gain = raw_index
-                real_db = self.camera.convert_gain_to_decibels(raw_index)
+                with self._settings_lock:
+                    raw_index = self.camera.convert_decibels_to_gain(db_value)
+                    self.camera.gain = raw_index
+                    real_db = self.camera.convert_gain_to_decibels(raw_index)
+                    self._previous_exposure_us = self.exposure_us
+                    self._previous_gain_db = self.gain_db
+                    self.gain_db = real_db
+                    self._mark_settings_changed()
                 print(f"[Kamera] Gain: {db_value:.2f} dB -> {real_db:.2f} dB")
             except Exception as e:
                 print(f"Błąd ustawiania Gain: {e}")
@@ -139,8 +489,18 @@ class RealCameraService(QObject):
     def stop_streaming(self):
         """Zatrzymuje akwizycję i zwalnia zasoby kamery."""
         self._is_running = False
-        if self.timer:
-            self.timer.stop()
+        thread = self.acquisition_thread
+        if thread and thread is not threading.current_thread():
+            # Wątek zakończy się najpóźniej po jednym poll_timeout_ms
+            thread.join()
+        self.acquisition_thread = None
+        self.stop_burst()
+        self.preview_mailbox.clear()
+        with self._settings_lock:
+            requests, self._capture_requests = self._capture_requests, []
+        for request in requests:
+            if request["stack"] is not None:
+                request["stack"].release()
 
         try:
             if self.camera:
@@ -157,69 +517,383 @@ class RealCameraService(QObject):
 
 
 # -----------------------------------------------------------------
-# PRACOWNIK KOŁA FILTRÓW (RealSerialWorker)
-# Działa jako zadanie w QThreadPool
+# POŁĄCZENIE Z KOŁEM FILTRÓW (FilterWheelConnection)
+# Działa w dedykowanym wątku QThread, port otwierany jest raz
 # -----------------------------------------------------------------
 
-class SerialWorkerSignals(QObject):
-    """Sygnały pomocnicze dla QRunnable."""
-    serial_response = Signal(str)
-    error = Signal(str)
-    finished = Signal()
-    status = Signal(str)
+def parse_move_info(line):
+    """
+    Czas ruchu z linii "INFO: Czas zmiany: <ms> ms[ (juz na miejscu)]".
+    Zwraca słownik {"firmware_ms", "in_place"} lub None dla innych linii.
+    """
+    prefix = "INFO: Czas zmiany:"
+    if not line.startswith(prefix):
+        return None
+    fields = line[len(prefix):].split()
+    try:
+        firmware_ms = int(fields[0])
+    except (IndexError, ValueError):
+        return None
+    return {"firmware_ms": firmware_ms, "in_place": "miejscu" in line}
 
 
-class RealSerialWorker(QRunnable):
+# Port "auto": wyszukanie sterownika na dostępnych portach szeregowych
+AUTO_PORT = "auto"
+# Typowe mostki USB-UART płytek ESP32 (VID): CP210x, CH340, FTDI, natywne USB Espressif
+ESP32_USB_VIDS = (0x10C4, 0x1A86, 0x0403, 0x303A)
+
+
+def candidate_ports():
+    """Porty szeregowe do sprawdzenia - najpierw mostki USB typowe dla ESP32."""
+    from serial.tools import list_ports
+
+    ports = sorted(list_ports.comports(), key=lambda p: (p.vid not in ESP32_USB_VIDS, p.device))
+    return [port.device for port in ports]
+
+
+class FilterWheelConnection(QObject):
     """
-    Obsługuje komunikację z mikrokontrolerem ESP32 przez port szeregowy.
-    Wysyła komendę i oczekuje na odpowiedź.
+    Utrzymuje stałe połączenie z mikrokontrolerem ESP32 przez port szeregowy.
+    Port otwierany jest raz przy starcie aplikacji i współdzielony przez
+    wszystkie polecenia. Gotowość sterownika sprawdzana jest przez
+    handshake (PING -> READY) zamiast stałej pauzy na reset DTR.
+
+    Poza GOTO obsługiwane są sekwencje (SEQ/NEXT/STOP): każde dojście
+    potwierdzane jest linią AT:<n>. Sekwencja z postojem (@ms) odpowiada
+    wieloma liniami AT: w ramach jednego polecenia - każda trafia do
+    serial_response, a całość kończy OK:SEQ:<n>.
+
+    Podsumowanie bazowania po resecie (linia HOMED przed READY)
+    zgłaszane jest po połączeniu przez homing_reported.
+
+    Dla port = "auto" sterownik wyszukiwany jest na kolejnych portach
+    (krótki handshake na każdym) - w wątku połączenia, równolegle ze
+    startem kamery.
     """
-
-    def __init__(self, port, baud, command):
+    serial_response = Signal(str)
+    error = Signal(str)
+    finished = Signal()
+    status = Signal(str)
+    ready = Signal(int)  # Pozycja zgłoszona przez sterownik (0 = nieznana)
+    # Wynik każdego ruchu: position, firmware_ms, host_ms, in_place
+    # (+ profile z telemetrii enkodera, gdy włączona)
+    move_completed = Signal(dict)
+    # Bazowanie sterownika: duration_ms, correction_steps, final_error_counts/deg
+    homing_reported = Signal(dict)
+
+    def __init__(self, port, baud, telemetry_decimation=0):
         super().__init__()
-        self.signals = SerialWorkerSignals()
         self.port = port
         self.baud = baud
-        self.command = command
-        self.timeout_sec = 5
+        self.ser = None
+        self.timeout_sec = 5            # Czas na odpowiedź po poleceniu ruchu
+        self.handshake_timeout_sec = 15  # Homing po resecie może chwilę potrwać
+        self.probe_timeout_sec = 2.0     # Handshake przy wyszukiwaniu portu (port "auto")
+        self.ping_interval_sec = 0.5
+        # Telemetria enkodera: 0 = wyłączona, N = co N-ta próbka korekcji
+        self.telemetry_decimation = telemetry_decimation
+        self.telemetry = MoveTelemetry()
+        self.homing = None               # Ostatnie podsumowanie bazowania (None - starszy firmware)
+
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
 
     @Slot()
-    def run(self):
-        ser = None
+    def open(self):
+        """Otwiera port i czeka na gotowość sterownika."""
         try:
-            # Otwarcie portu
-            ser = serial.Serial(self.port, self.baud, timeout=1)
-
-            # Pauza na reset DTR (można zmniejszyć jeśli ESP32 się nie resetuje)
-            time.sleep(2)
-            ser.flushInput()
-
-            # Wysłanie komendy
-            self.signals.status.emit("Koło: 🟡 Wysyłam polecenie...")
-            ser.write(self.command.encode('utf-8'))
-
-            # Oczekiwanie na odpowiedź
-            response = ""
-            start_time = time.time()
-            while time.time() - start_time < self.timeout_sec:
-                line = ser.readline().decode('utf-8').strip()
-                if not line:
-                    continue
-                # Szukamy potwierdzenia OK lub błędu ERROR
-                if line.startswith("OK:") or line.startswith("ERROR:"):
-                    response = line
+            self._connect()
+            return True
+        except serial.SerialException as e:
+            self.status.emit("Koło: 🔴 Brak połączenia")
+            self.error.emit(f"Błąd portu COM: {e}")
+        except Exception as e:
+            self.status.emit("Koło: 🔴 Brak połączenia")
+            self.error.emit(f"Nieznany błąd: {e}")
+        self._close_port()
+        return False
+
+    def _connect(self):
+        self._close_port()
+        if self.port == AUTO_PORT:
+            position = self._probe_ports()
+        else:
+            self.status.emit("Koło: 🟡 Łączenie...")
+            self._open_port(self.port)
+            position = self._handshake()
+        self._configure_telemetry()
+        self.status.emit("Koło filtrów: ✅ Gotowe")
+        if self.homing is not None:
+            self.homing_reported.emit(dict(self.homing))
+        self.ready.emit(position)
+
+    def _open_port(self, port):
+        ser = serial.Serial()
+        ser.port = port
+        ser.baudrate = self.baud
+        ser.timeout = 0.1
+        # Bez zmiany stanu linii DTR/RTS przy otwarciu ESP32 nie jest resetowany
+        ser.dtr = False
+        ser.rts = False
+        ser.open()
+        self.ser = ser
+
+    def _probe_ports(self):
+        """Szuka sterownika (odpowiedź na PING) na kolejnych portach; zwraca pozycję."""
+        for port in candidate_ports():
+            self.status.emit(f"Koło: 🟡 Sprawdzanie {port}...")
+            try:
+                self._open_port(port)
+                position = self._handshake(self.probe_timeout_sec)
+            except (serial.SerialException, OSError):
+                self._close_port()
+                continue
+            print(f"Sterownik koła znaleziony na {port}")
+            self.port = port
+            return position
+        raise serial.SerialException("Nie znaleziono sterownika koła na żadnym porcie")
+
+    def _handshake(self, timeout_sec=None):
+        """Wysyła PING do skutku i zwraca pozycję z odpowiedzi READY:n."""
+        self.ser.reset_input_buffer()
+        deadline = time.monotonic() + (timeout_sec or self.handshake_timeout_sec)
+        next_ping = 0.0
+        while time.monotonic() < deadline:
+            now = time.monotonic()
+            if now >= next_ping:
+                self.ser.write(b"PING\n")
+                next_ping = now + self.ping_interval_sec
+
+            line = self._read_line()
+            homing = parse_homing_line(line)
+            if homing is not None:
+                self.homing = homing  # Poprzedza READY:n
+                continue
+            if line.startswith("READY"):
+                try:
+                    return int(line.split(":")[-1])
+                except ValueError:
+                    return 0
+            if line.startswith("ERROR: Unknown command"):
+                # Starszy firmware bez PING - odpowiada, więc jest gotowy
+                return 0
+
+        raise serial.SerialException(f"Brak odpowiedzi sterownika na {self.port}")
+
+    def _configure_telemetry(self):
+        """Ustawia tryb telemetrii sterownika (starszy firmware odpowiada błędem - pomijamy)."""
+        mode = str(self.telemetry_decimation) if self.telemetry_decimation > 0 else "OFF"
+        self.ser.write(f"TELEM:{mode}\n".encode('utf-8'))
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            line = self._read_line()
+            if line.startswith("OK:TELEM"):
+                return
+            if line.startswith("ERROR:"):
+                if self.telemetry_decimation > 0:
+                    print(f"[Koło] Telemetria niedostępna: {line}")
+                return
+
+    def _read_line(self):
+        return self.ser.readline().decode('utf-8', errors='replace').strip()
+
+    @Slot(str)
+    def send_command(self, command):
+        """Wysyła polecenie i czeka na OK/ERROR. Przy błędzie portu łączy ponownie."""
+        try:
+            response = None
+            for attempt in range(2):
+                try:
+                    if not self.is_open():
+                        self._connect()
+                    response = self._transact(command)
                     break
+                except serial.SerialException as e:
+                    print(f"[Koło] Błąd portu ({e}), ponowne łączenie...")
+                    self._close_port()
+                    if attempt == 1:
+                        raise
 
             if response:
-                self.signals.serial_response.emit(response)
+                self.serial_response.emit(response)
             else:
-                self.signals.error.emit(f"Błąd koła: Brak odpowiedzi z {self.port}")
+                self.error.emit(f"Błąd koła: Brak odpowiedzi z {self.port}")
 
         except serial.SerialException as e:
-            self.signals.error.emit(f"Błąd portu COM: {e}")
+            self.error.emit(f"Błąd portu COM: {e}")
+        except Exception as e:
+            self.error.emit(f"Nieznany błąd: {e}")
+        finally:
+            self.finished.emit()
+
+    def _transact(self, command):
+        # Odrzucenie zaległych komunikatów diagnostycznych
+        self.ser.reset_input_buffer()
+
+        self.status.emit("Koło: 🟡 Wysyłam polecenie...")
+        self.ser.write(command.encode('utf-8'))
+
+        # Sekwencja bez postoju i NEXT kończą się na pierwszym dojściu (AT:)
+        name, _, arguments = command.strip().partition(":")
+        dwell_sec = 0.0
+        stop_at_arrival = name == "NEXT" or (name == "SEQ" and "@" not in arguments)
+        if name == "SEQ" and "@" in arguments:
+            try:
+                dwell_sec = int(arguments.rpartition("@")[2]) / 1000.0
+            except ValueError:
+                pass
+
+        move_start = time.monotonic()
+        deadline = move_start + self.timeout_sec
+        move_info = None
+        self.telemetry.reset()
+        while time.monotonic() < deadline:
+            line = self._read_line()
+            if not line:
+                continue
+            if self.telemetry.feed(line):
+                continue
+            if line.startswith("INFO:"):
+                move_info = parse_move_info(line) or move_info
+                continue
+            if line.startswith("ERROR:"):
+                return line
+            if line.startswith("AT:") or line.startswith("OK:"):
+                now = time.monotonic()
+                if move_info is not None:
+                    self._report_move(line, move_info, now - move_start)
+                    move_info = None
+                if line.startswith("OK:") or stop_at_arrival:
+                    return line
+                # Dojście w sekwencji z postojem - czekamy na kolejne ruchy
+                self.serial_response.emit(line)
+                move_start = now + dwell_sec
+                deadline = move_start + self.timeout_sec
+        return ""
+
+    def _report_move(self, line, move_info, host_sec):
+        try:
+            position = int(line.split(":")[-1])
+        except ValueError:
+            position = 0
+        result = dict(move_info, position=position, host_ms=round(host_sec * 1000, 1))
+        profile = self.telemetry.finish_move(position)
+        if profile is not None:
+            result["profile"] = profile
+        self.move_completed.emit(result)
+
+    @Slot()
+    def close(self):
+        self._close_port()
+        self.status.emit("Koło: 🔴 Rozłączone")
+
+    def _close_port(self):
+        try:
+            if self.ser and self.ser.is_open:
+                self.ser.close()
         except Exception as e:
-            self.signals.error.emit(f"Nieznany błąd: {e}")
+            print(f"Błąd zamykania portu: {e}")
         finally:
-            if ser and ser.is_open:
-                ser.close()
-            self.signals.finished.emit()
\ No newline at end of file
+            self.ser = None
+
+
+# -----------------------------------------------------------------
+# KOLEJKA POLECEŃ KOŁA FILTRÓW (wątek GUI)
+# -----------------------------------------------------------------
+
+class WheelCommandQueue(QObject):
+    """
+    Przyjmuje zlecenia ruchu także w trakcie jazdy koła. W locie jest
+    najwyżej jeden ruch, a kolejny cel jest tylko jeden: nowe zlecenie
+    zastępuje oczekujące (pięć kliknięć "Następny" to jeden ruch do
+    pozycji końcowej). Następny/Poprzedni liczone są względem ostatniego
+    zleconego celu, nie bieżącej pozycji. target_reached informuje
+    o osiągnięciu celu końcowego, gdy nic już nie czeka.
+    """
+    command_requested = Signal(str)
+    target_reached = Signal(int)
+    queue_changed = Signal(int, int)  # (cel w ruchu, cel oczekujący); 0 = brak
+
+    def __init__(self, filter_count=8):
+        super().__init__()
+        self.filter_count = filter_count
+        self.position = 0          # Ostatnia potwierdzona pozycja (0 = nieznana)
+        self.in_flight = None      # Cel wysłanego polecenia
+        self.pending = None        # Cel oczekujący (po scaleniu)
+        self.coalesced_count = 0   # Zlecenia zastąpione przed wysłaniem
+        self._failed = False
+
+    def is_busy(self):
+        return self.in_flight is not None
+
+    def latest_target(self):
+        """Cel, do którego koło ostatecznie dojedzie po obecnych zleceniach."""
+        if self.pending is not None:
+            return self.pending
+        if self.in_flight is not None:
+            return self.in_flight
+        return self.position
+
+    @Slot(int)
+    def set_position(self, position):
+        """Pozycja zgłoszona przez sterownik poza kolejką (np. READY po połączeniu)."""
+        if position >= 1 and self.in_flight is None:
+            self.position = position
+
+    @Slot(int)
+    def request_target(self, position):
+        if self.in_flight is None:
+            self._send(position)
+            return
+        if self.pending is not None:
+            self.coalesced_count += 1
+        # Powrót do celu już w ruchu nie wymaga osobnego polecenia
+        self.pending = None if position == self.in_flight else position
+        self.queue_changed.emit(self.in_flight, self.pending or 0)
+
+    @Slot(int)
+    def request_step(self, step):
+        """Ruch o `step` pozycji po obwodzie względem ostatniego celu."""
+        base = self.latest_target()
+        if base < 1:
+            self.request_target(1)
+            return
+        self.request_target((base - 1 + step) % self.filter_count + 1)
+
+    def _send(self, position):
+        self.in_flight = position
+        self.queue_changed.emit(position, 0)
+        self.command_requested.emit(f"GOTO:{position}\n")
+
+    @Slot(str)
+    def on_response(self, response):
+        if response.startswith("OK:") or response.startswith("AT:"):
+            try:
+                self.position = int(response.split(":")[-1])
+            except ValueError:
+                pass
+        elif response.startswith("ERROR:") and self.in_flight is not None:
+            # Po błędzie nie kontynuujemy zaległych zleceń
+            self.pending = None
+            self._failed = True
+
+    @Slot(str)
+    def on_error(self, message):
+        if self.in_flight is not None:
+            self.pending = None
+            self._failed = True
+
+    @Slot()
+    def on_finished(self):
+        """Koniec polecenia w wątku połączenia - wysyła oczekujący cel albo zgłasza dojazd."""
+        if self.in_flight is None:
+            return  # Polecenie spoza kolejki (np. skan)
+        self.in_flight = None
+        target, self.pending = self.pending, None
+        failed, self._failed = self._failed, False
+        if target is not None and target != self.position:
+            self._send(target)
+            return
+        self.queue_changed.emit(0, 0)
+        if not failed:
+            self.target_reached.emit(self.position)